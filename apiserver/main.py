@@ -1,5 +1,7 @@
 import os
 import heapq
+import threading
+import time
 import uuid
 
 from flask import Flask, render_template, jsonify, request, abort, Response
@@ -8,7 +10,7 @@ from flask_cors import CORS
 from psycopg2.extras import RealDictCursor, register_uuid
 from psycopg2.pool import ThreadedConnectionPool
 import requests
-from datasketch import LeanMinHash
+import numpy as np
 
 import settings
 
@@ -17,6 +19,45 @@ import settings
 app = Flask(__name__)
 
 
+class LatencyHistogram(object):
+    """A latency histogram of the API server in the Prometheus text format,
+    kept here as the API server is deployed without the findopendata
+    package."""
+
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+            10.0, float("inf"))
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self._counts[i] += 1
+            self._sum += seconds
+
+    def to_prometheus(self):
+        with self._lock:
+            lines = ["# HELP {} {}".format(self.name, self.description),
+                    "# TYPE {} histogram".format(self.name)]
+            for bound, count in zip(self.buckets, self._counts):
+                lines.append('{}_bucket{{le="{}"}} {}'.format(self.name,
+                    "+Inf" if bound == float("inf") else repr(bound),
+                    count))
+            lines.append("{}_sum {}".format(self.name, repr(self._sum)))
+            lines.append("{}_count {}".format(self.name, self._counts[-1]))
+        return "\n".join(lines) + "\n"
+
+
+lshserver_latency = LatencyHistogram("lshserver_request_seconds",
+        "The latency of LSH Server queries in seconds.")
+
+
 # When deployed to App Engine,
 # the `GAE_ENV` environment variable will be set.
 if os.environ.get('GAE_SERVICE') == 'apiserver':
@@ -213,6 +254,7 @@ def _execute_get_column_sketches(cur, ids, original_hosts=[]):
                 c.id as id,
                 c.seed,
                 c.minhash,
+                c.minhash_bits,
                 c.column_name,
                 c.sample,
                 c.distinct_count,
@@ -268,6 +310,12 @@ with cnx.cursor(cursor_factory=RealDictCursor) as cursor:
 cnxpool.putconn(cnx)
 
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return Response(lshserver_latency.to_prometheus(),
+            mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/api/original-hosts', methods=['GET'])
 def original_hosts():
     return jsonify(_original_hosts)
@@ -405,6 +453,36 @@ def package_file(file_id):
     return jsonify(package_file=package_file, package=package)
 
 
+# The little-endian types of the MinHash hash values saved in the
+# column_sketches table by the number of bits kept of each value, see
+# findopendata.sketch_encoding.
+_minhash_dtypes = {8: "<u1", 16: "<u2", 32: "<u4"}
+
+
+def _decode_minhash(column):
+    # Read the hash values from the bytea without copying.
+    return np.frombuffer(column["minhash"],
+            dtype=_minhash_dtypes[column["minhash_bits"]])
+
+
+def _is_comparable(query, column):
+    # MinHash created with different parameters cannot be compared, e.g.,
+    # during a migration to b-bit MinHash.
+    return query["seed"] == column["seed"] and \
+            query["minhash_bits"] == column["minhash_bits"] and \
+            len(query["minhash"]) == len(column["minhash"])
+
+
+def _jaccard(query, column):
+    matches = np.count_nonzero(query["minhash"] == column["minhash"]) / \
+            float(len(query["minhash"]))
+    if query["minhash_bits"] >= 32:
+        return matches
+    # Correct for the different hash values with the same lowest bits.
+    collision = 1.0 / (1 << query["minhash_bits"])
+    return max((matches - collision) / (1.0 - collision), 0.0)
+
+
 def _containment(jaccard, x, q):
     if jaccard == 1.0:
         return 1.0
@@ -430,10 +508,15 @@ def joinable_column_search():
         # The query does not exist.
         cnxpool.putconn(cnx)
         abort(404)
+    query["minhash"] = _decode_minhash(query)
     # Query the LSH Server.
+    start = time.perf_counter()
     try:
         resp = requests.post(lshserver_endpoint+"/query",
-                json={"seed": query["seed"], "minhash": query["minhash"]})
+                json={"seed": query["seed"],
+                    "minhash_bits": query["minhash_bits"],
+                    "minhash": query["minhash"].tolist()})
+        lshserver_latency.observe(time.perf_counter() - start)
         resp.raise_for_status()
     except requests.exceptions.HTTPError as err:
         app.logger.error("Error in querying the LSH server: {}".format(err))
@@ -447,7 +530,6 @@ def joinable_column_search():
         return jsonify([])
     # Create the final query results.
     results = []
-    query_minhash = LeanMinHash(seed=query["seed"], hashvalues=query["minhash"])
     # Obtain the column sketches of the results.
     with cnx.cursor(cursor_factory=RealDictCursor) as cursor:
         _execute_get_column_sketches(cursor, tuple(column_ids),
@@ -457,12 +539,15 @@ def joinable_column_search():
             if column["package_file_id"] == query["package_file_id"]:
                 continue
             # Compute the similarities for each column in the result.
-            jaccard = query_minhash.jaccard(LeanMinHash(
-                    seed=column["seed"], hashvalues=column["minhash"]))
+            column["minhash"] = _decode_minhash(column)
+            if not _is_comparable(query, column):
+                continue
+            jaccard = _jaccard(query, column)
             containment = _containment(jaccard, column["distinct_count"],
                     query["distinct_count"])
             column.pop("seed")
             column.pop("minhash")
+            column.pop("minhash_bits")
             column["jaccard"] = jaccard
             column["containment"] = containment
             if len(results) < limit:
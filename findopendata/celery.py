@@ -1,8 +1,15 @@
 import os
+import time
 
 from celery import Celery
+from celery.signals import task_postrun, worker_process_init
+from celery.utils.log import get_logger
 
-from .settings import celery_configs
+from .settings import celery_configs, crawler_configs, db_configs, \
+        db_pool_configs
+from .metrics import registry
+from .sessions import sessions
+from .db import pool
 
 
 app = Celery("findopendata",
@@ -16,5 +23,43 @@ app = Celery("findopendata",
 app.conf.task_default_queue = celery_configs.get("queue")
 
 
+logger = get_logger(__name__)
+
+# The connections are opened on first use, so the tasks called outside of
+# worker processes can also use the pool.
+pool.configure(db_configs=db_configs, **db_pool_configs)
+
+_metrics_log_interval = celery_configs.get("metrics_log_interval")
+_metrics_last_logged = [0.0]
+
+
+@worker_process_init.connect
+def _init_sessions(**kwargs):
+    """Create new HTTP sessions with the configured pool sizes and retries
+    in every worker process, instead of sharing the parent's connections."""
+    sessions.configure(**(crawler_configs.get("http_sessions") or {}))
+
+
+@worker_process_init.connect
+def _init_db_pool(**kwargs):
+    """Create a new Postgres connection pool in every worker process,
+    instead of sharing the parent's connections."""
+    pool.configure(db_configs=db_configs, **db_pool_configs)
+
+
+@task_postrun.connect
+def _log_metrics(**kwargs):
+    """Log the metrics of this worker process after a task finishes,
+    at most once every metrics_log_interval seconds."""
+    if not _metrics_log_interval:
+        return
+    now = time.monotonic()
+    if now - _metrics_last_logged[0] < float(_metrics_log_interval):
+        return
+    _metrics_last_logged[0] = now
+    for line in registry.log_lines():
+        logger.info("(pid={}) {}".format(os.getpid(), line))
+
+
 if __name__ == "__main__":
     app.start()
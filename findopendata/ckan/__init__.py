@@ -1,26 +1,28 @@
 import time
+import collections
+import concurrent.futures
 
-import requests
 import dateutil.parser
 import dateutil.tz
 
+from ..sessions import get_session
 
-def read_api(api_url, start=0, page_size=50, retries=3,
-        wait_between_retries=5):
-    """Scrolls through the CKAN package_search API to obtain packages.
 
-    Args:
-        api_url: the CKAN API endpoint URL (i.e., https://data.gov.uk).
-        start: the starting record index.
-        page_size: the number of records per each request.
-        retries: the number of retries when an error is encountered.
-        wait_between_retries: the seconds to wait between retries.
-    """
-    url = api_url.rstrip("/") + "/api/3/action/package_search"
-    sess = requests.session()
+def format_solr_timestamp(timestamp):
+    """Format the timestamp as a Solr date in UTC, e.g.,
+    2019-08-01T12:00:00.000Z. A timestamp without tzinfo is taken as UTC."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(dateutil.tz.tzutc())
+    return "{}.{:03d}Z".format(timestamp.strftime("%Y-%m-%dT%H:%M:%S"),
+            timestamp.microsecond // 1000)
+
+
+def _read_page(sess, url, params, start, page_size, retries,
+        wait_between_retries):
+    # Get the packages and the total count of the page at start.
+    params = dict(params, start=start, rows=page_size)
     while True:
-        resp = sess.get(url, params={"start" : start,
-                                     "rows"  : page_size})
+        resp = sess.get(url, params=params)
         try:
             resp.raise_for_status()
         except Exception as e:
@@ -29,12 +31,71 @@ def read_api(api_url, start=0, page_size=50, retries=3,
             retries -= 1
             time.sleep(wait_between_retries)
             continue
-        results = resp.json()["result"]["results"]
-        if len(results) == 0:
-            break
-        for package in results:
-            yield package
-        start += page_size
+        result = resp.json()["result"]
+        return result["results"], result.get("count")
+
+
+def read_api(api_url, start=0, page_size=50, retries=3,
+        wait_between_retries=5, modified_since=None, prefetch=1):
+    """Scrolls through the CKAN package_search API to obtain packages.
+    Up to prefetch pages are requested concurrently ahead of the page being
+    consumed, and the packages are yielded in order.
+
+    Args:
+        api_url: the CKAN API endpoint URL (i.e., https://data.gov.uk).
+        start: the starting record index.
+        page_size: the number of records per each request.
+        retries: the number of retries of each page when an error is
+            encountered.
+        wait_between_retries: the seconds to wait between retries.
+        modified_since: if given, only the packages with metadata_modified
+            at or after this timestamp are read, in ascending order of
+            metadata_modified.
+        prefetch: the number of page requests in flight.
+    """
+    url = api_url.rstrip("/") + "/api/3/action/package_search"
+    params = {}
+    if modified_since is not None:
+        params["fq"] = "metadata_modified:[{} TO *]".format(
+                format_solr_timestamp(modified_since))
+        params["sort"] = "metadata_modified asc"
+    sess = get_session(url)
+    executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(prefetch, 1))
+    pending = collections.deque()
+    # The start of the next page to request, and the total count of
+    # packages once known.
+    state = {"start": start, "count": None}
+
+    def _submit():
+        # Request at most one page past the count, which is empty unless
+        # packages were added while reading.
+        if state["count"] is not None and \
+                state["start"] > state["count"] + page_size:
+            return
+        pending.append(executor.submit(_read_page, sess, url, params,
+            state["start"], page_size, retries, wait_between_retries))
+        state["start"] += page_size
+
+    try:
+        for _ in range(max(prefetch, 1)):
+            _submit()
+        while pending:
+            results, count = pending.popleft().result()
+            if count is not None:
+                state["count"] = count
+            # The first empty page ends the results, the pages requested
+            # after it are discarded.
+            if len(results) == 0:
+                break
+            _submit()
+            for package in results:
+                yield package
+    finally:
+        # Cancel the pages not yet requested and wait for those in flight.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
 
 
 def parse_timestamp(timestamp_str):
@@ -1,19 +1,28 @@
 import os
 import time
+import datetime
 
 import requests
 import urllib3
-import psycopg2
 from psycopg2.extras import Json, RealDictCursor
+from celery.exceptions import Retry
 from celery.utils.log import get_task_logger
 
 from .celery import app
 from .ckan import read_api, extract_timestamp_from_package, \
-    extract_timestamp_from_resource
+    extract_timestamp_from_resource, parse_timestamp
 from .storage.objects import storage
-from .download import download_to_local
+from .db import get_connection
+from .download import download_to_local, download_to_storage, NotModified
+from .http_validators import get_validators, save_validators, \
+        is_unchanged, get_content_fingerprint
+from .host_limiter import host_limiter
+from .scheduler import host_slot, get_host
+from .ingest import StreamSketcher
+from .indexing import get_sketcher, get_sketch_params, \
+        get_sketch_memory_limits
 from .util import temporary_directory, get_safe_filename
-from .settings import crawler_configs, db_configs, gcp_configs
+from .settings import crawler_configs, gcp_configs, index_configs
 from .parsers.csv import csv2json
 from .parsers.avro import JSON2AvroRecords
 
@@ -26,48 +35,43 @@ accepted_resource_formats = ["csv",]
 
 
 @app.task(ignore_result=True)
-def add_ckan_package(package, endpoint, blob_prefix):
+def add_ckan_package(package_blob_name, endpoint, blob_prefix):
     """Registers the CKAN package and starts tasks for retrieving and adding
     associated resources (i.e. files).
 
     Args:
-        package: the CKAN package JSON.
+        package_blob_name: the blob name of the CKAN package JSON saved by
+            add_ckan_packages_from_api.
         endpoint: the CKAN endpoint (i.e., data.gov.uk) without http://.
         blob_prefix: the prefix for all the blobs uploaded from this
             function, relative to the root.
     """
+    package = storage.get_object(package_blob_name)
     package_id = package["id"]
 
-    # Upload the package JSON.
-    package_blob = storage.put_object(package,
-            os.path.join(blob_prefix, endpoint, package_id, "package.json"))
-    logger.info("(endpoint={} package={}) Saved package JSON.".format(endpoint,
-        package_id))
-
-    # Initialize Postgres connection.
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-
-    # Register the package.
-    cur.execute("INSERT INTO findopendata.ckan_packages "
-            "(endpoint, package_id, package_blob) "
-            "VALUES (%s, %s, %s) "
-            "ON CONFLICT (endpoint, package_id) DO UPDATE "
-            "SET updated = current_timestamp, "
-            "package_blob = EXCLUDED.package_blob RETURNING key;",
-            (endpoint, package_id, package_blob.name))
-    row = cur.fetchone()
-    if row is None:
-        raise RuntimeError("(endpoint={} package={}) Failed to fetch key".format(
+    # Get a Postgres connection from the pool.
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Register the package.
+        cur.execute("INSERT INTO findopendata.ckan_packages "
+                "(endpoint, package_id, package_blob) "
+                "VALUES (%s, %s, %s) "
+                "ON CONFLICT (endpoint, package_id) DO UPDATE "
+                "SET updated = current_timestamp, "
+                "package_blob = EXCLUDED.package_blob RETURNING key;",
+                (endpoint, package_id, package_blob_name))
+        row = cur.fetchone()
+        if row is None:
+            raise RuntimeError("(endpoint={} package={}) Failed to fetch "
+                    "key".format(endpoint, package_id))
+        package_key = row[0]
+        logger.info("(endpoint={} package={}) Registered package.".format(
             endpoint, package_id))
-    package_key = row[0]
-    logger.info("(endpoint={} package={}) Registered package.".format(endpoint,
-        package_id))
 
-    # Commit and close database connection.
-    conn.commit()
-    cur.close()
-    conn.close()
+        # Commit and close the cursor.
+        conn.commit()
+        cur.close()
 
     # Skip processing resources if none exists.
     if "resources" not in package:
@@ -80,8 +84,18 @@ def add_ckan_package(package, endpoint, blob_prefix):
                 not in accepted_resource_formats:
             add_ckan_resource_no_download(package_key=package_key,
                     resource=resource)
+        elif resource.get("id") is None:
+            logger.warning("(endpoint={} package={}) no resource id "
+                    "found.".format(endpoint, package_id))
         else:
-            add_ckan_resource.delay(package_key=package_key, resource=resource,
+            # Stage the resource JSON rather than passing it through the
+            # broker, the task reads the resource from the staged blob.
+            resource_blob = storage.put_object(resource, "/".join([
+                crawler_configs.get("staging_blob_prefix", "staging"),
+                blob_prefix, endpoint, package_id,
+                resource["id"] + ".json"]))
+            add_ckan_resource.delay(package_key=package_key,
+                    resource_blob_name=resource_blob.name,
                     package_path=resource_blob_prefix)
 
 
@@ -106,92 +120,312 @@ def add_ckan_resource_no_download(package_key, resource):
         return
     filename = None
 
-    # Initialize Postgres connection
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-
-    # Save this resource.
-    cur.execute("INSERT INTO findopendata.ckan_resources "
-            "(package_key, resource_id, filename, original_url, raw_metadata) "
-            "VALUES (%s, %s, %s, %s, %s) "
-            "ON CONFLICT (package_key, resource_id) "
-            "DO UPDATE "
-            "SET updated = current_timestamp, "
-            "filename = EXCLUDED.filename, "
-            "original_url = EXCLUDED.original_url, "
-            "raw_metadata = EXCLUDED.raw_metadata;",
-            (package_key, resource_id, filename, original_url, Json(resource)))
-    
-    # Save and close database connection
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Get a Postgres connection from the pool.
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Save this resource.
+        cur.execute("INSERT INTO findopendata.ckan_resources "
+                "(package_key, resource_id, filename, original_url, "
+                "raw_metadata) "
+                "VALUES (%s, %s, %s, %s, %s) "
+                "ON CONFLICT (package_key, resource_id) "
+                "DO UPDATE "
+                "SET updated = current_timestamp, "
+                "filename = EXCLUDED.filename, "
+                "original_url = EXCLUDED.original_url, "
+                "raw_metadata = EXCLUDED.raw_metadata;",
+                (package_key, resource_id, filename, original_url,
+                    Json(resource)))
+
+        # Save and close the cursor.
+        conn.commit()
+        cur.close()
 
     # Done
     logger.info("(package={}, resource={}, filename={}) Registered "
             "resource.".format(package_key, resource_id, filename))
 
 
-@app.task(ignore_result=True)
-def add_ckan_resource(package_key, resource, package_path):
+@app.task(bind=True, ignore_result=True)
+def add_ckan_resource(self, package_key, resource_blob_name, package_path):
     """Retrieves and adds CKAN resource files for the given resource.
+    The task is deferred if the host of the resource is at its limits.
 
     Args:
         package_key: the key of the package associated with the resource.
-        resource: the portion of the JSON data in the CKAN package
-            corresponds to the resource.
+        resource_blob_name: the blob name of the JSON of the resource in
+            the CKAN package, staged by add_ckan_package.
         package_path: the blob path to the directory corresponding
             to the package associated with the resource.
     """
-    resource_id = resource.get("id", None)
-    if resource_id is None:
-        raise ValueError("(package={}) no resource id found.".format(
-            package_key))
+    deferred = False
+    try:
+        resource = storage.get_object(resource_blob_name)
+        _add_ckan_resource(self, package_key, resource, package_path)
+    except Retry:
+        # The retried task reads the staged resource again.
+        deferred = True
+        raise
+    finally:
+        if not deferred:
+            _delete_staged_blob(resource_blob_name)
+
+
+def _add_ckan_resource(task, package_key, resource, package_path):
+    resource_id = resource["id"]
     original_url = resource.get("url", None)
     if original_url is None:
         logger.warning("(package={}, resource={}) no url found".format(
             package_key, resource_id))
         return
 
-    # Initialize Postgres connection for checking resource.
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-
-    # Check if the same version of this resource has been processed.
-    cur.execute("SELECT updated::timestamptz FROM findopendata.ckan_resources "
-            "WHERE package_key = %s AND resource_id = %s;",
-            (package_key, resource_id))
-    row = cur.fetchone()
-    if row is not None:
-        last_registered = row[0]
-        last_updated = extract_timestamp_from_resource(resource)
-        if last_updated is not None and last_updated <= last_registered:
-            logger.info("(package={}, resource={}) Skipping (updated: {} "
-                    "registered: {})".format(package_key, resource_id,
-                        last_updated, last_registered))
-            return
-
-    # Close database connection for checking resource.
-    cur.close()
-    conn.close()
+    # Get a Postgres connection for checking resource.
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Check if the same version of this resource has been processed.
+        cur.execute("SELECT updated::timestamptz "
+                "FROM findopendata.ckan_resources "
+                "WHERE package_key = %s AND resource_id = %s;",
+                (package_key, resource_id))
+        row = cur.fetchone()
+        validators = None
+        if row is not None:
+            last_registered = row[0]
+            last_updated = extract_timestamp_from_resource(resource)
+            if last_updated is not None and last_updated <= last_registered:
+                logger.info("(package={}, resource={}) Skipping (updated: {} "
+                        "registered: {})".format(package_key, resource_id,
+                            last_updated, last_registered))
+                return
+            # Get the validators of the last download for a conditional
+            # request, as the metadata timestamps are often missing or wrong.
+            validators = get_validators(cur, original_url)
+
+        # Return the connection before the download.
+        cur.close()
 
     # Download and upload the resource.
     logger.info("(package={} resource={}) Saving resource from {}".format(
         package_key, resource_id, original_url))
+    blob_dir = os.path.join(package_path, resource_id)
+    # Sketch the resource in the same pass if its format is supported.
+    dataset_format = str(resource.get("format", "")).strip().lower()
+    if not crawler_configs.get("sketch_on_ingest", False) or \
+            dataset_format not in accepted_resource_formats:
+        dataset_format = None
+    try:
+        with host_slot(host_limiter, task, original_url,
+                crawler_configs.get("host_max_deferrals", 100)):
+            if crawler_configs.get("stream_to_storage", False):
+                saved = _stream_resource_to_storage(package_key, resource_id,
+                        original_url, blob_dir, dataset_format, validators)
+            else:
+                saved = _save_resource_via_local(package_key, resource_id,
+                        original_url, blob_dir, dataset_format, validators)
+    except NotModified:
+        _refresh_resource(package_key, resource_id, resource)
+        logger.info("(package={}, resource={}) Skipping (not modified since "
+                "last download)".format(package_key, resource_id))
+        return
+    if saved is None:
+        return
+    filename, resource_blob, table_sketch, new_validators = saved
+    if is_unchanged(validators, new_validators):
+        # The registered resource blob and its sketches are still valid.
+        _refresh_resource(package_key, resource_id, resource, new_validators)
+        logger.info("(package={}, resource={}) Skipping (same content as "
+                "last download)".format(package_key, resource_id))
+        return
+    logger.info("(package={} resource={} filename={}) Saved resource "
+            "from {} to {}".format(package_key, resource_id, filename,
+                original_url, resource_blob.name))
+
+    # Save the sketch state next to the resource, it is loaded into the
+    # sketch tables when the resource is indexed.
+    sketch_blob_name = None
+    if table_sketch is not None:
+        sketch_blob_name = resource_blob.name + ".sketch.json"
+        # Keep the parameters with the state, they are saved with the
+        # sketches when the resource is indexed.
+        state = table_sketch.get_state()
+        state["sketch_params"] = get_sketch_params(index_configs)
+        try:
+            storage.put_object(state, sketch_blob_name)
+        except Exception as e:
+            logger.warning("(package={} resource={}) Failed to save sketch "
+                    "to {}: {}".format(package_key, resource_id,
+                        sketch_blob_name, e))
+            sketch_blob_name = None
+
+    # Get a Postgres connection for registering resource.
+    # The connection is taken after the download to prevent the download
+    # from hogging the connection pool.
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Register this resource.
+        cur.execute("INSERT INTO findopendata.ckan_resources "
+                "(package_key, resource_id, filename, resource_blob, "
+                "original_url, file_size, raw_metadata, sketch_blob, "
+                "content_fingerprint) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (package_key, resource_id) "
+                "DO UPDATE "
+                "SET updated = current_timestamp, "
+                "resource_blob = EXCLUDED.resource_blob, "
+                "original_url = EXCLUDED.original_url, "
+                "file_size = EXCLUDED.file_size, "
+                "raw_metadata = EXCLUDED.raw_metadata, "
+                "sketch_blob = EXCLUDED.sketch_blob, "
+                "content_fingerprint = EXCLUDED.content_fingerprint;",
+                (package_key, resource_id, filename,
+                    resource_blob.name, original_url,
+                    resource_blob.size, Json(resource), sketch_blob_name,
+                    get_content_fingerprint(new_validators)))
+        save_validators(cur, original_url, new_validators)
+        conn.commit()
+
+        cur.close()
+
+    logger.info("(package={}, resource={}, filename={}) Registered "
+            "resource.".format(package_key, resource_id, filename))
+
+
+def _refresh_resource(package_key, resource_id, resource, validators=None):
+    """Update the metadata and the updated time of a registered resource
+    whose content has not changed since the last download, keeping its
+    resource blob, sketches and content fingerprint.
+
+    Args:
+        package_key: the key of the package associated with the resource.
+        resource_id: the ID of the resource in the CKAN package.
+        resource: the JSON of the resource in the CKAN package.
+        validators: the validators of the new download to save, if any.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE findopendata.ckan_resources "
+                "SET updated = current_timestamp, raw_metadata = %s "
+                "WHERE package_key = %s AND resource_id = %s;",
+                (Json(resource), package_key, resource_id))
+        if validators is not None:
+            save_validators(cur, resource["url"], validators)
+        conn.commit()
+        cur.close()
+
+
+def _delete_staged_blob(blob_name):
+    try:
+        storage.delete(blob_name)
+    except Exception as e:
+        logger.warning("Failed to delete staged blob {}: {}".format(
+            blob_name, e))
+
+
+def _sketch_kwargs():
+    """The keyword arguments for sketchers from the index configurations."""
+    return dict(
+            record_sample_size=index_configs["table_sample_size"],
+            max_records=index_configs["max_records_per_dataset"],
+            minhash_size=index_configs["minhash_size"],
+            minhash_seed=index_configs["minhash_seed"],
+            hyperloglog_p=index_configs["hyperloglog_p"],
+            sample_size=index_configs["column_sample_size"],
+            enable_word_vector_data=index_configs["enable_word_vector_data"],
+            **get_sketch_memory_limits(index_configs)
+            )
+
+
+def _stream_resource_to_storage(package_key, resource_id, original_url,
+        blob_dir, dataset_format=None, validators=None):
+    """Download the resource and stream it directly into the storage.
+    If dataset_format is given, the stream is also sketched as it is read.
+
+    Raises: NotModified if the resource is not modified since the download
+        recorded by validators.
+
+    Returns: (filename, resource_blob, table_sketch, validators) or None if
+        failed. table_sketch is None if not sketched or sketching failed.
+    """
+    if dataset_format is None:
+        try:
+            filename, resource_blob, validators = download_to_storage(
+                    original_url, storage, blob_dir, validators=validators,
+                    max_resumes=crawler_configs.get("download_max_resumes",
+                        5))
+        except NotModified:
+            raise
+        except Exception as e:
+            logger.warning("(package={} resource={}) Failed to download {} "
+                    "to storage: {}".format(package_key, resource_id,
+                        original_url, e))
+            return None
+        return filename, resource_blob, None, validators
+    sketcher = StreamSketcher(get_sketcher(dataset_format),
+            **_sketch_kwargs())
+    try:
+        with sketcher:
+            filename, resource_blob, validators = download_to_storage(
+                    original_url, storage, blob_dir, on_read=sketcher.feed,
+                    validators=validators,
+                    max_resumes=crawler_configs.get("download_max_resumes",
+                        5))
+    except NotModified:
+        raise
+    except Exception as e:
+        logger.warning("(package={} resource={}) Failed to download {} to "
+                "storage: {}".format(package_key, resource_id, original_url,
+                    e))
+        return None
+    try:
+        table_sketch = sketcher.result()
+    except Exception as e:
+        logger.warning("(package={} resource={}) Failed to sketch {}: "
+                "{}".format(package_key, resource_id, original_url, e))
+        table_sketch = None
+    return filename, resource_blob, table_sketch, validators
+
+
+def _save_resource_via_local(package_key, resource_id, original_url,
+        blob_dir, dataset_format=None, validators=None):
+    """Download the resource into a temporary directory and then upload
+    the local file to the storage. If dataset_format is given, the local
+    file is also sketched before it is removed.
+
+    Raises: NotModified if the resource is not modified since the download
+        recorded by validators.
+
+    Returns: (filename, resource_blob, table_sketch, validators) or None if
+        failed. table_sketch is None if not sketched or sketching failed.
+        resource_blob is None if the content is unchanged since the download
+        recorded by validators, in which case it is not uploaded.
+    """
     working_dir = crawler_configs.get("working_dir", "/tmp")
     with temporary_directory(working_dir) as parent_dir:
 
         # Download this resource.
         try:
-            filename = download_to_local(original_url, parent_dir)
+            filename, new_validators = download_to_local(original_url,
+                    parent_dir, validators=validators,
+                    parallel_min_size=crawler_configs.get(
+                        "parallel_download_min_size"),
+                    parallel_parts=crawler_configs.get(
+                        "parallel_download_parts", 4),
+                    max_resumes=crawler_configs.get("download_max_resumes", 5))
+        except NotModified:
+            raise
         except Exception as e:
             logger.warning("(package={} resource={}) Failed to download {}: "
                     "{}".format(package_key, resource_id, original_url, e))
-            return
+            return None
+        if is_unchanged(validators, new_validators):
+            return filename, None, None, new_validators
 
-        # Save and register the resource file.
+        # Save the resource file.
         # Build blob name
-        blob_name = os.path.join(package_path, resource_id, filename)
+        blob_name = os.path.join(blob_dir, filename)
         try:
             with open(os.path.join(parent_dir, filename), "rb") as f:
                 resource_blob = storage.put_file(f, blob_name)
@@ -199,40 +433,20 @@ def add_ckan_resource(package_key, resource, package_path):
             logger.warning("(package={} resource={}) Failed to save local "
                     "file {} to {}: {}".format(package_key, resource_id,
                         filename, blob_name, e))
-            return
-        logger.info("(package={} resource={} filename={}) Saved resource "
-                "from {} to {}".format(package_key, resource_id, filename,
-                    original_url, blob_name))
-
-    # Initialize Postgres connection for registering resource.
-    # A new connection is created here to prevent the download
-    # from hogging the connection pool.
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-
-    # Register this resource.
-    cur.execute("INSERT INTO findopendata.ckan_resources "
-            "(package_key, resource_id, filename, resource_blob, "
-            "original_url, file_size, raw_metadata) "
-            "VALUES (%s, %s, %s, %s, %s, %s, %s) "
-            "ON CONFLICT (package_key, resource_id) "
-            "DO UPDATE "
-            "SET updated = current_timestamp, "
-            "resource_blob = EXCLUDED.resource_blob, "
-            "original_url = EXCLUDED.original_url, "
-            "file_size = EXCLUDED.file_size, "
-            "raw_metadata = EXCLUDED.raw_metadata;",
-            (package_key, resource_id, filename,
-                resource_blob.name, original_url,
-                resource_blob.size, Json(resource)))
-    conn.commit()
-
-    # Close database connection for registering resource.
-    cur.close()
-    conn.close()
-
-    logger.info("(package={}, resource={}, filename={}) Registered "
-            "resource.".format(package_key, resource_id, filename))
+            return None
+
+        # Sketch the local file.
+        table_sketch = None
+        if dataset_format is not None:
+            sketcher = get_sketcher(dataset_format)
+            try:
+                with open(os.path.join(parent_dir, filename), "rb") as f:
+                    table_sketch = sketcher(f, **_sketch_kwargs())
+            except Exception as e:
+                logger.warning("(package={} resource={}) Failed to sketch "
+                        "local file {}: {}".format(package_key, resource_id,
+                            filename, e))
+    return filename, resource_blob, table_sketch, new_validators
 
 
 @app.task(ignore_result=True)
@@ -249,46 +463,90 @@ def add_ckan_packages_from_api(api_url, endpoint, blob_prefix, force_update):
             default, packages with updated time before the previously
             registered time will be skipped.
     """
+    modified_since = None
     if not force_update:
         logger.info("Reading last updated timestamps for endpoint {}".format(
                 endpoint))
-        conn = psycopg2.connect(**db_configs)
-        cur = conn.cursor()
-        cur.execute(r"""SELECT package_id, updated::timestamptz
-                        FROM findopendata.ckan_packages
-                        WHERE endpoint = %s""", (endpoint,))
-        updated_times = dict((package_id, updated) 
-                for package_id, updated in cur)
-        cur.close()
-        conn.close()
-
-    logger.info("Reading CKAN API: {}".format(api_url))
-    packages = read_api(api_url)
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(r"""SELECT package_id, updated::timestamptz
+                            FROM findopendata.ckan_packages
+                            WHERE endpoint = %s""", (endpoint,))
+            updated_times = dict((package_id, updated) 
+                    for package_id, updated in cur)
+            if crawler_configs.get("ckan_incremental", False):
+                # Read only the packages modified since the high-water mark,
+                # with an overlap for the packages modified during the last
+                # crawl or whose tasks failed.
+                cur.execute(r"""SELECT max(modified_since)
+                                FROM findopendata.ckan_apis
+                                WHERE endpoint = %s""", (endpoint,))
+                row = cur.fetchone()
+                if row is not None and row[0] is not None:
+                    modified_since = row[0] - datetime.timedelta(
+                            hours=crawler_configs.get(
+                                "ckan_incremental_overlap_hours", 24))
+            cur.close()
+
+    logger.info("Reading CKAN API: {} (modified since {})".format(api_url,
+        modified_since))
+    # Keep up to ckan_prefetch_pages page requests in flight, but not more
+    # than the concurrency limit of the host.
+    prefetch = crawler_configs.get("ckan_prefetch_pages", 1)
+    max_concurrency = host_limiter.get_limits(
+            get_host(api_url)).max_concurrency
+    if max_concurrency is not None:
+        prefetch = min(prefetch, max_concurrency)
+    packages = read_api(api_url, modified_since=modified_since,
+            prefetch=max(prefetch, 1))
+    high_water_mark = None
     for package in packages:
+        # The next crawl filters the packages by metadata_modified, so the
+        # high water mark is taken from that field only.
+        if package.get("metadata_modified"):
+            package_modified = parse_timestamp(package["metadata_modified"])
+            if package_modified is not None and (high_water_mark is None or
+                    package_modified > high_water_mark):
+                high_water_mark = package_modified
+        metadata_modified = extract_timestamp_from_package(package)
         if not force_update:
-            metadata_modified = extract_timestamp_from_package(package)
             package_updated = updated_times.get(package["id"])
             if metadata_modified is not None and package_updated is not None \
                     and metadata_modified <= package_updated:
                 continue
-        add_ckan_package.delay(package, endpoint=endpoint, 
+        # Save the package JSON and pass only its blob name through the
+        # broker, as large packages make slow, large messages.
+        package_blob = storage.put_object(package, os.path.join(blob_prefix,
+            endpoint, package["id"], "package.json"))
+        add_ckan_package.delay(package_blob.name, endpoint=endpoint,
                 blob_prefix=blob_prefix)
 
+    # Save the high-water mark after reading all the packages.
+    if high_water_mark is not None:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(r"""UPDATE findopendata.ckan_apis
+                            SET modified_since = GREATEST(modified_since, %s)
+                            WHERE endpoint = %s""",
+                            (high_water_mark, endpoint))
+            conn.commit()
+            cur.close()
+
 
 @app.task(ignore_result=True)
 def add_ckan_apis(force_update):
     """Add CKAN API endpoints to the crawler."""
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-    cur.execute(r"""SELECT scheme, endpoint 
-                    FROM findopendata.ckan_apis 
-                    WHERE enabled = true""")
-    def _get_api_url(scheme, endpoint):
-        endpoint = endpoint.rstrip("/")
-        return ("{}://{}".format(scheme, endpoint), endpoint)
-    api_urls = [_get_api_url(scheme, endpoint) for scheme, endpoint in cur]
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(r"""SELECT scheme, endpoint 
+                        FROM findopendata.ckan_apis 
+                        WHERE enabled = true""")
+        def _get_api_url(scheme, endpoint):
+            endpoint = endpoint.rstrip("/")
+            return ("{}://{}".format(scheme, endpoint), endpoint)
+        api_urls = [_get_api_url(scheme, endpoint)
+                for scheme, endpoint in cur]
+        cur.close()
     for api_url, endpoint in api_urls:
         add_ckan_packages_from_api.delay(api_url=api_url,
                 endpoint=endpoint,
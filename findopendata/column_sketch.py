@@ -1,3 +1,5 @@
+import sys
+
 import farmhash
 import simplejson as json
 import numpy as np
@@ -6,6 +8,24 @@ from datasketch import MinHash, HyperLogLogPlusPlus
 from .models.word_vector_models import WordVectorModel
 
 
+def _hash32(str_value):
+    return farmhash.hash32(str_value)
+
+
+# The empty MinHash by the number of permutations and seed. The MinHash of
+# a column is copied from it, so the column sketches share the permutations
+# instead of generating and keeping their own.
+_empty_minhashes = {}
+
+
+def _new_minhash(num_perm, seed):
+    key = (num_perm, seed)
+    if key not in _empty_minhashes:
+        _empty_minhashes[key] = MinHash(num_perm=num_perm, seed=seed,
+                hashfunc=_hash32)
+    return _empty_minhashes[key].copy()
+
+
 def _is_number(x):
     try:
         a = float(x)
@@ -26,6 +46,11 @@ class ColumnSketch:
         sample_size: the size of sample to be kept.
         enable_word_vector_data: whether to build word embedding vector for 
             data values -- can be 10x more expensive.
+        exact_threshold: the number of distinct values kept exactly before
+            the MinHash and HyperLogLog are created from them, which saves
+            memory for columns with few distinct values. They are also
+            created once the distinct values take more memory than them.
+            The sketches are the same as if created from the start.
     """
     def __init__(self, column_name, 
         minhash_size=256, 
@@ -34,6 +59,7 @@ class ColumnSketch:
         sample_size=100,
         enable_word_vector_data=False,
         model=WordVectorModel,
+        exact_threshold=0,
         ):
         self._column_name = column_name
         self._sample = set([])
@@ -42,14 +68,116 @@ class ColumnSketch:
         self._empty_count = 0
         self._oov_count = 0
         self._numeric_count = 0
-        self._minhash = MinHash(num_perm=minhash_size, seed=minhash_seed,
-                hashfunc=self._hashfunc32)
-        self._hhl = HyperLogLogPlusPlus(p=hyperloglog_p,
-                hashfunc=self._hashfunc64) 
+        self._minhash_size = minhash_size
+        self._minhash_seed = minhash_seed
+        self._hyperloglog_p = hyperloglog_p
+        self._exact_threshold = exact_threshold
+        # The distinct values and their estimated size in bytes, until the
+        # MinHash and HyperLogLog are created.
+        self._distinct = set([])
+        self._distinct_bytes = 0
+        self._minhash = None
+        self._hhl = None
+        if exact_threshold <= 0:
+            self._create_sketches()
         self._enabled_word_vec_data = enable_word_vector_data
         self._model = model
         self._sum_vector = self._model.get_empty_word_vector()
 
+    @classmethod
+    def from_state(cls, state, model=WordVectorModel):
+        """Restore a column sketch from the state created by get_state,
+        so it can be used for output or updated with more data values.
+
+        Args:
+            state: the state as a Python dictionary.
+            model: the word vector model.
+        """
+        sketch = cls(state["column_name"],
+                minhash_size=len(state["minhash"]),
+                minhash_seed=state["seed"],
+                hyperloglog_p=state["hyperloglog_p"],
+                sample_size=state["sample_size"],
+                enable_word_vector_data=state["enable_word_vector_data"],
+                model=model,
+                exact_threshold=0)
+        sketch._sample = set(state["sample"])
+        sketch._count = state["count"]
+        sketch._empty_count = state["empty_count"]
+        sketch._oov_count = state["out_of_vocabulary_count"]
+        sketch._numeric_count = state["numeric_count"]
+        sketch._minhash.hashvalues = np.array(state["minhash"],
+                dtype=sketch._minhash.hashvalues.dtype)
+        sketch._hhl.reg = np.array(state["hyperloglog"],
+                dtype=sketch._hhl.reg.dtype)
+        if state.get("sum_vector") is not None:
+            sketch._sum_vector = np.array(state["sum_vector"],
+                    dtype=np.float32)
+        return sketch
+
+    def get_state(self):
+        """The complete state of this sketch as a JSON-serializable Python
+        dictionary, from which the sketch can be restored using from_state.
+        """
+        return {
+                "column_name": self._column_name,
+                "sample": list(self._sample),
+                "sample_size": self._sample_size,
+                "count": self._count,
+                "empty_count": self._empty_count,
+                "out_of_vocabulary_count": self._oov_count,
+                "numeric_count": self._numeric_count,
+                "minhash": self.minhash,
+                "seed": self.seed,
+                "hyperloglog_p": self._hyperloglog_p,
+                "hyperloglog": self.hyperloglog,
+                "enable_word_vector_data": self._enabled_word_vec_data,
+                "sum_vector": (list(float(v) for v in self._sum_vector)
+                    if self._enabled_word_vec_data else None),
+                }
+
+    def _new_sketches(self):
+        minhash = _new_minhash(self._minhash_size, self._minhash_seed)
+        hhl = HyperLogLogPlusPlus(p=self._hyperloglog_p,
+                hashfunc=self._hashfunc64)
+        for value in self._distinct:
+            minhash.update(value)
+            hhl.update(value)
+        return minhash, hhl
+
+    def _create_sketches(self):
+        # Create the MinHash and HyperLogLog from the distinct values, and
+        # update them instead of the distinct values from now on.
+        self._minhash, self._hhl = self._new_sketches()
+        self._distinct = None
+        self._distinct_bytes = 0
+
+    def _get_sketches(self):
+        if self._minhash is not None:
+            return self._minhash, self._hhl
+        return self._new_sketches()
+
+    @property
+    def is_exact(self):
+        """Whether the distinct values are still kept exactly, before the
+        MinHash and HyperLogLog are created.
+        """
+        return self._minhash is None
+
+    @property
+    def memory_usage(self):
+        """The estimated number of bytes used by the distinct values or the
+        MinHash and HyperLogLog.
+        """
+        if self.is_exact:
+            return self._distinct_bytes
+        return self._sketches_bytes
+
+    @property
+    def _sketches_bytes(self):
+        # The hash values of the MinHash and the HyperLogLog registers.
+        return self._minhash_size * 8 + (1 << self._hyperloglog_p)
+
     def _hashfunc32(self, str_value):
         return farmhash.hash32(str_value)
     
@@ -122,6 +250,8 @@ class ColumnSketch:
         """
         if len(self._sample) < self._sample_size:
             return len(self._sample)
+        if self.is_exact:
+            return len(self._distinct)
         return max(len(self._sample), self._hhl.count())
     
     @property
@@ -149,19 +279,21 @@ class ColumnSketch:
     def minhash(self):
         """The hash values in the MinHash.
         """
-        return list(int(v) for v in self._minhash.digest())
+        minhash, _ = self._get_sketches()
+        return list(int(v) for v in minhash.digest())
 
     @property
     def seed(self):
         """The random seed used for MinHash.
         """
-        return self._minhash.seed
+        return self._minhash_seed
     
     @property
     def hyperloglog(self):
         """The register values of the HyperLogLog counter.
         """
-        return list(int(v) for v in self._hhl.digest())
+        _, hhl = self._get_sketches()
+        return list(int(v) for v in hhl.digest())
 
     def update(self, value):
         """Add a data value into the sketch.
@@ -181,10 +313,19 @@ class ColumnSketch:
         # Add to sample.
         if len(self._sample) < self._sample_size:
             self._sample.add(value)
-        # Update the MinHash sketch.
-        self._minhash.update(value)
-        # Update the HyperLogLog sketch.
-        self._hhl.update(value)
+        if self.is_exact:
+            # Keep the distinct value until there are too many of them.
+            if value not in self._distinct:
+                self._distinct.add(value)
+                self._distinct_bytes += sys.getsizeof(value)
+                if len(self._distinct) > self._exact_threshold or \
+                        self._distinct_bytes > self._sketches_bytes:
+                    self._create_sketches()
+        else:
+            # Update the MinHash sketch.
+            self._minhash.update(value)
+            # Update the HyperLogLog sketch.
+            self._hhl.update(value)
         # Skip word vector extraction if not enabled.
         if not self._enabled_word_vec_data:
             return
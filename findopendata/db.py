@@ -0,0 +1,141 @@
+"""Postgres connections shared by the tasks in a worker process.
+
+Tasks take a connection from the pool of their process and return it when
+done, instead of connecting to Postgres for every task. The pool is
+recreated in a forked process, as the connections cannot be shared between
+processes.
+"""
+import os
+import threading
+import contextlib
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+
+# The default of ConnectionPool.configure for the timeout left unchanged, as
+# None means waiting forever.
+_UNCHANGED = object()
+
+
+class ConnectionPool(object):
+    """A pool of Postgres connections for this process. The connections are
+    only opened when first used.
+
+    Args:
+        db_configs: the keyword arguments for psycopg2.connect.
+        minconn: the number of connections kept open in the pool.
+        maxconn: the maximum number of connections opened by this process,
+            i.e., the number of tasks using a connection at the same time.
+            Other tasks wait for a connection to be returned.
+        timeout: the seconds to wait for a connection before raising
+            psycopg2.pool.PoolError, None to wait forever.
+    """
+
+    def __init__(self, db_configs=None, minconn=1, maxconn=4, timeout=30):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._slots = None
+        self._pid = os.getpid()
+        self._db_configs = None
+        self._minconn = 1
+        self._maxconn = 4
+        self._timeout = 30
+        self.configure(db_configs=db_configs, minconn=minconn,
+                maxconn=maxconn, timeout=timeout)
+
+    def configure(self, db_configs=None, minconn=None, maxconn=None,
+            timeout=_UNCHANGED):
+        """Update the settings of the pool and close the existing
+        connections. The arguments left as None are not changed, except
+        the timeout, which is not changed if not given."""
+        with self._lock:
+            if db_configs is not None:
+                self._db_configs = dict(db_configs)
+            if minconn is not None:
+                self._minconn = int(minconn)
+            if maxconn is not None:
+                self._maxconn = int(maxconn)
+            if timeout is not _UNCHANGED:
+                self._timeout = float(timeout) if timeout is not None \
+                        else None
+            self._reset()
+
+    def _reset(self):
+        if self._pid != os.getpid():
+            # Forked: drop the pool without closing the connections that
+            # still belong to the parent process.
+            self._pool = None
+            self._pid = os.getpid()
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._pool is None:
+                if self._db_configs is None:
+                    raise RuntimeError("The connection pool is not "
+                            "configured.")
+                self._pool = ThreadedConnectionPool(self._minconn,
+                        self._maxconn, **self._db_configs)
+                # The pool raises an error when all connections are in use,
+                # so the tasks wait for a slot before getting a connection.
+                self._slots = threading.BoundedSemaphore(self._maxconn)
+            return self._pool, self._slots
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Get a connection from the pool, and return it to the pool when
+        done. The transaction not committed is rolled back, and broken
+        connections are discarded."""
+        pool, slots = self._get_pool()
+        if not slots.acquire(timeout=self._timeout):
+            raise PoolError("No connection available after {} "
+                    "seconds".format(self._timeout))
+        try:
+            conn = pool.getconn()
+        except Exception:
+            slots.release()
+            raise
+        try:
+            yield conn
+        finally:
+            close = bool(conn.closed)
+            if not close and conn.get_transaction_status() != \
+                    psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+            if pool.closed:
+                # The pool has been reconfigured while the connection was
+                # in use.
+                conn.close()
+            else:
+                pool.putconn(conn, close=close)
+            slots.release()
+
+    def close(self):
+        """Close all connections of the pool."""
+        with self._lock:
+            self._reset()
+
+
+# The connection pool of this process.
+pool = ConnectionPool()
+
+
+def get_connection():
+    """Get a connection from the pool of this process, used as a context
+    manager:
+
+        with get_connection() as conn:
+            cur = conn.cursor()
+            ...
+            conn.commit()
+    """
+    return pool.connection()
@@ -1,41 +1,381 @@
 import os
 import shutil
+import hashlib
+import http.client
+import concurrent.futures
 
 import rfc6266
-import requests
+import urllib3
 
 from .util import get_safe_filename
+from .sessions import get_session
 
-def download_to_local(url, dir_name):
-    """Downloads remote resource given its URL.
+
+class NotModified(Exception):
+    """Raised when the remote resource has not been modified since the
+    validators were recorded (i.e., the server responded 304)."""
+    pass
+
+
+def conditional_headers(validators):
+    """Get the HTTP headers for a conditional request.
+
+    Args:
+        validators: the validators of the previous download, a dictionary
+            with keys etag and last_modified, or None.
+
+    Returns: a dictionary of headers, empty if no validator is available.
+    """
+    headers = {}
+    if not validators:
+        return headers
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+class CountingReader(object):
+    """A readonly binary stream wrapper that counts and hashes the bytes read
+    through it, used to measure the size and content hash of a streamed
+    download on the fly.
+
+    Args:
+        stream: the binary stream to read from (e.g., a HTTP response body).
+        on_read: an optional function called with every chunk of bytes read,
+            used to tee the stream (e.g., into a StreamSketcher).
+    """
+
+    def __init__(self, stream, on_read=None):
+        self._stream = stream
+        self._on_read = on_read
+        self._bytes_read = 0
+        self._hash = hashlib.sha256()
+
+    @property
+    def bytes_read(self):
+        """The number of bytes read so far."""
+        return self._bytes_read
+
+    @property
+    def content_hash(self):
+        """The hex digest of the bytes read so far."""
+        return self._hash.hexdigest()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._bytes_read += len(data)
+        self._hash.update(data)
+        if self._on_read is not None and data:
+            self._on_read(data)
+        return data
+
+    def tell(self):
+        return self._bytes_read
+
+
+# The errors of reading a response body after which the download can be
+# resumed with a range request.
+_resumable_errors = (urllib3.exceptions.HTTPError, http.client.HTTPException,
+        OSError)
+
+_chunk_size = 1024*1024
+
+
+def _supports_ranges(headers):
+    # Ranges are over the encoded body, so only identity encoding is resumed.
+    return headers.get("accept-ranges", "").lower() == "bytes" and \
+            headers.get("content-encoding", "identity").lower() == \
+            "identity"
+
+
+def _content_length(headers):
+    try:
+        return int(headers["content-length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _range_headers(headers, start, end=None):
+    # If-Range makes the server send the whole (changed) resource with 200
+    # instead of a range of a different version.
+    range_headers = {"Range": "bytes={}-{}".format(start,
+        "" if end is None else end)}
+    validator = headers.get("etag") or headers.get("last-modified")
+    if validator:
+        range_headers["If-Range"] = validator
+    return range_headers
+
+
+def _get_range(url, headers, start, end=None):
+    r = get_session(url).get(url, stream=True,
+            headers=_range_headers(headers, start, end))
+    if r.status_code != 206:
+        r.close()
+        raise RuntimeError("Cannot get range {}-{} of {}: status {}, the "
+                "resource may have changed".format(start, end, url,
+                    r.status_code))
+    return r
+
+
+class ResumableReader(object):
+    """A readonly binary stream over the body of a HTTP response that
+    resumes from the last byte read with a range request when the
+    connection drops, if the server accepts byte ranges.
+
+    Args:
+        url: the URL of the resource.
+        response: the streamed response of the GET request of the URL.
+        max_resumes: the maximum number of times to resume.
+    """
+
+    def __init__(self, url, response, max_resumes=5):
+        self._url = url
+        self._response = response
+        self._headers = response.headers
+        self._length = _content_length(response.headers)
+        self._resumable = _supports_ranges(response.headers)
+        self._max_resumes = max_resumes
+        self._resumes = 0
+        self._pos = 0
+
+    @property
+    def resumes(self):
+        """The number of times the download has been resumed."""
+        return self._resumes
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def _resume(self, error):
+        if not self._resumable or self._resumes >= self._max_resumes:
+            raise error
+        self._resumes += 1
+        self._response.close()
+        self._response = _get_range(self._url, self._headers, self._pos)
+
+    def read(self, size=-1):
+        while True:
+            try:
+                data = self._response.raw.read(None if size < 0 else size)
+            except _resumable_errors as e:
+                self._resume(e)
+                continue
+            if not data and size != 0 and self._length is not None and \
+                    self._pos < self._length:
+                # The connection was closed before the end.
+                self._resume(IOError("Incomplete body of {}: {} of {} "
+                    "bytes".format(self._url, self._pos, self._length)))
+                continue
+            self._pos += len(data)
+            return data
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._response.close()
+
+
+def _download_part(url, headers, path, start, end, max_resumes):
+    # Download the byte range [start, end] into the file at the path.
+    pos = start
+    resumes = 0
+    while pos <= end:
+        try:
+            with _get_range(url, headers, pos, end) as r:
+                with open(path, "r+b") as f:
+                    f.seek(pos)
+                    while pos <= end:
+                        data = r.raw.read(min(_chunk_size, end - pos + 1))
+                        if not data:
+                            break
+                        f.write(data)
+                        pos += len(data)
+        except _resumable_errors:
+            if resumes >= max_resumes:
+                raise
+        if pos <= end:
+            if resumes >= max_resumes:
+                raise IOError("Incomplete range {}-{} of {}: stopped at "
+                        "{}".format(start, end, url, pos))
+            resumes += 1
+    return pos - start
+
+
+def _download_parts(url, headers, path, length, parts, max_resumes):
+    # Download the resource in parallel byte ranges into the file.
+    with open(path, "wb") as f:
+        f.truncate(length)
+    part_size = -(-length // parts)
+    ranges = [(start, min(start + part_size, length) - 1)
+            for start in range(0, length, part_size)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parts) as executor:
+        futures = [executor.submit(_download_part, url, headers, path,
+            start, end, max_resumes) for start, end in ranges]
+        size = sum(future.result() for future in futures)
+    if size != length:
+        raise IOError("Incomplete download of {}: {} of {} bytes".format(
+            url, size, length))
+    content_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(_chunk_size), b""):
+            content_hash.update(data)
+    return content_hash.hexdigest()
+
+
+def _check_length(url, headers, size):
+    length = _content_length(headers)
+    if length is not None and size != length:
+        raise IOError("Incomplete download of {}: {} of {} bytes".format(
+            url, size, length))
+
+
+def _get_filename(url, headers):
+    # Guesst the proper filename to use
+    filename = ""
+    # 1. Try to use the content-disposition header if available
+    if "content-disposition" in headers:
+        filename = rfc6266.parse_headers(headers["content-disposition"],
+                relaxed=True).filename_unsafe
+    # 2. Try to get it from the URL
+    if filename == "":
+        filename = url.rsplit("/", 1)[-1]
+    # 3. Sanitize the filename, this handles empty filename right now
+    return get_safe_filename(filename)
+
+
+def _get_validators(headers, content_length, content_hash):
+    return {
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "content_length": content_length,
+            "content_hash": content_hash,
+            }
+
+
+def _get(url, validators):
+    r = get_session(url).get(url, stream=True,
+            headers=conditional_headers(validators))
+    if r.status_code == 304:
+        r.close()
+        raise NotModified(url)
+    try:
+        r.raise_for_status()
+    except Exception:
+        r.close()
+        raise
+    return r
+
+
+def download_to_local(url, dir_name, validators=None, parallel_min_size=None,
+        parallel_parts=4, max_resumes=5):
+    """Downloads remote resource given its URL. If the server accepts byte
+    ranges, a dropped connection is resumed from the last byte received,
+    and a large resource is downloaded in parallel byte ranges.
 
     Args:
         url: the URL to the resource.
         dir_name: the directory on the local filesystem to save the resource.
+        validators: the validators of the previous download of the same URL,
+            used to make a conditional request.
+        parallel_min_size: the minimum size in bytes of a resource to be
+            downloaded in parallel byte ranges, None to always use a single
+            stream.
+        parallel_parts: the number of byte ranges downloaded in parallel.
+        max_resumes: the maximum number of times to resume the download
+            (or each byte range) after the connection drops.
+
+    Raises:
+        NotModified: if the resource has not been modified according to
+            the validators.
 
     Returns:
         filename: the filename (relative to the dir_name) of the downloaded
             resource. It may be different from the name of the remote resource
             because of sanitization.
+        validators: the validators of this download, a dictionary with keys
+            etag, last_modified, content_length and content_hash.
     """
 
     # TODO: be able to verify SSL certificates from some publishers
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
+    r = _get(url, validators)
+    headers = r.headers
+    filename = _get_filename(url, headers)
+    path = os.path.join(dir_name, filename)
+    length = _content_length(headers)
+    if parallel_min_size is not None and length is not None and \
+            length >= parallel_min_size and _supports_ranges(headers):
+        # Only the headers of the first response are used.
+        r.close()
+        content_hash = _download_parts(url, headers, path, length,
+                parallel_parts, max_resumes)
+        return filename, _get_validators(headers, length, content_hash)
+
+    # Download the file in a single stream.
+    stream = ResumableReader(url, r, max_resumes)
+    try:
+        reader = CountingReader(stream)
+        with open(path, "wb") as o:
+            shutil.copyfileobj(reader, o, _chunk_size)
+    finally:
+        stream.close()
+    _check_length(url, headers, reader.bytes_read)
+    return filename, _get_validators(headers, reader.bytes_read,
+            reader.content_hash)
 
-        # Guesst the proper filename to use
-        filename = ""
-        # 1. Try to use the content-disposition header if available
-        if "content-disposition" in r.headers:
-            filename = rfc6266.parse_headers(r.headers["content-disposition"],
-                    relaxed=True).filename_unsafe
-        # 2. Try to get it from the URL
-        if filename == "":
-            filename = url.rsplit("/", 1)[-1]
-        # 3. Sanitize the filename, this handles empty filename right now
-        filename = get_safe_filename(filename)
-
-        # Download the file
-        with open(os.path.join(dir_name, filename), "wb") as o:
-            shutil.copyfileobj(r.raw, o)
-    return filename
+
+def download_to_storage(url, storage, blob_dir, on_read=None,
+        validators=None, max_resumes=5):
+    """Downloads remote resource given its URL and streams the response body
+    directly into the storage, without writing it to the local filesystem.
+    If the server accepts byte ranges, a dropped connection is resumed from
+    the last byte received.
+
+    Args:
+        url: the URL to the resource.
+        storage: the BlobStorage provider to save the resource.
+        blob_dir: the blob name prefix (i.e., directory) of the resource.
+        on_read: an optional function called with every chunk of bytes of
+            the response body as it is streamed into the storage.
+        validators: the validators of the previous download of the same URL,
+            used to make a conditional request.
+        max_resumes: the maximum number of times to resume the download
+            after the connection drops.
+
+    Raises:
+        NotModified: if the resource has not been modified according to
+            the validators.
+
+    Returns:
+        filename: the filename of the downloaded resource, the name of the
+            blob is blob_dir/filename.
+        blob: the blob object that was created.
+        validators: the validators of this download, a dictionary with keys
+            etag, last_modified, content_length and content_hash.
+    """
+    r = _get(url, validators)
+    headers = r.headers
+    stream = ResumableReader(url, r, max_resumes)
+    try:
+        filename = _get_filename(url, headers)
+        reader = CountingReader(stream, on_read)
+        blob = storage.put_file(reader, os.path.join(blob_dir, filename))
+    finally:
+        stream.close()
+    _check_length(url, headers, reader.bytes_read)
+    if blob.size is not None and blob.size != reader.bytes_read:
+        raise RuntimeError("Size mismatch for {}: downloaded {} bytes, "
+                "saved {} bytes".format(url, reader.bytes_read, blob.size))
+    return filename, blob, _get_validators(headers, reader.bytes_read,
+            reader.content_hash)
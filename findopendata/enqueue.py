@@ -0,0 +1,164 @@
+"""Helpers for the driver scripts that enqueue a task per database row.
+
+The rows are streamed through a server-side cursor instead of being loaded
+into memory, and the tasks are sent in chunks with backpressure: when the
+queue holds more than a maximum number of messages, sending pauses until
+the workers drain it to half of the maximum.
+"""
+import sys
+import time
+import itertools
+
+import psycopg2
+
+
+def count_rows(db_configs, sql, params=None):
+    """Count the rows returned by the query, for progress reporting."""
+    conn = psycopg2.connect(**db_configs)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM ({}) AS q".format(sql), params)
+        count = cur.fetchone()[0]
+        cur.close()
+    finally:
+        conn.close()
+    return count
+
+
+def stream_rows(db_configs, sql, params=None, name="enqueue_rows",
+        itersize=2000, cursor_factory=None):
+    """Stream the rows returned by the query through a named server-side
+    cursor, which fetches itersize rows per round trip.
+
+    Args:
+        db_configs: the keyword arguments for psycopg2.connect.
+        sql: the query.
+        params: the parameters of the query.
+        name: the name of the server-side cursor.
+        itersize: the number of rows fetched per round trip.
+        cursor_factory: the cursor factory, e.g., RealDictCursor.
+    """
+    conn = psycopg2.connect(**db_configs)
+    try:
+        cur = conn.cursor(name=name, cursor_factory=cursor_factory)
+        cur.itersize = itersize
+        cur.execute(sql, params)
+        for row in cur:
+            yield row
+        cur.close()
+    finally:
+        conn.close()
+
+
+def batched(rows, batch_size):
+    """Group the rows into lists of at most batch_size rows."""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_queue_depth(app, queue):
+    """Get the number of messages waiting in the queue of the Celery
+    app's broker, or 0 if the queue does not exist."""
+    with app.connection_or_acquire() as conn:
+        try:
+            _, message_count, _ = conn.default_channel.queue_declare(
+                    queue=queue, passive=True)
+        except Exception:
+            return 0
+    return message_count
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return "{:d}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60,
+            seconds % 60)
+
+
+class Progress(object):
+    """Prints the number of sent tasks, the throughput and the ETA at most
+    once every interval seconds.
+
+    Args:
+        total: the total number of tasks, None if unknown.
+        interval: the minimum seconds between reports.
+        out: the file to print to.
+        clock: the function returning the current time in seconds.
+    """
+
+    def __init__(self, total=None, interval=10, out=sys.stdout,
+            clock=time.monotonic):
+        self._total = total
+        self._interval = interval
+        self._out = out
+        self._clock = clock
+        self._start = clock()
+        self._last_report = self._start
+        self.count = 0
+
+    def update(self, n=1):
+        """Add n sent tasks and report if the interval has passed."""
+        self.count += n
+        if self._clock() - self._last_report >= self._interval:
+            self.report()
+
+    def report(self):
+        now = self._clock()
+        self._last_report = now
+        elapsed = now - self._start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        line = "Sent {} tasks".format(self.count)
+        if self._total is not None:
+            line = "Sent {}/{} tasks".format(self.count, self._total)
+        line += " ({:.1f} tasks/s".format(rate)
+        if self._total is not None and rate > 0:
+            line += ", ETA {}".format(_format_duration(
+                max(self._total - self.count, 0) / rate))
+        line += ")"
+        print(line, file=self._out)
+        self._out.flush()
+
+
+def enqueue(rows, send, total=None, chunk_size=1000, max_queue_depth=None,
+        get_queue_depth=None, poll_interval=5, report_interval=10,
+        out=sys.stdout, sleep=time.sleep, clock=time.monotonic):
+    """Send a task for every row in chunks. After every chunk, if the queue
+    holds more than max_queue_depth messages, wait until it is drained to
+    half of max_queue_depth.
+
+    Args:
+        rows: an iterable of rows.
+        send: the function sending the task of a row.
+        total: the total number of rows for the ETA, None if unknown.
+        chunk_size: the number of tasks sent between checks of the queue.
+        max_queue_depth: the maximum number of messages in the queue, None
+            for no backpressure.
+        get_queue_depth: the function returning the number of messages in
+            the queue.
+        poll_interval: the seconds between checks of the queue while
+            waiting.
+        report_interval: the minimum seconds between progress reports.
+        out: the file to print the progress to.
+
+    Returns: the number of tasks sent.
+    """
+    progress = Progress(total, report_interval, out, clock)
+    for chunk in batched(rows, chunk_size):
+        for row in chunk:
+            send(row)
+        progress.update(len(chunk))
+        if max_queue_depth is None or get_queue_depth is None:
+            continue
+        depth = get_queue_depth()
+        if depth <= max_queue_depth:
+            continue
+        print("Queue depth {} is over {}, waiting for workers...".format(
+            depth, max_queue_depth), file=out)
+        while depth > max_queue_depth // 2:
+            sleep(poll_interval)
+            depth = get_queue_depth()
+    progress.report()
+    return progress.count
@@ -0,0 +1,10 @@
+"""This module has the initialized host limiter shared by the crawler tasks.
+"""
+
+from .settings import crawler_configs, db_configs
+from .scheduler import HostLimiterFactory
+
+host_limiter = HostLimiterFactory(
+        provider=crawler_configs.get("host_limiter"),
+        host_limits=crawler_configs.get("host_limits"),
+        db_configs=db_configs)
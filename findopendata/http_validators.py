@@ -0,0 +1,67 @@
+"""The store of HTTP validators of downloaded resources, kept in the
+http_validators table and keyed by the original URL.
+"""
+
+_fields = ["etag", "last_modified", "content_length", "content_hash"]
+
+
+def get_validators(cur, url):
+    """Get the validators of the last download of the URL.
+
+    Args:
+        cur: the database cursor.
+        url: the original URL of the resource.
+
+    Returns: a dictionary with keys etag, last_modified, content_length and
+        content_hash, or None if the URL has not been downloaded.
+    """
+    cur.execute("SELECT etag, last_modified, content_length, content_hash "
+            "FROM findopendata.http_validators WHERE url = %s;", (url,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return dict((field, row[field]) for field in _fields)
+    return dict(zip(_fields, row))
+
+
+def save_validators(cur, url, validators):
+    """Save the validators of a download of the URL. The caller commits
+    the transaction.
+
+    Args:
+        cur: the database cursor.
+        url: the original URL of the resource.
+        validators: a dictionary with keys etag, last_modified,
+            content_length and content_hash.
+    """
+    cur.execute("INSERT INTO findopendata.http_validators "
+            "(url, etag, last_modified, content_length, content_hash) "
+            "VALUES (%s, %s, %s, %s, %s) "
+            "ON CONFLICT (url) DO UPDATE "
+            "SET updated = current_timestamp, "
+            "etag = EXCLUDED.etag, "
+            "last_modified = EXCLUDED.last_modified, "
+            "content_length = EXCLUDED.content_length, "
+            "content_hash = EXCLUDED.content_hash;",
+            (url,) + tuple(validators.get(field) for field in _fields))
+
+
+def get_content_fingerprint(validators):
+    """The fingerprint of the downloaded content, i.e., its hash and length,
+    or None if the content is not hashed."""
+    if not validators or not validators.get("content_hash"):
+        return None
+    return "{}:{}".format(validators["content_hash"],
+            validators.get("content_length"))
+
+
+def is_unchanged(old_validators, new_validators):
+    """Whether the downloaded content is identical to the last download,
+    judging by content length and hash."""
+    if not old_validators or not old_validators.get("content_hash"):
+        return False
+    return old_validators.get("content_hash") == \
+            new_validators.get("content_hash") and \
+            old_validators.get("content_length") == \
+            new_validators.get("content_length")
@@ -1,22 +1,31 @@
 import os
+import time
 
-import psycopg2
-from psycopg2.extras import Json, RealDictCursor, register_uuid
+from psycopg2.extras import Json, RealDictCursor, register_uuid, \
+        execute_values
 import dateutil.parser
 from celery.utils.log import get_task_logger
 
 from .celery import app
-from .settings import db_configs
+from .db import get_connection
+from .settings import index_configs
 from .storage.objects import storage
 from .parsers.csv import csv2json
 from .parsers.avro import avro2json
 from .parsers.jsonl import jsonl2json
 from .column_sketch import ColumnSketch
 from .table_sketch import TableSketch
+from .sketch_encoding import encode_minhash, encode_hyperloglog
+from .metrics import registry
 
 
 logger = get_task_logger(__name__)
 
+# The time spent in each phase of the tasks, the storage reads during
+# sketching are also recorded separately by the instrumented storage.
+_phase_seconds = registry.histogram("task_phase_seconds",
+        "The time spent in each phase of a task in seconds.")
+
 
 def _json_records_sketcher(records, record_sample_size=20, max_records=None,
         **kwargs):
@@ -56,6 +65,149 @@ _sketchers = {
         }
 
 
+def get_sketcher(dataset_format):
+    """Get the sketcher function for the dataset format. A sketcher takes
+    a binary file object, record_sample_size, max_records and keyword
+    arguments for ColumnSketch, and returns a TableSketch.
+
+    Args:
+        dataset_format: one of csv, jsonl, and avro.
+    """
+    if dataset_format not in _sketchers:
+        raise ValueError("{} is not supported".format(dataset_format))
+    return _sketchers[dataset_format]
+
+
+def get_sketch_params(index_configs):
+    """Get the parameters of sketch_package_file from the index
+    configurations. The parameters are saved with the sketches, so package
+    files are sketched again only when their content or the parameters
+    change.
+    """
+    return dict(
+            max_records=index_configs["max_records_per_dataset"],
+            table_sample_size=index_configs["table_sample_size"],
+            minhash_size=index_configs["minhash_size"],
+            minhash_seed=index_configs["minhash_seed"],
+            hyperloglog_p=index_configs["hyperloglog_p"],
+            column_sample_size=index_configs["column_sample_size"],
+            enable_word_vector_data=index_configs["enable_word_vector_data"],
+            minhash_bits=index_configs.get("minhash_bits", 32),
+            )
+
+
+def get_sketch_memory_limits(index_configs):
+    """Get the keyword arguments of TableSketch that limit the memory used
+    for sketching wide tables from the index configurations. They are
+    limits of the workers rather than sketch parameters, so package files
+    are not sketched again when they change.
+    """
+    return dict(
+            max_columns=index_configs.get("sketch_max_columns"),
+            exact_threshold=index_configs.get("sketch_exact_threshold", 0),
+            )
+
+
+def save_table_sketch(cur, package_file_key, table_sketch,
+        content_fingerprint=None, sketch_params=None):
+    """Save the column sketches, table sample and column names of a package
+    file using the given cursor. The caller commits the transaction.
+
+    Args:
+        cur: the database cursor with RealDictCursor cursor factory.
+        package_file_key: the primary key of package_files table.
+        table_sketch: the TableSketch of the package file.
+        content_fingerprint: the fingerprint of the content that was
+            sketched.
+        sketch_params: the parameters the sketches were created with, see
+            get_sketch_params. The MinHash sketches are saved with the
+            minhash_bits in the parameters, 32 if not given.
+    """
+    register_uuid(conn_or_curs=cur)
+    minhash_bits = (sketch_params or {}).get("minhash_bits", 32)
+    # Save column sketches in one multi-row upsert. A column name appearing
+    # more than once keeps its last sketch, as a row cannot be updated twice
+    # by the same statement.
+    sketches = dict((sketch.column_name, sketch)
+            for sketch in table_sketch.column_sketches)
+    rows = execute_values(cur, r"""INSERT INTO findopendata.column_sketches
+            (
+                package_file_key,
+                id,
+                column_name,
+                sample,
+                count,
+                empty_count,
+                out_of_vocabulary_count,
+                numeric_count,
+                distinct_count,
+                word_vector_column_name,
+                word_vector_data,
+                minhash,
+                minhash_bits,
+                seed,
+                hyperloglog
+            )
+            VALUES %s
+            ON CONFLICT (package_file_key, column_name)
+            DO UPDATE
+            SET updated = current_timestamp,
+            sample = EXCLUDED.sample,
+            count = EXCLUDED.count,
+            empty_count = EXCLUDED.empty_count,
+            out_of_vocabulary_count = EXCLUDED.out_of_vocabulary_count,
+            numeric_count = EXCLUDED.numeric_count,
+            distinct_count = EXCLUDED.distinct_count,
+            word_vector_column_name = EXCLUDED.word_vector_column_name,
+            word_vector_data = EXCLUDED.word_vector_data,
+            minhash = EXCLUDED.minhash,
+            minhash_bits = EXCLUDED.minhash_bits,
+            seed = EXCLUDED.seed,
+            hyperloglog = EXCLUDED.hyperloglog
+            RETURNING column_name, id::uuid
+            """, [(
+                package_file_key,
+                sketch.column_name,
+                sketch.sample,
+                sketch.count,
+                sketch.empty_count,
+                sketch.out_of_vocabulary_count,
+                sketch.numeric_count,
+                sketch.distinct_count,
+                sketch.word_vector_column_name,
+                sketch.word_vector_data,
+                encode_minhash(sketch.minhash, minhash_bits),
+                minhash_bits,
+                sketch.seed,
+                encode_hyperloglog(sketch.hyperloglog),
+                ) for sketch in sketches.values()],
+            template="(%s, uuid_generate_v1mc(), "
+                "%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            page_size=max(len(sketches), 1), fetch=True)
+    # The returned rows are not ordered, so map the IDs back to the columns.
+    ids = dict((row["column_name"], row["id"]) for row in rows)
+    column_sketch_ids = [ids[sketch.column_name]
+            for sketch in table_sketch.column_sketches]
+    # Save table samples, column names and column sketch IDs, and what the
+    # sketches were created from.
+    cur.execute(r"""UPDATE findopendata.package_files
+                    SET column_names = %s,
+                    column_sketch_ids = %s,
+                    sample = %s,
+                    sketch_fingerprint = %s,
+                    sketch_params = %s
+                    WHERE key = %s
+                    """, (
+                        table_sketch.column_names,
+                        column_sketch_ids,
+                        Json(table_sketch.record_sample),
+                        content_fingerprint,
+                        Json(sketch_params) if sketch_params is not None
+                            else None,
+                        package_file_key,
+                        ))
+
+
 @app.task(ignore_result=True)
 def sketch_package_file(package_file_key,
         blob_name,
@@ -66,7 +218,9 @@ def sketch_package_file(package_file_key,
         minhash_seed,
         hyperloglog_p,
         column_sample_size,
-        enable_word_vector_data):
+        enable_word_vector_data,
+        content_fingerprint=None,
+        minhash_bits=32):
     """Generate column sketches and table sample of the table in the
     package file.
 
@@ -84,13 +238,16 @@ def sketch_package_file(package_file_key,
         column_sample_size: the number of non-random sampled values.
         enable_word_vector_data: whether to create word vectors for the
             data values -- this can be 10x more expensive.
+        content_fingerprint: the fingerprint of the content of the package
+            file, saved with the sketches.
+        minhash_bits: the number of bits saved of each MinHash hash value,
+            one of 8, 16 and 32.
     """
     # Get sketcher
-    if dataset_format not in _sketchers:
-        raise ValueError("{} is not supported".format(dataset_format))
-    sketcher = _sketchers[dataset_format]
+    sketcher = get_sketcher(dataset_format)
 
     # Sketch the file.
+    start = time.perf_counter()
     try:
         with storage.get_file(blob_name) as input_file:
             table_sketch = sketcher(input_file,
@@ -100,92 +257,44 @@ def sketch_package_file(package_file_key,
                     minhash_seed=minhash_seed,
                     hyperloglog_p=hyperloglog_p,
                     sample_size=column_sample_size,
-                    enable_word_vector_data=enable_word_vector_data
+                    enable_word_vector_data=enable_word_vector_data,
+                    **get_sketch_memory_limits(index_configs)
                     )
     except Exception as e:
         logger.error("Sketching {} ({}) failed due to {}".format(
             blob_name, package_file_key, e))
         raise e
+    _phase_seconds.observe(time.perf_counter() - start,
+            task="sketch_package_file", phase="sketch")
+    logger.info("Sketched {} ({}): {}".format(blob_name, package_file_key,
+        table_sketch.memory_usage))
 
+    start = time.perf_counter()
     try:
         # Save sketches to the database
-        # Initialize Postgres connection.
-        conn = psycopg2.connect(**db_configs)
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        register_uuid(conn_or_curs=cur)
-        # Save column sketches
-        column_sketch_ids = []
-        for sketch in table_sketch.column_sketches:
-            cur.execute(r"""INSERT INTO findopendata.column_sketches
-                    (
-                        package_file_key,
-                        id,
-                        column_name,
-                        sample,
-                        count,
-                        empty_count,
-                        out_of_vocabulary_count,
-                        numeric_count,
-                        distinct_count,
-                        word_vector_column_name,
-                        word_vector_data,
-                        minhash,
-                        seed,
-                        hyperloglog
-                    )
-                    VALUES (%s, uuid_generate_v1mc(),
-                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (package_file_key, column_name)
-                    DO UPDATE
-                    SET updated = current_timestamp,
-                    sample = EXCLUDED.sample,
-                    count = EXCLUDED.count,
-                    empty_count = EXCLUDED.empty_count,
-                    out_of_vocabulary_count = EXCLUDED.out_of_vocabulary_count,
-                    numeric_count = EXCLUDED.numeric_count,
-                    distinct_count = EXCLUDED.distinct_count,
-                    word_vector_column_name = EXCLUDED.word_vector_column_name,
-                    word_vector_data = EXCLUDED.word_vector_data,
-                    minhash = EXCLUDED.minhash,
-                    seed = EXCLUDED.seed,
-                    hyperloglog = EXCLUDED.hyperloglog
-                    RETURNING id::uuid
-                    """, (
-                        package_file_key,
-                        sketch.column_name,
-                        sketch.sample,
-                        sketch.count,
-                        sketch.empty_count,
-                        sketch.out_of_vocabulary_count,
-                        sketch.numeric_count,
-                        sketch.distinct_count,
-                        sketch.word_vector_column_name,
-                        sketch.word_vector_data,
-                        sketch.minhash,
-                        sketch.seed,
-                        sketch.hyperloglog,
-                        ))
-            column_sketch_ids.append(cur.fetchone()["id"])
-        # Save table samples, column names and column sketch IDs.
-        cur.execute(r"""UPDATE findopendata.package_files
-                        SET column_names = %s,
-                        column_sketch_ids = %s,
-                        sample = %s
-                        WHERE key = %s
-                        """, (
-                            table_sketch.column_names,
-                            column_sketch_ids,
-                            Json(table_sketch.record_sample),
-                            package_file_key,
-                            ))
-        # Commit
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Get a Postgres connection from the pool.
+        with get_connection() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            save_table_sketch(cur, package_file_key, table_sketch,
+                    content_fingerprint=content_fingerprint,
+                    sketch_params=dict(
+                        max_records=max_records,
+                        table_sample_size=table_sample_size,
+                        minhash_size=minhash_size,
+                        minhash_seed=minhash_seed,
+                        hyperloglog_p=hyperloglog_p,
+                        column_sample_size=column_sample_size,
+                        enable_word_vector_data=enable_word_vector_data,
+                        minhash_bits=minhash_bits))
+            # Commit
+            conn.commit()
+            cur.close()
     except Exception as e:
         logger.error("Error saving sketches of {} ({}) due to {}".format(
             blob_name, package_file_key, e))
         raise e
+    _phase_seconds.observe(time.perf_counter() - start,
+            task="sketch_package_file", phase="save")
 
     # Finish
     logger.info("Sketching {} ({}) successful".format(blob_name,
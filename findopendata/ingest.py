@@ -0,0 +1,154 @@
+"""Single-pass ingest: sketching a dataset while it is being downloaded.
+
+The download stream is teed into a StreamSketcher, which parses and sketches
+the bytes on a background thread, so the dataset does not need to be read
+back from the storage to be sketched.
+"""
+import io
+import queue
+import threading
+
+
+class _PipeReader(io.BufferedIOBase):
+    """A readonly binary file fed with chunks of bytes from another thread.
+    The first head_size bytes are retained so the parsers can seek to the
+    beginning after guessing encoding and dialect.
+    """
+
+    def __init__(self, chunks, head_size):
+        self._chunks = chunks
+        self._head_size = head_size
+        self._data = bytearray()
+        # The stream position of the first byte in _data.
+        self._base = 0
+        self._pos = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _fill(self, size):
+        while not self._eof and (size is None or size < 0 or
+                self._base + len(self._data) - self._pos < size):
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._data += chunk
+
+    def read(self, size=-1):
+        self._fill(size)
+        start = self._pos - self._base
+        if size is None or size < 0:
+            end = len(self._data)
+        else:
+            end = min(start + size, len(self._data))
+        data = bytes(self._data[start:end])
+        self._pos += len(data)
+        # Release the bytes already read once past the head.
+        if self._pos > self._head_size:
+            del self._data[:self._pos - self._base]
+            self._base = self._pos
+        return data
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Only seeking from the beginning "
+                    "or current position is supported.")
+        if offset < self._base or offset > self._base + len(self._data):
+            raise io.UnsupportedOperation("Cannot seek to {} outside of the "
+                    "buffered head of the stream.".format(offset))
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class StreamSketcher(object):
+    """Sketches a dataset from chunks of bytes fed by the downloading thread.
+    Sketching runs on a background thread that is started when entering the
+    context and joined when exiting it.
+
+    Example:
+
+        with StreamSketcher(get_sketcher("csv"), **sketch_kwargs) as sketcher:
+            download_to_storage(url, storage, blob_dir,
+                    on_read=sketcher.feed)
+        table_sketch = sketcher.result()
+
+    If sketching fails or stops early (e.g., after max_records), the
+    remaining chunks are dropped without blocking the download.
+
+    Args:
+        sketcher: the sketcher function that takes a binary file object
+            and keyword arguments and returns a TableSketch, see
+            indexing.get_sketcher.
+        head_size: the number of bytes in the beginning of the stream that
+            are retained for the parser to seek back to, it must cover the
+            bytes read for guessing encoding and dialect.
+        max_queued_chunks: the maximum number of chunks waiting to be
+            sketched before the download is slowed down.
+        sketch_kwargs: keyword arguments for the sketcher.
+    """
+
+    def __init__(self, sketcher, head_size=1024*1024,
+            max_queued_chunks=64, **sketch_kwargs):
+        self._sketcher = sketcher
+        self._sketch_kwargs = sketch_kwargs
+        self._chunks = queue.Queue(maxsize=max_queued_chunks)
+        self._reader = _PipeReader(self._chunks, head_size)
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._table_sketch = None
+        self._error = None
+
+    def _run(self):
+        try:
+            self._table_sketch = self._sketcher(self._reader,
+                    **self._sketch_kwargs)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done.set()
+
+    def _put(self, chunk):
+        while not self._done.is_set():
+            try:
+                self._chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def feed(self, chunk):
+        """Feed the next chunk of bytes of the dataset."""
+        if chunk:
+            self._put(bytes(chunk))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        # Signal the end of the stream.
+        self._put(None)
+        self._thread.join()
+
+    def result(self):
+        """Get the TableSketch, raising the error if sketching failed."""
+        if self._error is not None:
+            raise self._error
+        return self._table_sketch
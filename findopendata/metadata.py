@@ -1,7 +1,7 @@
 import os
+import collections
 
-import psycopg2
-from psycopg2.extras import Json, RealDictCursor
+from psycopg2.extras import Json, RealDictCursor, execute_values
 from celery.utils.log import get_task_logger
 import spacy
 from bs4 import BeautifulSoup
@@ -9,8 +9,11 @@ import requests
 
 from .celery import app
 from .storage.objects import storage
-from .settings import db_configs
+from .storage.aio import get_objects
+from .db import get_connection
 from .models.language_models import LanguageModel as lm
+from .indexing import save_table_sketch
+from .table_sketch import TableSketch
 
 
 logger = get_task_logger(__name__)
@@ -35,14 +38,15 @@ def index_ckan_package(
     # Get package metadata
     package = storage.get_object(package_blob_name)
 
-    # Get connection.
-    conn = psycopg2.connect(**db_configs)
     # Get CKAN resources
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("""SELECT key, filename, resource_blob, file_size, raw_metadata
-            FROM findopendata.ckan_resources where package_key = %s""",
-            (crawler_package_key,))
-    resources = [row for row in cur]
+    with get_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT key, filename, resource_blob, file_size,
+                raw_metadata, sketch_blob, content_fingerprint
+                FROM findopendata.ckan_resources where package_key = %s""",
+                (crawler_package_key,))
+        resources = [row for row in cur]
+        cur.close()
 
     # Parse package metadata
     created = package.get("metadata_created", None)
@@ -71,79 +75,81 @@ def index_ckan_package(
     original_host = endpoint
     num_files = len(resources)
 
-    # Save package
-    cur.execute(r"""INSERT INTO findopendata.packages
-            (
-                crawler_table,
-                crawler_key,
-                id,
-                original_host,
-                num_files,
-                created,
-                modified,
-                title,
-                title_spacy,
-                name,
-                description,
-                description_spacy,
-                tags,
-                license_title,
-                license_url,
-                organization_display_name,
-                organization_name,
-                organization_image_url,
-                organization_description,
-                raw_metadata
-            )
-            VALUES (
-                %s, %s, uuid_generate_v1mc(), %s, %s,
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-            )
-            ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
-            original_host = EXCLUDED.original_host,
-            num_files = EXCLUDED.num_files,
-            updated = current_timestamp,
-            created = EXCLUDED.created,
-            modified = EXCLUDED.modified,
-            title = EXCLUDED.title,
-            title_spacy = EXCLUDED.title_spacy,
-            name = EXCLUDED.name,
-            description = EXCLUDED.description,
-            description_spacy = EXCLUDED.description_spacy,
-            tags = EXCLUDED.tags,
-            license_title = EXCLUDED.license_title,
-            license_url = EXCLUDED.license_url,
-            organization_display_name = EXCLUDED.organization_display_name,
-            organization_name = EXCLUDED.organization_name,
-            organization_image_url = EXCLUDED.organization_image_url,
-            organization_description = EXCLUDED.organization_description,
-            raw_metadata = EXCLUDED.raw_metadata
-            RETURNING key;""",
-            (
-                crawler_table,
-                crawler_key,
-                original_host,
-                num_files,
-                created,
-                modified,
-                title,
-                Json(title_spacy),
-                name,
-                description,
-                Json(description_spacy),
-                tags,
-                license_title,
-                license_url,
-                organization_display_name,
-                organization_name,
-                organization_image_url,
-                organization_description,
-                Json(raw_metadata),
-            ))
-    package_key = cur.fetchone()["key"]
-    # Commit all changes.
-    conn.commit()
-    conn.close()
+    # Get a connection from the pool.
+    with get_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # Save package
+        cur.execute(r"""INSERT INTO findopendata.packages
+                (
+                    crawler_table,
+                    crawler_key,
+                    id,
+                    original_host,
+                    num_files,
+                    created,
+                    modified,
+                    title,
+                    title_spacy,
+                    name,
+                    description,
+                    description_spacy,
+                    tags,
+                    license_title,
+                    license_url,
+                    organization_display_name,
+                    organization_name,
+                    organization_image_url,
+                    organization_description,
+                    raw_metadata
+                )
+                VALUES (
+                    %s, %s, uuid_generate_v1mc(), %s, %s,
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                )
+                ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
+                original_host = EXCLUDED.original_host,
+                num_files = EXCLUDED.num_files,
+                updated = current_timestamp,
+                created = EXCLUDED.created,
+                modified = EXCLUDED.modified,
+                title = EXCLUDED.title,
+                title_spacy = EXCLUDED.title_spacy,
+                name = EXCLUDED.name,
+                description = EXCLUDED.description,
+                description_spacy = EXCLUDED.description_spacy,
+                tags = EXCLUDED.tags,
+                license_title = EXCLUDED.license_title,
+                license_url = EXCLUDED.license_url,
+                organization_display_name = EXCLUDED.organization_display_name,
+                organization_name = EXCLUDED.organization_name,
+                organization_image_url = EXCLUDED.organization_image_url,
+                organization_description = EXCLUDED.organization_description,
+                raw_metadata = EXCLUDED.raw_metadata
+                RETURNING key;""",
+                (
+                    crawler_table,
+                    crawler_key,
+                    original_host,
+                    num_files,
+                    created,
+                    modified,
+                    title,
+                    Json(title_spacy),
+                    name,
+                    description,
+                    Json(description_spacy),
+                    tags,
+                    license_title,
+                    license_url,
+                    organization_display_name,
+                    organization_name,
+                    organization_image_url,
+                    organization_description,
+                    Json(raw_metadata),
+                ))
+        package_key = cur.fetchone()["key"]
+        # Commit all changes.
+        conn.commit()
     logger.info("Indexed CKAN package {} and {} package files".format(
         crawler_package_key, len(resources)))
 
@@ -154,7 +160,9 @@ def index_ckan_package(
                 blob_name=resource["resource_blob"],
                 filename=resource["filename"],
                 file_size=resource["file_size"],
-                raw_metadata=resource["raw_metadata"])
+                raw_metadata=resource["raw_metadata"],
+                sketch_blob=resource["sketch_blob"],
+                content_fingerprint=resource["content_fingerprint"])
 
 
 @app.task(ignore_result=True)
@@ -164,10 +172,14 @@ def index_ckan_package_file(
         blob_name,
         filename,
         file_size,
-        raw_metadata):
+        raw_metadata,
+        sketch_blob=None,
+        content_fingerprint=None):
     """Register the CKAN resource into the package_files table by doing the
     following:
         1. Extract metadata such as name and description from the source JSON.
+        2. Save the sketches created during ingest, if available, so the
+            package file does not need to be sketched again.
 
     Args:
         crawler_resource_key: the primary key of the ckan_resources table.
@@ -177,6 +189,10 @@ def index_ckan_package_file(
         file_size: the file size in bytes.
         raw_metadata: the 'resource' extracted from the CKAN's package JSON
             corresponding to this package file.
+        sketch_blob: the relative path to the blob of the TableSketch state
+            created during ingest.
+        content_fingerprint: the fingerprint of the content of the package
+            file given by the crawler.
     """
     # Extract metadata from raw_metadata
     crawler_table = "ckan_resources"
@@ -189,74 +205,329 @@ def index_ckan_package_file(
     original_url = raw_metadata.get("url", None)
     file_format = raw_metadata.get("format", None)
 
-    # Get connection.
-    conn = psycopg2.connect(**db_configs)
-    # Save CKAN pacakge file
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute(r"""INSERT INTO findopendata.package_files
-            (
-                package_key,
-                crawler_table,
-                crawler_key,
-                id,
-                created,
-                modified,
-                filename,
-                name,
-                description,
-                description_spacy,
-                original_url,
-                format,
-                file_size,
-                blob_name,
-                raw_metadata
-            ) VALUES
-            (%s, %s, %s, uuid_generate_v1mc(), %s, %s,
-            %s, %s, %s, %s, %s, %s, %s, %s,
-            %s) ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
-            updated = current_timestamp,
-            created = EXCLUDED.created,
-            modified = EXCLUDED.modified,
-            filename = EXCLUDED.filename,
-            name = EXCLUDED.name,
-            description = EXCLUDED.description,
-            description_spacy = EXCLUDED.description_spacy,
-            original_url = EXCLUDED.original_url,
-            format = EXCLUDED.format,
-            file_size = EXCLUDED.file_size,
-            blob_name = EXCLUDED.blob_name,
-            raw_metadata = EXCLUDED.raw_metadata
-            RETURNING key;""",
-            (
-                package_key,
-                crawler_table,
-                crawler_resource_key,
-                created,
-                modified,
-                filename,
-                name,
-                description,
-                Json(description_spacy),
-                original_url,
-                file_format,
-                file_size,
-                blob_name,
-                Json(raw_metadata)
-            ))
-    # Commit all changes.
-    conn.commit()
-    conn.close()
+    # Get a connection from the pool.
+    with get_connection() as conn:
+        # Save CKAN pacakge file
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(r"""INSERT INTO findopendata.package_files
+                (
+                    package_key,
+                    crawler_table,
+                    crawler_key,
+                    id,
+                    created,
+                    modified,
+                    filename,
+                    name,
+                    description,
+                    description_spacy,
+                    original_url,
+                    format,
+                    file_size,
+                    blob_name,
+                    raw_metadata,
+                    content_fingerprint
+                ) VALUES
+                (%s, %s, %s, uuid_generate_v1mc(), %s, %s,
+                %s, %s, %s, %s, %s, %s, %s, %s,
+                %s, %s) ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
+                updated = current_timestamp,
+                created = EXCLUDED.created,
+                modified = EXCLUDED.modified,
+                filename = EXCLUDED.filename,
+                name = EXCLUDED.name,
+                description = EXCLUDED.description,
+                description_spacy = EXCLUDED.description_spacy,
+                original_url = EXCLUDED.original_url,
+                format = EXCLUDED.format,
+                file_size = EXCLUDED.file_size,
+                blob_name = EXCLUDED.blob_name,
+                raw_metadata = EXCLUDED.raw_metadata,
+                content_fingerprint = EXCLUDED.content_fingerprint
+                RETURNING key;""",
+                (
+                    package_key,
+                    crawler_table,
+                    crawler_resource_key,
+                    created,
+                    modified,
+                    filename,
+                    name,
+                    description,
+                    Json(description_spacy),
+                    original_url,
+                    file_format,
+                    file_size,
+                    blob_name,
+                    Json(raw_metadata),
+                    content_fingerprint,
+                ))
+        package_file_key = cur.fetchone()["key"]
+        # Save the sketches created during ingest.
+        if sketch_blob is not None:
+            try:
+                state = storage.get_object(sketch_blob)
+                table_sketch = TableSketch.from_state(state)
+            except Exception as e:
+                logger.warning("Failed to load sketch {} of CKAN resource {}: "
+                        "{}".format(sketch_blob, crawler_resource_key, e))
+            else:
+                save_table_sketch(cur, package_file_key, table_sketch,
+                        content_fingerprint=content_fingerprint,
+                        sketch_params=state.get("sketch_params"))
+        # Commit all changes.
+        conn.commit()
     logger.info("Indexed CKAN resource {} into package_files".format(
         crawler_resource_key))
 
 
+@app.task(ignore_result=True)
+def index_ckan_packages(packages):
+    """The batch version of index_ckan_package: register the crawled CKAN
+    packages and their resources (i.e., package files) in one task. The
+    package JSON files are read concurrently, the titles and descriptions
+    are processed by the language model in one batch, and the packages and
+    package files are saved with multi-row upserts in one transaction.
+
+    Args:
+        packages: a list of (crawler_package_key, package_blob_name,
+            endpoint) of the packages.
+    """
+    packages = dict((key, (blob_name, endpoint))
+            for key, blob_name, endpoint in packages)
+    crawler_keys = list(packages.keys())
+
+    # Get package metadata.
+    package_jsons = get_objects(storage,
+            [packages[key][0] for key in crawler_keys],
+            return_exceptions=True)
+    package_metadata = {}
+    for key, package in zip(crawler_keys, package_jsons):
+        if isinstance(package, Exception):
+            logger.warning("Failed to read CKAN package {} from {}: "
+                    "{}".format(key, packages[key][0], package))
+            continue
+        package_metadata[key] = package
+    crawler_keys = [key for key in crawler_keys if key in package_metadata]
+    if not crawler_keys:
+        return
+
+    # Get CKAN resources of all packages.
+    with get_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute("""SELECT key, package_key, filename, resource_blob,
+                file_size, raw_metadata, sketch_blob, content_fingerprint
+                FROM findopendata.ckan_resources
+                WHERE package_key = ANY(%s)""", (crawler_keys,))
+        resources = [row for row in cur]
+        cur.close()
+
+    # Get the sketches created during ingest.
+    sketch_resources = [r for r in resources if r["sketch_blob"] is not None]
+    sketch_states = get_objects(storage,
+            [r["sketch_blob"] for r in sketch_resources],
+            return_exceptions=True)
+    table_sketches = {}
+    for resource, state in zip(sketch_resources, sketch_states):
+        try:
+            if isinstance(state, Exception):
+                raise state
+            table_sketches[resource["key"]] = (
+                    TableSketch.from_state(state), state.get("sketch_params"))
+        except Exception as e:
+            logger.warning("Failed to load sketch {} of CKAN resource {}: "
+                    "{}".format(resource["sketch_blob"], resource["key"], e))
+
+    # Parse package and resource metadata, and process all texts in one
+    # batch.
+    package_texts = dict((key, (
+        BeautifulSoup(package_metadata[key].get("title", ""),
+            "html.parser").get_text(),
+        BeautifulSoup(package_metadata[key].get("notes", ""),
+            "html.parser").get_text())) for key in crawler_keys)
+    resource_texts = dict((r["key"], BeautifulSoup(
+        r["raw_metadata"].get("description", ""), "html.parser").get_text())
+        for r in resources)
+    texts = [text for key in crawler_keys for text in package_texts[key]] + \
+            [resource_texts[r["key"]] for r in resources]
+    docs = [doc.to_json() for doc in lm.pipe(texts)]
+    num_files = collections.Counter(r["package_key"] for r in resources)
+    package_rows = []
+    for i, key in enumerate(crawler_keys):
+        package = package_metadata[key]
+        endpoint = packages[key][1]
+        title, description = package_texts[key]
+        organization = package.get("organization", {})
+        organization_name = organization.get("name", None)
+        if organization_name is not None:
+            organization_name = "{}:{}".format(endpoint, organization_name)
+        package_rows.append((
+            "ckan_packages",
+            key,
+            endpoint,
+            num_files[key],
+            package.get("metadata_created", None),
+            package.get("metadata_modified", None),
+            title,
+            Json(docs[2*i]),
+            package.get("name", None),
+            description,
+            Json(docs[2*i+1]),
+            [tag["name"] for tag in package.get("tags", []) if "name" in tag],
+            package.get("license_title", None),
+            package.get("license_url", None),
+            organization.get("title", None),
+            organization_name,
+            organization.get("image_url", None),
+            organization.get("description", None),
+            Json(package),
+            ))
+
+    with get_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+
+        # Save packages.
+        rows = execute_values(cur, r"""INSERT INTO findopendata.packages
+                (
+                    crawler_table,
+                    crawler_key,
+                    id,
+                    original_host,
+                    num_files,
+                    created,
+                    modified,
+                    title,
+                    title_spacy,
+                    name,
+                    description,
+                    description_spacy,
+                    tags,
+                    license_title,
+                    license_url,
+                    organization_display_name,
+                    organization_name,
+                    organization_image_url,
+                    organization_description,
+                    raw_metadata
+                )
+                VALUES %s
+                ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
+                original_host = EXCLUDED.original_host,
+                num_files = EXCLUDED.num_files,
+                updated = current_timestamp,
+                created = EXCLUDED.created,
+                modified = EXCLUDED.modified,
+                title = EXCLUDED.title,
+                title_spacy = EXCLUDED.title_spacy,
+                name = EXCLUDED.name,
+                description = EXCLUDED.description,
+                description_spacy = EXCLUDED.description_spacy,
+                tags = EXCLUDED.tags,
+                license_title = EXCLUDED.license_title,
+                license_url = EXCLUDED.license_url,
+                organization_display_name = EXCLUDED.organization_display_name,
+                organization_name = EXCLUDED.organization_name,
+                organization_image_url = EXCLUDED.organization_image_url,
+                organization_description = EXCLUDED.organization_description,
+                raw_metadata = EXCLUDED.raw_metadata
+                RETURNING crawler_key, key;""", package_rows,
+                template="(%s, %s, uuid_generate_v1mc(), %s, %s, "
+                    "%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, "
+                    "%s)",
+                page_size=len(package_rows), fetch=True)
+        package_keys = dict((row["crawler_key"], row["key"]) for row in rows)
+
+        # Save package files.
+        resource_rows = []
+        for i, resource in enumerate(resources):
+            raw_metadata = resource["raw_metadata"]
+            resource_rows.append((
+                package_keys[resource["package_key"]],
+                "ckan_resources",
+                resource["key"],
+                raw_metadata.get("created", None),
+                raw_metadata.get("last_modified", None),
+                resource["filename"],
+                raw_metadata.get("name", None),
+                resource_texts[resource["key"]],
+                Json(docs[2*len(crawler_keys)+i]),
+                raw_metadata.get("url", None),
+                raw_metadata.get("format", None),
+                resource["file_size"],
+                resource["resource_blob"],
+                Json(raw_metadata),
+                resource["content_fingerprint"],
+                ))
+        package_file_keys = {}
+        fingerprints = dict((r["key"], r["content_fingerprint"])
+                for r in resources)
+        if resource_rows:
+            rows = execute_values(cur,
+                    r"""INSERT INTO findopendata.package_files
+                    (
+                        package_key,
+                        crawler_table,
+                        crawler_key,
+                        id,
+                        created,
+                        modified,
+                        filename,
+                        name,
+                        description,
+                        description_spacy,
+                        original_url,
+                        format,
+                        file_size,
+                        blob_name,
+                        raw_metadata,
+                        content_fingerprint
+                    )
+                    VALUES %s
+                    ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
+                    updated = current_timestamp,
+                    created = EXCLUDED.created,
+                    modified = EXCLUDED.modified,
+                    filename = EXCLUDED.filename,
+                    name = EXCLUDED.name,
+                    description = EXCLUDED.description,
+                    description_spacy = EXCLUDED.description_spacy,
+                    original_url = EXCLUDED.original_url,
+                    format = EXCLUDED.format,
+                    file_size = EXCLUDED.file_size,
+                    blob_name = EXCLUDED.blob_name,
+                    raw_metadata = EXCLUDED.raw_metadata,
+                    content_fingerprint = EXCLUDED.content_fingerprint
+                    RETURNING crawler_key, key;""", resource_rows,
+                    template="(%s, %s, %s, uuid_generate_v1mc(), %s, %s, "
+                        "%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    page_size=len(resource_rows), fetch=True)
+            package_file_keys = dict((row["crawler_key"], row["key"])
+                    for row in rows)
+
+        # Save the sketches created during ingest.
+        for resource_key, (table_sketch, sketch_params) in \
+                table_sketches.items():
+            save_table_sketch(cur, package_file_keys[resource_key],
+                    table_sketch,
+                    content_fingerprint=fingerprints[resource_key],
+                    sketch_params=sketch_params)
+
+        # Commit all changes.
+        conn.commit()
+        cur.close()
+    logger.info("Indexed {} CKAN packages and {} package files".format(
+        len(package_rows), len(resource_rows)))
+
+
 @app.task(ignore_result=True)
 def index_socrata_resource(
         crawler_key,
         domain,
         metadata_blob_name,
         resource_blob_name,
-        dataset_size):
+        dataset_size,
+        content_fingerprint=None,
+        sketch_blob=None):
     """Register the crawled Scorata resource into the centralized packages
     table for all types of packages to make it searchable.
     The following processes are performed:
@@ -265,6 +536,8 @@ def index_socrata_resource(
         2. Create the fulltext search doc for keyword search.
         3. Extract named entities from the title and description for
             metadata enrichment.
+        4. Save the sketches created during download, if available, so the
+            package file does not need to be sketched again.
     """
     # Get raw metadata
     metadata = storage.get_object(metadata_blob_name)
@@ -290,132 +563,146 @@ def index_socrata_resource(
     original_host = domain
     num_files = 1
 
-    # Get connection.
-    conn = psycopg2.connect(**db_configs)
-    # Get CKAN resources
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    # Save package
-    cur.execute(r"""INSERT INTO findopendata.packages
-            (
-                crawler_table,
-                crawler_key,
-                id,
-                original_host,
-                num_files,
-                created,
-                modified,
-                title,
-                title_spacy,
-                name,
-                description,
-                description_spacy,
-                tags,
-                license_title,
-                license_url,
-                organization_display_name,
-                organization_name,
-                organization_image_url,
-                organization_description,
-                raw_metadata
-            )
-            VALUES (
-                %s, %s, uuid_generate_v1mc(), %s, %s,
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-            )
-            ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
-            original_host = EXCLUDED.original_host,
-            num_files = EXCLUDED.num_files,
-            updated = current_timestamp,
-            created = EXCLUDED.created,
-            modified = EXCLUDED.modified,
-            title = EXCLUDED.title,
-            title_spacy = EXCLUDED.title_spacy,
-            name = EXCLUDED.name,
-            description = EXCLUDED.description,
-            description_spacy = EXCLUDED.description_spacy,
-            tags = EXCLUDED.tags,
-            license_title = EXCLUDED.license_title,
-            license_url = EXCLUDED.license_url,
-            organization_display_name = EXCLUDED.organization_display_name,
-            organization_name = EXCLUDED.organization_name,
-            organization_image_url = EXCLUDED.organization_image_url,
-            organization_description = EXCLUDED.organization_description,
-            raw_metadata = EXCLUDED.raw_metadata
-            RETURNING key;""",
-            (
-                crawler_table,
-                crawler_key,
-                original_host,
-                num_files,
-                created,
-                modified,
-                title,
-                Json(title_spacy),
-                name,
-                description,
-                Json(description_spacy),
-                tags,
-                license_title,
-                license_url,
-                organization_display_name,
-                organization_name,
-                organization_image_url,
-                organization_description,
-                Json(metadata),
-            ))
-    package_key = cur.fetchone()["key"]
+    # Get a connection from the pool.
+    with get_connection() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
 
-    # Package file fields extracted
-    created = metadata["resource"].get("createdAt")
-    modified = metadata["resource"].get("data_updated_at")
-    original_url = metadata["link"]
-    file_format = 'AVRO'
-    file_size = dataset_size
-    blob_name = resource_blob_name
-    raw_metadata = metadata["resource"]
-
-    # Save pacakge file:
-    cur.execute(r"""INSERT INTO findopendata.package_files
-            (
-                package_key,
-                crawler_table,
-                crawler_key,
-                id,
-                created,
-                modified,
-                original_url,
-                format,
-                file_size,
-                blob_name,
-                raw_metadata
-            ) VALUES
-            (%s, %s, %s, uuid_generate_v1mc(), %s,
-            %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
-            updated = current_timestamp,
-            created = EXCLUDED.created,
-            modified = EXCLUDED.modified,
-            original_url = EXCLUDED.original_url,
-            format = EXCLUDED.format,
-            file_size = EXCLUDED.file_size,
-            blob_name = EXCLUDED.blob_name,
-            raw_metadata = EXCLUDED.raw_metadata
-            RETURNING key;""",
-            (
-                package_key,
-                crawler_table,
-                crawler_key,
-                created,
-                modified,
-                original_url,
-                file_format,
-                file_size,
-                blob_name,
-                Json(raw_metadata)
-            ))
+        # Save package
+        cur.execute(r"""INSERT INTO findopendata.packages
+                (
+                    crawler_table,
+                    crawler_key,
+                    id,
+                    original_host,
+                    num_files,
+                    created,
+                    modified,
+                    title,
+                    title_spacy,
+                    name,
+                    description,
+                    description_spacy,
+                    tags,
+                    license_title,
+                    license_url,
+                    organization_display_name,
+                    organization_name,
+                    organization_image_url,
+                    organization_description,
+                    raw_metadata
+                )
+                VALUES (
+                    %s, %s, uuid_generate_v1mc(), %s, %s,
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                )
+                ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
+                original_host = EXCLUDED.original_host,
+                num_files = EXCLUDED.num_files,
+                updated = current_timestamp,
+                created = EXCLUDED.created,
+                modified = EXCLUDED.modified,
+                title = EXCLUDED.title,
+                title_spacy = EXCLUDED.title_spacy,
+                name = EXCLUDED.name,
+                description = EXCLUDED.description,
+                description_spacy = EXCLUDED.description_spacy,
+                tags = EXCLUDED.tags,
+                license_title = EXCLUDED.license_title,
+                license_url = EXCLUDED.license_url,
+                organization_display_name = EXCLUDED.organization_display_name,
+                organization_name = EXCLUDED.organization_name,
+                organization_image_url = EXCLUDED.organization_image_url,
+                organization_description = EXCLUDED.organization_description,
+                raw_metadata = EXCLUDED.raw_metadata
+                RETURNING key;""",
+                (
+                    crawler_table,
+                    crawler_key,
+                    original_host,
+                    num_files,
+                    created,
+                    modified,
+                    title,
+                    Json(title_spacy),
+                    name,
+                    description,
+                    Json(description_spacy),
+                    tags,
+                    license_title,
+                    license_url,
+                    organization_display_name,
+                    organization_name,
+                    organization_image_url,
+                    organization_description,
+                    Json(metadata),
+                ))
+        package_key = cur.fetchone()["key"]
+
+        # Package file fields extracted
+        created = metadata["resource"].get("createdAt")
+        modified = metadata["resource"].get("data_updated_at")
+        original_url = metadata["link"]
+        file_format = 'AVRO'
+        file_size = dataset_size
+        blob_name = resource_blob_name
+        raw_metadata = metadata["resource"]
+
+        # Save pacakge file:
+        cur.execute(r"""INSERT INTO findopendata.package_files
+                (
+                    package_key,
+                    crawler_table,
+                    crawler_key,
+                    id,
+                    created,
+                    modified,
+                    original_url,
+                    format,
+                    file_size,
+                    blob_name,
+                    raw_metadata,
+                    content_fingerprint
+                ) VALUES
+                (%s, %s, %s, uuid_generate_v1mc(), %s,
+                %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (crawler_table, crawler_key) DO UPDATE SET
+                updated = current_timestamp,
+                created = EXCLUDED.created,
+                modified = EXCLUDED.modified,
+                original_url = EXCLUDED.original_url,
+                format = EXCLUDED.format,
+                file_size = EXCLUDED.file_size,
+                blob_name = EXCLUDED.blob_name,
+                raw_metadata = EXCLUDED.raw_metadata,
+                content_fingerprint = EXCLUDED.content_fingerprint
+                RETURNING key;""",
+                (
+                    package_key,
+                    crawler_table,
+                    crawler_key,
+                    created,
+                    modified,
+                    original_url,
+                    file_format,
+                    file_size,
+                    blob_name,
+                    Json(raw_metadata),
+                    content_fingerprint,
+                ))
+        package_file_key = cur.fetchone()["key"]
+        # Save the sketches created during download.
+        if sketch_blob is not None:
+            try:
+                state = storage.get_object(sketch_blob)
+                table_sketch = TableSketch.from_state(state)
+            except Exception as e:
+                logger.warning("Failed to load sketch {} of Socrata resource "
+                        "{}: {}".format(sketch_blob, crawler_key, e))
+            else:
+                save_table_sketch(cur, package_file_key, table_sketch,
+                        content_fingerprint=content_fingerprint,
+                        sketch_params=state.get("sketch_params"))
 
-    # Commit all changes.
-    conn.commit()
-    conn.close()
+        # Commit all changes.
+        conn.commit()
     logger.info("Indexed Socrata resource {}".format(crawler_key))
@@ -0,0 +1,202 @@
+"""An in-process metrics registry with counters and latency histograms.
+
+Metrics are kept per process (i.e., per Celery worker process) and can be
+dumped in the Prometheus text exposition format or as log lines. The API
+server is deployed without this package and keeps its own latency histogram
+in the same format.
+"""
+import bisect
+import threading
+
+
+# The default latency histogram buckets in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+        10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key):
+    items = list(label_key)
+    if not items:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', r'\"'))
+            for k, v in items) + "}"
+
+
+class Counter(object):
+    """A monotonically increasing counter with labels.
+
+    Args:
+        name: the metric name.
+        description: the help text of the metric.
+    """
+
+    type_name = "counter"
+
+    def __init__(self, name, description=""):
+        self._name = name
+        self._description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def description(self):
+        return self._description
+
+    def inc(self, amount=1, **labels):
+        """Increment the counter for the given labels."""
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """Get the current value of the counter for the given labels."""
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def samples(self):
+        """Get a list of (sample name, label key, value)."""
+        with self._lock:
+            return [(self._name, key, value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram(object):
+    """A histogram of observed values with labels, using cumulative buckets.
+
+    Args:
+        name: the metric name.
+        description: the help text of the metric.
+        buckets: the upper bounds of the buckets in increasing order.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name, description="", buckets=DEFAULT_BUCKETS):
+        self._name = name
+        self._description = description
+        self._buckets = tuple(buckets)
+        # Label key -> [bucket counts, sum, count].
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def description(self):
+        return self._description
+
+    def observe(self, value, **labels):
+        """Record an observed value for the given labels."""
+        key = _label_key(labels)
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * (len(self._buckets) + 1), 0.0, 0]
+            entry = self._values[key]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def get(self, **labels):
+        """Get the (count, sum) of observed values for the given labels."""
+        with self._lock:
+            entry = self._values.get(_label_key(labels))
+            if entry is None:
+                return (0, 0.0)
+            return (entry[2], entry[1])
+
+    def samples(self):
+        """Get a list of (sample name, label key, value), with cumulative
+        buckets labeled by `le`."""
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(
+                        list(self._buckets) + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    samples.append((self._name + "_bucket",
+                            key + (("le", bound),), cumulative))
+                samples.append((self._name + "_sum", key, total))
+                samples.append((self._name + "_count", key, count))
+        return samples
+
+
+class MetricsRegistry(object):
+    """A collection of named metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric {} is already registered as a "
+                        "{}".format(name, metric.type_name))
+            return metric
+
+    def counter(self, name, description=""):
+        """Get or create a counter."""
+        return self._get_or_create(Counter, name, description)
+
+    def histogram(self, name, description="", buckets=DEFAULT_BUCKETS):
+        """Get or create a histogram."""
+        return self._get_or_create(Histogram, name, description, buckets)
+
+    def clear(self):
+        """Remove all metrics."""
+        with self._lock:
+            self._metrics.clear()
+
+    def _sorted_metrics(self):
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def to_prometheus(self):
+        """Dump all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._sorted_metrics():
+            lines.append("# HELP {} {}".format(metric.name,
+                    metric.description))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type_name))
+            for name, key, value in metric.samples():
+                lines.append("{}{} {}".format(name, _format_labels(key),
+                        value))
+        return "\n".join(lines) + "\n"
+
+    def log_lines(self):
+        """Dump counters and histogram summaries as human-readable lines."""
+        lines = []
+        for metric in self._sorted_metrics():
+            if isinstance(metric, Histogram):
+                for name, key, value in metric.samples():
+                    if name.endswith("_count"):
+                        _, total = metric.get(**dict(key))
+                        mean = total / value if value else 0.0
+                        lines.append("{}{} count={} sum={:.6f} "
+                                "mean={:.6f}".format(metric.name,
+                                    _format_labels(key), value, total, mean))
+            else:
+                for name, key, value in metric.samples():
+                    lines.append("{}{} {}".format(name, _format_labels(key),
+                            value))
+        return lines
+
+
+# The registry of this process.
+registry = MetricsRegistry()
@@ -9,10 +9,18 @@ class _LazySpacyModel:
         self._model = None
         self._model_kwargs = kwargs
 
-    def process(self, text):
+    def _get_model(self):
         if not self._model:
             self._model = spacy.load(self._model_name, **self._model_kwargs)
-        return self._model(text)
+        return self._model
+
+    def process(self, text):
+        return self._get_model()(text)
+
+    def pipe(self, texts, batch_size=256):
+        """Process the texts in batches, which is faster than processing
+        them one by one. The docs are generated in the order of texts."""
+        return self._get_model().pipe(texts, batch_size=batch_size)
 
     def get_empty_word_vector(self):
         doc = self.process("test")
@@ -0,0 +1,311 @@
+"""Per-host concurrency and rate limits for crawler tasks.
+
+A crawler task acquires a slot for the host it is about to download from.
+If the host is at its concurrency limit or out of rate tokens, the task is
+deferred with a retry countdown instead of blocking the worker, so the
+worker picks up tasks for other hosts in the meantime.
+"""
+import os
+import time
+import random
+import threading
+import contextlib
+import collections
+from urllib.parse import urlparse
+
+import psycopg2
+
+
+HostLimits = collections.namedtuple("HostLimits",
+        ["max_concurrency", "rate", "burst"])
+HostLimits.__doc__ = """The limits of a host.
+
+Args:
+    max_concurrency: the maximum number of concurrent tasks, None for
+        unlimited.
+    rate: the number of tasks started per second, None for unlimited.
+    burst: the capacity of the token bucket, i.e., the number of tasks
+        that can be started at once after the host has been idle.
+"""
+
+DEFAULT_HOST_LIMITS = HostLimits(max_concurrency=4, rate=2.0, burst=4)
+
+
+def get_host(url):
+    """Get the host name of the URL."""
+    return (urlparse(url).hostname or "").lower()
+
+
+def parse_host_limits(configs):
+    """Parse the host limits from the crawler.host_limits configurations.
+
+    Args:
+        configs: a dictionary mapping host names to dictionaries with keys
+            max_concurrency, rate and burst. The limits under the `default`
+            key are used for hosts not listed.
+
+    Returns: (default, limits) where default is a HostLimits and limits is a
+        dictionary from host names to HostLimits.
+    """
+    configs = configs or {}
+
+    def _parse(c, base):
+        c = c or {}
+        return HostLimits(
+                max_concurrency=c.get("max_concurrency", base.max_concurrency),
+                rate=c.get("rate", base.rate),
+                burst=c.get("burst", base.burst))
+
+    default = _parse(configs.get("default"), DEFAULT_HOST_LIMITS)
+    limits = dict((host.lower(), _parse(c, default))
+            for host, c in configs.items() if host != "default")
+    return default, limits
+
+
+class HostLimiter(object):
+    """The interface of a per-host limiter.
+
+    Args:
+        default: the HostLimits used for hosts not in limits.
+        limits: a dictionary from host names to HostLimits.
+    """
+
+    def __init__(self, default=DEFAULT_HOST_LIMITS, limits=None):
+        self._default = default
+        self._limits = limits or {}
+
+    def get_limits(self, host):
+        """Get the HostLimits of the host."""
+        return self._limits.get(host, self._default)
+
+    def acquire(self, host):
+        """Try to acquire a slot for the host without blocking.
+
+        Returns: 0 if acquired, otherwise the suggested number of seconds
+            to wait before trying again.
+        """
+        raise NotImplementedError()
+
+    def release(self, host):
+        """Release a slot acquired for the host."""
+        raise NotImplementedError()
+
+
+class NullHostLimiter(HostLimiter):
+    """A limiter without any limit."""
+
+    def acquire(self, host):
+        return 0
+
+    def release(self, host):
+        pass
+
+
+class LocalHostLimiter(HostLimiter):
+    """A limiter that keeps the token buckets and concurrency counts in
+    this process. The limits are only enforced among the tasks running in
+    the same process, e.g., a worker using the threads or solo pool.
+
+    Args:
+        default: the HostLimits used for hosts not in limits.
+        limits: a dictionary from host names to HostLimits.
+        clock: the function returning the current time in seconds.
+    """
+
+    def __init__(self, default=DEFAULT_HOST_LIMITS, limits=None,
+            clock=time.monotonic):
+        super().__init__(default, limits)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._running = collections.Counter()
+        # host -> (tokens, last refill time)
+        self._buckets = {}
+
+    def _take_token(self, host, limits):
+        if not limits.rate:
+            return 0
+        now = self._clock()
+        capacity = max(limits.burst or 1, 1)
+        tokens, last = self._buckets.get(host, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * limits.rate)
+        if tokens < 1:
+            self._buckets[host] = (tokens, now)
+            return (1 - tokens) / limits.rate
+        self._buckets[host] = (tokens - 1, now)
+        return 0
+
+    def acquire(self, host):
+        limits = self.get_limits(host)
+        with self._lock:
+            if limits.max_concurrency is not None and \
+                    self._running[host] >= limits.max_concurrency:
+                # Wait for about the time of starting a new task.
+                return 1.0 / limits.rate if limits.rate else 1.0
+            wait = self._take_token(host, limits)
+            if wait > 0:
+                return wait
+            self._running[host] += 1
+            return 0
+
+    def release(self, host):
+        with self._lock:
+            if self._running[host] > 0:
+                self._running[host] -= 1
+
+    def running(self, host):
+        """The number of slots currently acquired for the host."""
+        with self._lock:
+            return self._running[host]
+
+
+class PostgresHostLimiter(HostLimiter):
+    """A limiter shared by all workers using the Postgres database.
+    Concurrency is limited with session-level advisory locks, one lock
+    per slot, which are released automatically if a worker dies. Rate is
+    limited with token buckets in the findopendata.crawler_host_buckets
+    table.
+
+    Args:
+        db_configs: the keyword arguments for psycopg2.connect.
+        default: the HostLimits used for hosts not in limits.
+        limits: a dictionary from host names to HostLimits.
+    """
+
+    def __init__(self, db_configs, default=DEFAULT_HOST_LIMITS, limits=None):
+        super().__init__(default, limits)
+        self._db_configs = db_configs
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # host -> the list of slots held by this process
+        self._slots = collections.defaultdict(list)
+
+    def _get_conn(self):
+        # The connection cannot be shared with forked worker processes.
+        pid = os.getpid()
+        if self._conn is None or self._conn.closed or self._pid != pid:
+            self._conn = psycopg2.connect(**self._db_configs)
+            self._conn.autocommit = True
+            self._pid = pid
+            self._slots.clear()
+        return self._conn
+
+    def _take_token(self, cur, host, limits):
+        if not limits.rate:
+            return 0
+        capacity = max(limits.burst or 1, 1)
+        cur.execute("INSERT INTO findopendata.crawler_host_buckets AS b "
+                "(host, tokens, updated) "
+                "VALUES (%(host)s, %(capacity)s - 1, clock_timestamp()) "
+                "ON CONFLICT (host) DO UPDATE "
+                "SET tokens = LEAST(%(capacity)s, b.tokens + "
+                "EXTRACT(EPOCH FROM clock_timestamp() - b.updated) "
+                "* %(rate)s) - 1, "
+                "updated = clock_timestamp() "
+                "WHERE LEAST(%(capacity)s, b.tokens + "
+                "EXTRACT(EPOCH FROM clock_timestamp() - b.updated) "
+                "* %(rate)s) >= 1 "
+                "RETURNING tokens;",
+                {"host": host, "capacity": capacity, "rate": limits.rate})
+        if cur.fetchone() is not None:
+            return 0
+        cur.execute("SELECT LEAST(%(capacity)s, tokens + "
+                "EXTRACT(EPOCH FROM clock_timestamp() - updated) "
+                "* %(rate)s) FROM findopendata.crawler_host_buckets "
+                "WHERE host = %(host)s;",
+                {"host": host, "capacity": capacity, "rate": limits.rate})
+        row = cur.fetchone()
+        tokens = float(row[0]) if row is not None else 0.0
+        return max((1 - tokens) / limits.rate, 0.01)
+
+    def acquire(self, host):
+        limits = self.get_limits(host)
+        with self._lock:
+            cur = self._get_conn().cursor()
+            try:
+                slot = None
+                if limits.max_concurrency is not None:
+                    # Advisory locks are re-entrant within the session, and
+                    # the connection is shared by the whole process, so the
+                    # slots held by this process must be skipped.
+                    held = set(self._slots[host])
+                    for i in range(limits.max_concurrency):
+                        if i in held:
+                            continue
+                        cur.execute("SELECT pg_try_advisory_lock("
+                                "hashtext(%s), %s);", (host, i))
+                        if cur.fetchone()[0]:
+                            slot = i
+                            break
+                    if slot is None:
+                        return 1.0 / limits.rate if limits.rate else 1.0
+                wait = self._take_token(cur, host, limits)
+                if wait > 0:
+                    if slot is not None:
+                        cur.execute("SELECT pg_advisory_unlock("
+                                "hashtext(%s), %s);", (host, slot))
+                    return wait
+                self._slots[host].append(slot)
+                return 0
+            finally:
+                cur.close()
+
+    def release(self, host):
+        with self._lock:
+            if not self._slots[host]:
+                return
+            slot = self._slots[host].pop()
+            if slot is None:
+                return
+            cur = self._get_conn().cursor()
+            try:
+                cur.execute("SELECT pg_advisory_unlock(hashtext(%s), %s);",
+                        (host, slot))
+            finally:
+                cur.close()
+
+
+def HostLimiterFactory(provider=None, host_limits=None, db_configs=None):
+    """Create a host limiter.
+
+    Args:
+        provider: the name of the limiter. Choose among `local`, `postgres`
+            and None (no limit).
+        host_limits: the crawler.host_limits configurations, see
+            parse_host_limits.
+        db_configs: the keyword arguments for psycopg2.connect, required by
+            the `postgres` limiter.
+
+    Return: a limiter of the class `HostLimiter`.
+    """
+    default, limits = parse_host_limits(host_limits)
+    if not provider:
+        return NullHostLimiter(default, limits)
+    if provider == "local":
+        return LocalHostLimiter(default, limits)
+    if provider == "postgres":
+        return PostgresHostLimiter(db_configs, default, limits)
+    raise ValueError("Unknown host limiter: "+provider)
+
+
+@contextlib.contextmanager
+def host_slot(limiter, task, url, max_deferrals=100):
+    """Run the body with a slot acquired for the host of the URL. If no slot
+    is available the bound Celery task is retried after the suggested wait
+    plus a random jitter, so it does not occupy the worker.
+
+    Args:
+        limiter: the HostLimiter.
+        task: the bound Celery task (i.e., self of a bind=True task).
+        url: the URL to be requested in the body.
+        max_deferrals: the maximum number of times the task is deferred.
+    """
+    host = get_host(url)
+    wait = limiter.acquire(host)
+    if wait > 0:
+        raise task.retry(countdown=wait + random.uniform(0, wait),
+                max_retries=max_deferrals)
+    try:
+        yield host
+    finally:
+        limiter.release(host)
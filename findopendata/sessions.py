@@ -0,0 +1,108 @@
+"""HTTP sessions shared by the crawler tasks in a worker process.
+
+Requests to the same host reuse the connections kept alive in the host's
+session, instead of paying for TCP and TLS setup on every request. The
+sessions also retry failed connections and throttled responses with
+exponential backoff.
+"""
+import os
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class SessionRegistry(object):
+    """A registry of requests sessions keyed by the scheme and host of URLs.
+    The sessions are recreated in a forked process, as the pooled
+    connections cannot be shared between processes.
+
+    Args:
+        pool_connections: the number of connection pools to cache per
+            session.
+        pool_maxsize: the maximum number of connections kept alive per
+            connection pool, i.e., the concurrent requests to a host.
+        max_retries: the number of retries for failed connections and
+            responses with status in status_forcelist.
+        backoff_factor: the backoff factor between retries, the n-th retry
+            waits for backoff_factor * (2 ** (n - 1)) seconds, or the
+            Retry-After header of the response if given.
+        status_forcelist: the response status codes to retry.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=3,
+            backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pid = os.getpid()
+        self.configure(pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize, max_retries=max_retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=status_forcelist)
+
+    def configure(self, pool_connections=None, pool_maxsize=None,
+            max_retries=None, backoff_factor=None, status_forcelist=None):
+        """Update the settings of new sessions and close the existing ones.
+        The arguments left as None are not changed."""
+        with self._lock:
+            if pool_connections is not None:
+                self._pool_connections = int(pool_connections)
+            if pool_maxsize is not None:
+                self._pool_maxsize = int(pool_maxsize)
+            if max_retries is not None:
+                self._max_retries = int(max_retries)
+            if backoff_factor is not None:
+                self._backoff_factor = float(backoff_factor)
+            if status_forcelist is not None:
+                self._status_forcelist = tuple(status_forcelist)
+            self._close_all()
+
+    def _create_session(self):
+        retry = Retry(total=self._max_retries,
+                backoff_factor=self._backoff_factor,
+                status_forcelist=self._status_forcelist,
+                respect_retry_after_header=True,
+                raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self._pool_connections,
+                pool_maxsize=self._pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _close_all(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+    def get(self, url):
+        """Get the session for the host of the URL."""
+        parsed = urlparse(url)
+        key = (parsed.scheme, parsed.netloc.lower())
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: drop the sessions without closing the connections
+                # that still belong to the parent process.
+                self._sessions = {}
+                self._pid = os.getpid()
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._create_session()
+                self._sessions[key] = session
+            return session
+
+    def clear(self):
+        """Close and remove all sessions."""
+        with self._lock:
+            self._close_all()
+
+
+# The session registry of this process.
+sessions = SessionRegistry()
+
+
+def get_session(url):
+    """Get the shared session of this process for the host of the URL."""
+    return sessions.get(url)
@@ -21,6 +21,9 @@ storage_configs = configs.get("storage")
 # Local storage configurations.
 local_configs = configs.get("local")
 
+# In-memory storage configurations, used for tests and benchmarks.
+memory_configs = configs.get("memory") or {}
+
 # GCP configurations.
 gcp_configs = configs.get("gcp")
 
@@ -33,6 +36,9 @@ crawler_configs = configs.get("crawler")
 # Postgres configurations.
 db_configs = configs.get("postgres")
 
+# Postgres connection pool configurations of each process.
+db_pool_configs = configs.get("postgres_pool") or {}
+
 # Celery configurations.
 celery_configs = configs.get("celery")
 
@@ -0,0 +1,50 @@
+"""The binary encoding of the MinHash and HyperLogLog sketches saved in the
+column_sketches table.
+
+The MinHash hash values are 32-bit, saved as little-endian unsigned integers
+of minhash_bits bits, optionally keeping only the lowest 8 or 16 bits of
+each value (b-bit MinHash). The HyperLogLog registers are saved as one
+unsigned byte each. The MinHash hash values are decoded by the API server
+(apiserver/main.py) and the LSH server (lshserver/main.go), which do not
+depend on this package.
+"""
+import numpy as np
+
+
+# The supported number of bits kept of each MinHash hash value, and the
+# little-endian types they are saved as.
+MINHASH_DTYPES = {
+        8: np.dtype("<u1"),
+        16: np.dtype("<u2"),
+        32: np.dtype("<u4"),
+        }
+
+
+def _get_minhash_dtype(bits):
+    if bits not in MINHASH_DTYPES:
+        raise ValueError("Unsupported number of MinHash bits: {}, expecting "
+                "one of {}".format(bits, sorted(MINHASH_DTYPES)))
+    return MINHASH_DTYPES[bits]
+
+
+def encode_minhash(hashvalues, bits=32):
+    """Encode the MinHash hash values, keeping the lowest bits of each.
+
+    Args:
+        hashvalues: the 32-bit hash values, e.g., ColumnSketch.minhash.
+        bits: the number of bits kept of each hash value, one of 8, 16
+            and 32.
+
+    Returns: the little-endian bytes of the hash values.
+    """
+    dtype = _get_minhash_dtype(bits)
+    values = np.asarray(hashvalues, dtype=np.uint64)
+    if bits < 32:
+        values = values & np.uint64((1 << bits) - 1)
+    return values.astype(dtype).tobytes()
+
+
+def encode_hyperloglog(registers):
+    """Encode the HyperLogLog registers, e.g., ColumnSketch.hyperloglog,
+    as one byte each."""
+    return np.asarray(registers, dtype=np.uint8).tobytes()
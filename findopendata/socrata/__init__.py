@@ -1,44 +1,253 @@
-import requests
+import re
+import csv
+import codecs
+import concurrent.futures
 
+from ..sessions import get_session
 
-def socrata_records(resource_url, app_token, limit=25000):
+
+# The Socrata column data types of numbers, which the CSV export formats
+# with thousands separators and currency or percent signs, while the JSON
+# API returns them as plain number strings.
+SOCRATA_NUMBER_TYPES = ("number", "double", "money", "percent")
+
+_resource_url_reg = re.compile(
+        r"^(https?:\/\/[^\/]+)\/resource\/([a-z0-9A-Z]{4}-[a-z0-9A-Z]{4})"
+        r"\.json$")
+
+
+def socrata_check_modified(resource_url, app_token, validators=None):
+    """Check if the Socrata dataset has been modified using a conditional
+    request for a single record.
+
+    Args:
+        resource_url: the Socrata dataset API.
+        app_token: the Socrata dataset access credential.
+        validators: the validators of the last download, a dictionary with
+            keys etag and last_modified, or None.
+
+    Returns: None if the dataset is not modified, otherwise a dictionary
+        with the current etag and last_modified of the dataset.
+    """
+    headers = {}
+    if app_token is not None:
+        headers["X-App-Token"] = app_token
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    resp = get_session(resource_url).get(resource_url,
+            params={
+                r"$order" : r":id",
+                r"$limit" : 1},
+            headers=headers)
+    if resp.status_code == 304:
+        return None
+    if resp.status_code == 403 and app_token is not None:
+        # Re-try without app token
+        return socrata_check_modified(resource_url, None, validators)
+    resp.raise_for_status()
+    return {
+            "etag": resp.headers.get("etag"),
+            "last_modified": resp.headers.get("last-modified"),
+            }
+
+
+def _escape(value):
+    # Escape a string literal in SoQL.
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def socrata_rows_summary(resource_url, app_token, until_id=None):
+    """Count the records and get the latest update time of the records
+    in the Socrata dataset, which tells whether the records read before
+    have been changed in place.
+
+    Args:
+        resource_url: the Socrata dataset API.
+        app_token: the Socrata dataset access credential.
+        until_id: only summarize the records whose row identifier `:id` is
+            less than or equal to this one, None for all records.
+
+    Returns: (num_records, max_updated_at), where max_updated_at is the
+        latest `:updated_at` of the records as given by the API, or None
+        if there is no record.
+    """
+    params = {r"$select" : r"count(*) AS num_records, "
+            r"max(:updated_at) AS max_updated_at"}
+    if until_id is not None:
+        params[r"$where"] = r":id <= {}".format(_escape(until_id))
+    headers = {}
+    if app_token is not None:
+        headers["X-App-Token"] = app_token
+    resp = get_session(resource_url).get(resource_url, params=params,
+            headers=headers)
+    if resp.status_code == 403 and app_token is not None:
+        # Re-try without app token
+        return socrata_rows_summary(resource_url, None, until_id)
+    resp.raise_for_status()
+    rows = resp.json()
+    if not rows:
+        return 0, None
+    return int(rows[0].get("num_records", 0)), rows[0].get("max_updated_at")
+
+
+def socrata_records(resource_url, app_token, limit=25000, start_after=None,
+        prefetch=True, include_id=False, include_updated_at=False):
     """Reading records from given resource URL.
 
+    The records are paged by keyset (i.e., `$where=:id > last_id` ordered by
+    `:id`) rather than by `$offset`, so the cost of reading each page does
+    not grow with its position in the dataset.
+
     Args:
         resource_url: the Socrata dataset API.
         app_token: the Socrata dataset access credential.
         limit (defautl 25000): the pagination limit used for reading the
             Socrata dataset API.
+        start_after: read only the records whose row identifier `:id` is
+            greater than this one, None to read from the beginning.
+        prefetch: whether to request the next page on a background thread
+            while the records of the current page are consumed.
+        include_id: whether to keep the row identifier in the records under
+            the key `:id`.
+        include_updated_at: whether to include the time each record is last
+            updated in the records under the key `:updated_at`.
     """
-    def _call_api(resource_url, app_token, limit, offset):
+    select = r":id, :updated_at, *" if include_updated_at else r":id, *"
+
+    def _call_api(resource_url, app_token, limit, last_id):
+        params = {
+                r"$select" : select,
+                r"$order" : r":id",
+                r"$limit" : limit}
+        if last_id is not None:
+            params[r"$where"] = r":id > {}".format(_escape(last_id))
         if app_token is not None:
-            resp = requests.get(resource_url,
-                    params={
-                        r"$order" : r":id",
-                        r"$offset" : offset,
-                        r"$limit" : limit},
+            resp = get_session(resource_url).get(resource_url,
+                    params=params,
                     headers={
                         "X-App-Token" : app_token})
             if resp.status_code == 403:
                 # Re-try without app token
-                return _call_api(resource_url, None, limit, offset)
+                return _call_api(resource_url, None, limit, last_id)
         else:
-            resp = requests.get(resource_url,
-                    params={
-                        r"$order" : r":id",
-                        r"$offset" : offset,
-                        r"$limit" : limit})
+            resp = get_session(resource_url).get(resource_url,
+                    params=params)
         if not resp.ok:
             resp.raise_for_status()
         records = resp.json()
         return records
 
+    def _pages(executor):
+        last_id = start_after
+        future = None
+        while True:
+            if future is not None:
+                records = future.result()
+            else:
+                records = _call_api(resource_url, app_token, limit, last_id)
+            if len(records) == 0:
+                return
+            last_id = records[-1][":id"]
+            # The server may return fewer records than the limit for pages
+            # other than the last, so only an empty page ends the loop.
+            if executor is not None:
+                future = executor.submit(_call_api, resource_url, app_token,
+                        limit, last_id)
+            yield records
+
     # Main loop
-    offset = 0
-    while True:
-        records = _call_api(resource_url, app_token, limit, offset)
-        offset += limit
-        if len(records) == 0:
+    executor = None
+    if prefetch:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        for records in _pages(executor):
+            for record in records:
+                if not include_id:
+                    record.pop(":id", None)
+                yield record
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def socrata_export_url(resource_url):
+    """Get the URL of the bulk CSV export of the Socrata dataset given its
+    resource URL (e.g., https://domain/resource/abcd-1234.json).
+    """
+    m = _resource_url_reg.match(resource_url)
+    if m is None:
+        raise ValueError("Not a Socrata resource URL: {}".format(resource_url))
+    return "{}/api/views/{}/rows.csv".format(m.group(1), m.group(2))
+
+
+def _to_number_string(value):
+    return value.replace(",", "").replace("$", "").replace("%", "").strip()
+
+
+def _iter_lines(chunks):
+    # Decode the chunks of bytes into lines that keep the line endings, so
+    # the csv module can read quoted values spanning multiple lines.
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    rest = ""
+    for chunk in chunks:
+        lines = (rest + decoder.decode(chunk)).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    rest += decoder.decode(b"", final=True)
+    if rest:
+        yield rest
+
+
+def socrata_csv_records(resource_url, app_token, field_names, datatypes,
+        display_names=None):
+    """Reading records from the bulk CSV export of the Socrata dataset as a
+    single stream. The values are kept as the strings returned by the JSON
+    API (see socrata_records), i.e., numbers without formatting and empty
+    values omitted, so the records are saved the same way.
+
+    Args:
+        resource_url: the Socrata dataset API.
+        app_token: the Socrata dataset access credential.
+        field_names: the API field names of the columns (the
+            `columns_field_name` in the Discovery API).
+        datatypes: the Socrata data types of the columns (the
+            `columns_datatype` in the Discovery API).
+        display_names: the display names of the columns (the
+            `columns_name` in the Discovery API), which the CSV export
+            uses as headers.
+    """
+    number_fields = set(name for name, datatype in zip(field_names, datatypes)
+            if str(datatype).lower() in SOCRATA_NUMBER_TYPES)
+    header_to_field = dict((name, name) for name in field_names)
+    if display_names is not None:
+        header_to_field.update(zip(display_names, field_names))
+    headers = {}
+    if app_token is not None:
+        headers["X-App-Token"] = app_token
+    export_url = socrata_export_url(resource_url)
+    with get_session(export_url).get(export_url,
+            params={"accessType" : "DOWNLOAD"},
+            headers=headers, stream=True) as resp:
+        resp.raise_for_status()
+        reader = csv.reader(_iter_lines(resp.iter_content(64*1024)))
+        header = next(reader, None)
+        if header is None:
             return
-        for record in records:
+        # The positions of the CSV columns in the records, columns without
+        # a known field name are skipped.
+        columns = [(i, header_to_field[h]) for i, h in enumerate(header)
+                if h in header_to_field]
+        for row in reader:
+            record = {}
+            for i, name in columns:
+                if i >= len(row) or row[i] == "":
+                    continue
+                if name in number_fields:
+                    record[name] = _to_number_string(row[i])
+                else:
+                    record[name] = row[i]
             yield record
@@ -0,0 +1,123 @@
+from collections import OrderedDict
+
+from ..table_sketch import TableSketch
+
+
+class SketchState(object):
+    """The sketch of the records read from a Socrata dataset, with the
+    position of the last record read. A dataset that only grows can be
+    refreshed by reading and sketching the records after that position,
+    instead of reading and sketching the whole dataset again.
+
+    Args:
+        table_sketch: the TableSketch of the records read.
+        sketch_params: the parameters of the sketch, see
+            findopendata.indexing.get_sketch_params.
+        field_names: the API field names of the dataset columns.
+        last_id: the row identifier `:id` of the last record read.
+        max_updated_at: the latest `:updated_at` of the records read.
+        num_records: the number of records read.
+        num_sketched: the number of records sketched, which stops at the
+            max_records in sketch_params.
+    """
+
+    def __init__(self, table_sketch, sketch_params, field_names,
+            last_id=None, max_updated_at=None, num_records=0,
+            num_sketched=0):
+        self.table_sketch = table_sketch
+        self.sketch_params = dict(sketch_params)
+        self.field_names = list(field_names)
+        self.last_id = last_id
+        self.max_updated_at = max_updated_at
+        self.num_records = num_records
+        self.num_sketched = num_sketched
+
+    @classmethod
+    def new(cls, sketch_params, field_names, max_columns=None,
+            exact_threshold=0):
+        """Create the state for reading a dataset from the beginning. The
+        max_columns and exact_threshold limit the memory used by the
+        TableSketch."""
+        table_sketch = TableSketch(
+                record_sample_size=sketch_params["table_sample_size"],
+                max_columns=max_columns,
+                exact_threshold=exact_threshold,
+                minhash_size=sketch_params["minhash_size"],
+                minhash_seed=sketch_params["minhash_seed"],
+                hyperloglog_p=sketch_params["hyperloglog_p"],
+                sample_size=sketch_params["column_sample_size"],
+                enable_word_vector_data=sketch_params[
+                    "enable_word_vector_data"])
+        return cls(table_sketch, sketch_params, field_names)
+
+    @classmethod
+    def from_state(cls, state):
+        """Restore from the state created by get_state."""
+        resume = state["resume"]
+        return cls(TableSketch.from_state(state), state["sketch_params"],
+                resume["field_names"],
+                last_id=resume["last_id"],
+                max_updated_at=resume["max_updated_at"],
+                num_records=resume["num_records"],
+                num_sketched=resume["num_sketched"])
+
+    def get_state(self):
+        """The state of the table sketch, as created by
+        TableSketch.get_state, with the sketch parameters and the position
+        of the last record read."""
+        state = self.table_sketch.get_state()
+        state["sketch_params"] = self.sketch_params
+        state["resume"] = {
+                "field_names": self.field_names,
+                "last_id": self.last_id,
+                "max_updated_at": self.max_updated_at,
+                "num_records": self.num_records,
+                "num_sketched": self.num_sketched,
+                }
+        return state
+
+    def can_resume(self, sketch_params, field_names):
+        """Whether the records after the last record read can be added to
+        this state, which requires the same sketch parameters and
+        columns."""
+        return self.last_id is not None and \
+                self.sketch_params == dict(sketch_params) and \
+                self.field_names == list(field_names)
+
+    def is_unchanged(self, num_records, max_updated_at):
+        """Whether the records read have not been changed in place, given
+        the number of records and their latest update time in the dataset
+        up to the last record read (see socrata_rows_summary)."""
+        return num_records == self.num_records and \
+                max_updated_at == self.max_updated_at
+
+    def track(self, records):
+        """Record the position of the records read by socrata_records with
+        include_id and include_updated_at, and remove the `:id` and
+        `:updated_at` from the records."""
+        for record in records:
+            self.last_id = record.pop(":id")
+            updated_at = record.pop(":updated_at", None)
+            if updated_at is not None and (self.max_updated_at is None or
+                    updated_at > self.max_updated_at):
+                self.max_updated_at = updated_at
+            self.num_records += 1
+            yield record
+
+    def sketch(self, records, field_names):
+        """Sketch the records as they are passed through, until max_records
+        records are sketched.
+
+        Args:
+            records: the records.
+            field_names: the fields of the records in the order of the
+                columns, i.e., the fields of the Avro schema, so the records
+                are sketched the same way as when read from the Avro file.
+        """
+        max_records = self.sketch_params.get("max_records")
+        for record in records:
+            if max_records is None or self.num_sketched < max_records:
+                self.table_sketch.update(OrderedDict((f, record.get(f))
+                    for f in field_names))
+                self.num_sketched += 1
+            yield record
@@ -1,115 +1,474 @@
 import re
 import io
 import random
+import shutil
+import hashlib
+import tempfile
+import itertools
 
-import requests
+import simplejson as json
 import dateutil.parser
-import psycopg2
+import fastavro
+from celery.exceptions import Retry
 from celery.utils.log import get_task_logger
 
 from .celery import app
 from .storage.objects import storage
+from .db import get_connection
 from .parsers.avro import JSON2AvroRecords
-from .settings import crawler_configs, db_configs, gcp_configs
-from .socrata import socrata_records
+from .settings import crawler_configs, gcp_configs, index_configs
+from .socrata import socrata_records, socrata_check_modified, \
+        socrata_csv_records, socrata_rows_summary
+from .socrata.sketch_state import SketchState
+from .indexing import get_sketch_params, get_sketch_memory_limits
+from .sessions import get_session
+from .http_validators import get_validators, save_validators, \
+        is_unchanged, get_content_fingerprint
+from .host_limiter import host_limiter
+from .scheduler import host_slot
 
 
 # Logger for tasks.
 logger = get_task_logger(__name__)
 
 
-@app.task(ignore_result=True)
-def add_socrata_resource(metadata, app_token, blob_prefix, force_update):
+@app.task(bind=True, ignore_result=True)
+def add_socrata_resource(self, metadata_blob_name, app_token, blob_prefix,
+        force_update, freshness_checked=False):
     """Retrieves and adds a Socrata resource to the registry.
+    The task is deferred if the host of the resource is at its limits.
 
     Args:
-        metadata: the 'resource' section of the JSON data returned from
-            the Socrata Discovery API.
+        metadata_blob_name: the blob name of the JSON data returned from
+            the Socrata Discovery API for the resource, staged by
+            add_socrata_resources_from_api.
         app_token: the application token for using the discovery API.
         blob_prefix: the prefix for all the blobs uploaded from this
             function, relative to the root.
         force_update: whether to force update regardless of the updated time.
+        freshness_checked: whether the updated time has already been
+            checked against the registry before the task is enqueued.
     """
+    deferred = False
+    try:
+        metadata = storage.get_object(metadata_blob_name)
+        _add_socrata_resource(self, metadata, app_token, blob_prefix,
+                force_update, freshness_checked)
+    except Retry:
+        # The retried task reads the staged metadata again.
+        deferred = True
+        raise
+    finally:
+        if not deferred:
+            _delete_blobs(metadata_blob_name)
+
 
+def _add_socrata_resource(task, metadata, app_token, blob_prefix,
+        force_update, freshness_checked):
     domain = metadata["metadata"]["domain"]
     try:
-        uid, original_url = _extract_socrata_uid2(metadata)
+        uid, original_url = _resolve_socrata_uid(metadata, app_token)
     except Exception as e:
         logger.warning("(domain={} Failed to extract UID and resource URL from "
                 "{}: {}".format(domain, metadata["permalink"], e))
         return
 
+    validators = None
+    sketch_blob_name = None
+    registered_blob_name = None
     if not force_update:
-        # Initialize Postgres connection and cursor.
-        conn = psycopg2.connect(**db_configs)
-        cur = conn.cursor()
+        # Get a Postgres connection from the pool.
+        with get_connection() as conn:
+            cur = conn.cursor()
 
-        # Check if the resource already exists and is updated.
-        cur.execute("SELECT updated::timestamptz "
-                "FROM findopendata.socrata_resources "
-                "WHERE domain = %s AND id = %s;", (domain, uid))
-        row = cur.fetchone()
-        if row is not None:
-            last_registered = row[0]
-            last_updated = dateutil.parser.parse(
-                    metadata["resource"]["updatedAt"])
-            if last_updated <= last_registered:
-                logger.info("(domain={} id={}) Skipping (updated {}, "
-                        "registered {})".format(domain, uid, last_updated,
-                            last_registered))
+            # Check if the resource already exists and is updated.
+            cur.execute("SELECT updated::timestamptz, resource_blob, "
+                    "sketch_blob FROM findopendata.socrata_resources "
+                    "WHERE domain = %s AND id = %s;", (domain, uid))
+            row = cur.fetchone()
+            if row is not None:
+                last_registered, registered_blob_name, sketch_blob_name = row
+                last_updated = dateutil.parser.parse(
+                        metadata["resource"]["updatedAt"])
+                if not freshness_checked and last_updated <= last_registered:
+                    logger.info("(domain={} id={}) Skipping (updated {}, "
+                            "registered {})".format(domain, uid, last_updated,
+                                last_registered))
+                    return
+                validators = get_validators(cur, original_url)
+
+            # Return the connection to prevent download hogging the pool.
+            cur.close()
+
+    # Requests to the host are limited, and the task is deferred if the
+    # host is busy.
+    with host_slot(host_limiter, task, original_url,
+            crawler_configs.get("host_max_deferrals", 100)):
+        # Check if the dataset is modified since the last download.
+        try:
+            new_validators = socrata_check_modified(original_url, app_token,
+                    validators)
+        except Exception as e:
+            logger.warning("(domain={} id={}) Failed to check {}: {}".format(
+                domain, uid, original_url, e))
+            return
+
+        # Upload the metadata.
+        metadata_blob = storage.put_object(metadata, 
+                "/".join([blob_prefix, domain, uid, "metadata.json"]))
+        logger.info("(domain={} id={}) Saved metadata.".format(domain, uid))
+
+        if new_validators is None:
+            _refresh_resource(domain, uid, metadata_blob.name, original_url)
+            logger.info("(domain={} id={}) Skipping (not modified since last "
+                    "download)".format(domain, uid))
+            return
+
+        # Get the field names from metadata.
+        field_names = metadata["resource"]["columns_field_name"]
+
+        # Download and upload the resource.
+        logger.info("(domain={} id={}) Saving resource from {}.".format(
+            domain, uid, original_url))
+        resource_blob_name = "/".join([blob_prefix, domain, uid,
+                "resource.avro"])
+        # The resource is saved to a temporary blob first, and copied over
+        # the registered blob only after it is saved completely, so a failed
+        # download does not truncate the registered blob.
+        tmp_blob_name = resource_blob_name + ".tmp"
+        resource_blob = None
+        sketch_state = None
+        incremental = crawler_configs.get("socrata_incremental", False)
+        if incremental:
+            sketch_params = get_sketch_params(index_configs)
+            sketch_state = _load_sketch_state(sketch_blob_name,
+                    sketch_params, field_names)
+        if sketch_state is not None:
+            # Read and sketch only the records added since the last
+            # download, if the records read before are unchanged.
+            try:
+                appended = _append_socrata_records(original_url, app_token,
+                        registered_blob_name, tmp_blob_name, sketch_state)
+            except Exception as e:
+                logger.warning("(domain={} id={}) Failed to append new "
+                        "records, reading all records: {}".format(domain,
+                            uid, e))
+                appended = False
+            if appended is None:
+                # No record has been changed or added, the registered
+                # resource and its sketches are still valid.
+                _refresh_resource(domain, uid, metadata_blob.name,
+                        original_url, new_validators)
+                logger.info("(domain={} id={}) Skipping (no new records "
+                        "since last download)".format(domain, uid))
                 return
+            if appended:
+                resource_blob, content = appended
+            else:
+                sketch_state = None
+        # The bulk CSV export has no row identifiers, so it is not used for
+        # incremental downloads.
+        if resource_blob is None and not incremental and \
+                crawler_configs.get("socrata_bulk_export", False):
+            # Stream the bulk CSV export of large datasets, and fall back to
+            # paging the JSON records if it fails.
+            content = _RecordsHash()
+            try:
+                num_records, _ = socrata_rows_summary(original_url,
+                        app_token)
+                if num_records >= crawler_configs.get(
+                        "socrata_bulk_export_min_records", 100000):
+                    records = JSON2AvroRecords(content.update(
+                        socrata_csv_records(original_url, app_token,
+                            field_names=field_names,
+                            datatypes=metadata["resource"][
+                                "columns_datatype"],
+                            display_names=metadata["resource"].get(
+                                "columns_name"))),
+                        field_names=field_names)
+                    resource_blob = storage.put_avro(records.schema,
+                            records.get(), tmp_blob_name, codec="snappy")
+            except Exception as e:
+                logger.warning("(domain={} id={}) Failed to save resource "
+                        "from CSV export, falling back to JSON records: "
+                        "{}".format(domain, uid, e))
+        if resource_blob is None:
+            content = _RecordsHash()
+            if incremental:
+                # Sketch all records and keep the row identifier of the last
+                # one, so the next download can start after it.
+                sketch_state = SketchState.new(sketch_params, field_names,
+                        **get_sketch_memory_limits(index_configs))
+            try:
+                json_records = socrata_records(original_url, app_token,
+                        include_id=incremental,
+                        include_updated_at=incremental)
+                if sketch_state is not None:
+                    json_records = sketch_state.track(json_records)
+                records = JSON2AvroRecords(content.update(json_records),
+                        field_names=field_names)
+                avro_records = records.get()
+                if sketch_state is not None:
+                    avro_records = sketch_state.sketch(avro_records,
+                            _get_avro_field_names(records.schema))
+                resource_blob = storage.put_avro(records.schema,
+                        avro_records, tmp_blob_name, codec="snappy")
+            except Exception as e:
+                logger.warning("(domain={} id={}) Failed to save resource "
+                        "from {}: {}".format(domain, uid, original_url, e))
+                _delete_blobs(tmp_blob_name)
+                return
+    logger.info("(domain={} id={}) Finished saving resource from {} to {}".\
+            format(domain, uid, original_url, resource_blob_name))
+    new_validators.update(content_length=content.length,
+            content_hash=content.hexdigest())
+
+    if is_unchanged(validators, new_validators):
+        # The registered resource is the same.
+        _refresh_resource(domain, uid, metadata_blob.name, original_url,
+                new_validators)
+        _delete_blobs(tmp_blob_name)
+        logger.info("(domain={} id={}) Skipping (same records as last "
+                "download)".format(domain, uid))
+        return
+
+    # Replace the registered blob, keeping its name, which is also used by
+    # the package files indexed from the resource.
+    try:
+        resource_blob = storage.copy(tmp_blob_name, resource_blob_name)
+    finally:
+        _delete_blobs(tmp_blob_name)
+
+    # Save the sketch state next to the resource, it is loaded into the
+    # sketch tables when the resource is indexed, and resumed by the next
+    # download.
+    sketch_blob_name = None
+    if sketch_state is not None:
+        sketch_blob_name = resource_blob.name + ".sketch.json"
+        try:
+            storage.put_object(sketch_state.get_state(), sketch_blob_name)
+        except Exception as e:
+            logger.warning("(domain={} id={}) Failed to save sketch to {}: "
+                    "{}".format(domain, uid, sketch_blob_name, e))
+            sketch_blob_name = None
+
+    # Get a Postgres connection for registering resource.
+    with get_connection() as conn:
+        cur = conn.cursor()
 
-        # Close the database connection to prevent download hogging the pool.
+        # Register this resource.
+        cur.execute("INSERT INTO findopendata.socrata_resources "
+                "(domain, id, metadata_blob, resource_blob, original_url, "
+                "dataset_size, content_fingerprint, sketch_blob) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (domain, id) DO UPDATE "
+                "SET updated = current_timestamp, "
+                "metadata_blob = EXCLUDED.metadata_blob, "
+                "resource_blob = EXCLUDED.resource_blob, "
+                "original_url = EXCLUDED.original_url, "
+                "dataset_size = EXCLUDED.dataset_size, "
+                "content_fingerprint = EXCLUDED.content_fingerprint, "
+                "sketch_blob = EXCLUDED.sketch_blob;",
+                (domain, uid, metadata_blob.name, resource_blob.name,
+                    original_url, resource_blob.size,
+                    get_content_fingerprint(new_validators),
+                    sketch_blob_name))
+        save_validators(cur, original_url, new_validators)
+        conn.commit()
+
+        cur.close()
+
+    logger.info("(domain={} id={}) Successful.".format(domain, uid))
+
+
+def _refresh_resource(domain, uid, metadata_blob_name, original_url,
+        validators=None):
+    """Update the metadata and the updated time of a registered resource
+    whose records have not changed since the last download, keeping its
+    resource blob, sketches and content fingerprint.
+
+    Args:
+        domain: the domain of the resource.
+        uid: the ID of the resource.
+        metadata_blob_name: the blob name of the uploaded metadata.
+        original_url: the URL of the resource.
+        validators: the validators of the new download to save, if any.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE findopendata.socrata_resources "
+                "SET updated = current_timestamp, metadata_blob = %s "
+                "WHERE domain = %s AND id = %s;",
+                (metadata_blob_name, domain, uid))
+        if validators is not None:
+            save_validators(cur, original_url, validators)
+        conn.commit()
         cur.close()
-        conn.close()
 
-    # Upload the metadata.
-    metadata_blob = storage.put_object(metadata, 
-            "/".join([blob_prefix, domain, uid, "metadata.json"]))
-    logger.info("(domain={} id={}) Saved metadata.".format(domain, uid))
 
-    # Get the field names from metadata.
-    field_names = metadata["resource"]["columns_field_name"]
+def _delete_blobs(*blob_names):
+    for blob_name in blob_names:
+        if blob_name is None:
+            continue
+        try:
+            storage.delete(blob_name)
+        except Exception as e:
+            logger.warning("Failed to delete blob {}: {}".format(blob_name,
+                e))
 
-    # Download and upload the resource.
-    logger.info("(domain={} id={}) Saving resource from {}.".format(
-        domain, uid, original_url))
-    resource_blob_name = "/".join([blob_prefix, domain, uid, "resource.avro"])
+
+def _get_avro_field_names(schema):
+    return [field["name"] for field in schema.get("fields", [])]
+
+
+def _load_sketch_state(sketch_blob_name, sketch_params, field_names):
+    """Load the sketch state saved by the last download, or None if there
+    is none or it cannot be resumed with the current sketch parameters and
+    columns."""
+    if sketch_blob_name is None:
+        return None
     try:
-        records = JSON2AvroRecords(socrata_records(original_url, app_token),
-                field_names=field_names)
-        resource_blob = storage.put_avro(records.schema, records.get(),
+        sketch_state = SketchState.from_state(
+                storage.get_object(sketch_blob_name))
+    except Exception as e:
+        logger.warning("Failed to load sketch state {}: {}".format(
+            sketch_blob_name, e))
+        return None
+    if not sketch_state.can_resume(sketch_params, field_names):
+        return None
+    return sketch_state
+
+
+def _append_socrata_records(original_url, app_token, registered_blob_name,
+        resource_blob_name, sketch_state):
+    """Read the records after the last record of the sketch state, sketch
+    them, and save them after the records of the registered resource to
+    another blob.
+
+    Returns: (resource_blob, content) if records are appended, None if
+        there is no new record, or False if the records read before have
+        been changed in place, which requires reading all records again.
+    """
+    num_records, max_updated_at = socrata_rows_summary(original_url,
+            app_token, until_id=sketch_state.last_id)
+    if not sketch_state.is_unchanged(num_records, max_updated_at):
+        return False
+    new_records = sketch_state.track(socrata_records(original_url, app_token,
+            start_after=sketch_state.last_id, include_id=True,
+            include_updated_at=True))
+    first = next(new_records, None)
+    if first is None:
+        return None
+    # A blob cannot be appended to, so the registered records are copied to
+    # a local file and written again followed by the new records.
+    content = _RecordsHash()
+    with tempfile.TemporaryFile() as local_file:
+        with storage.get_file(registered_blob_name) as blob_file:
+            shutil.copyfileobj(blob_file, local_file)
+        local_file.seek(0)
+        reader = fastavro.reader(local_file)
+        schema = reader.writer_schema
+        records = itertools.chain(reader, sketch_state.sketch(
+            itertools.chain([first], new_records),
+            _get_avro_field_names(schema)))
+        resource_blob = storage.put_avro(schema, content.update(records),
                 resource_blob_name, codec="snappy")
+    return resource_blob, content
+
+
+def _drop_nulls(value):
+    if isinstance(value, dict):
+        return dict((k, _drop_nulls(v)) for k, v in value.items()
+                if v is not None)
+    if isinstance(value, list):
+        return [_drop_nulls(v) for v in value]
+    return value
+
+
+class _RecordsHash(object):
+    """The content hash and length of a stream of JSON records, computed
+    over their canonical JSON serialization without null values, so the
+    records read back from Avro, which have every field, hash the same as
+    the JSON records they were saved from."""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self.length = 0
+
+    def update(self, records):
+        for record in records:
+            data = json.dumps(_drop_nulls(record),
+                    sort_keys=True).encode("utf-8")
+            self._hash.update(data)
+            self.length += len(data)
+            yield record
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def _resolve_socrata_uid(metadata, app_token):
+    """Get the UID and resource URL of the dataset. Resolved UIDs are cached
+    in the socrata_uid_cache table by permalink. For a new permalink, the
+    dataset ID given by the Discovery API is used if its resource URL
+    responds, otherwise the UID is scraped from the dataset web page.
+    """
+    permalink = metadata["permalink"]
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT uid, resource_url "
+                "FROM findopendata.socrata_uid_cache "
+                "WHERE permalink = %s;", (permalink,))
+        row = cur.fetchone()
+        cur.close()
+    if row is not None:
+        return row[0], row[1]
+
+    try:
+        uid, resource_url = _extract_socrata_uid_from_discovery(metadata,
+                app_token)
     except Exception as e:
-        logger.warning("(domain={} id={}) Failed to save resource from {}: {}".\
-                format(domain, id, original_url, e))
-        return
-    logger.info("(domain={} id={}) Finished saving resource from {} to {}".\
-            format(domain, uid, original_url, resource_blob_name))
+        logger.info("(permalink={}) Cannot use the dataset ID from the "
+                "Discovery API, scraping the web page: {}".format(permalink,
+                    e))
+        uid, resource_url = _extract_socrata_uid2(metadata)
 
-    # Initialize Postgres connection and cursor for registering resource.
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-
-    # Register this resource.
-    cur.execute("INSERT INTO findopendata.socrata_resources "
-            "(domain, id, metadata_blob, resource_blob, original_url, "
-            "dataset_size) VALUES (%s, %s, %s, %s, %s, %s) "
-            "ON CONFLICT (domain, id) DO UPDATE "
-            "SET updated = current_timestamp, "
-            "metadata_blob = EXCLUDED.metadata_blob, "
-            "resource_blob = EXCLUDED.resource_blob, "
-            "original_url = EXCLUDED.original_url, "
-            "dataset_size = EXCLUDED.dataset_size;",
-            (domain, uid, metadata_blob.name, resource_blob.name,
-                original_url, resource_blob.size))
-    conn.commit()
-
-    # Close database connection for checking resource.
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO findopendata.socrata_uid_cache "
+                "(permalink, domain, uid, resource_url) "
+                "VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (permalink) DO UPDATE "
+                "SET uid = EXCLUDED.uid, "
+                "resource_url = EXCLUDED.resource_url, "
+                "updated = current_timestamp;",
+                (permalink, metadata["metadata"]["domain"], uid, resource_url))
+        conn.commit()
+        cur.close()
+    return uid, resource_url
 
-    logger.info("(domain={} id={}) Successful.".format(domain, uid))
+
+_uid_reg = re.compile(r"^[a-z0-9A-Z]{4}-[a-z0-9A-Z]{4}$")
+
+
+def _extract_socrata_uid_from_discovery(metadata, app_token):
+    # Use the dataset ID from the Discovery API and verify that its resource
+    # URL serves records with a cheap single-record request.
+    domain = metadata["metadata"]["domain"]
+    uid = metadata["resource"]["id"]
+    if not _uid_reg.match(uid):
+        raise ValueError("Invalid dataset ID: {}".format(uid))
+    resource_url = "https://{}/resource/{}.json".format(domain, uid)
+    headers = {}
+    if app_token is not None:
+        headers["X-App-Token"] = app_token
+    resp = get_session(resource_url).get(resource_url,
+            params={r"$limit" : 1}, headers=headers)
+    resp.raise_for_status()
+    if not isinstance(resp.json(), list):
+        raise ValueError("{} does not respond with records".format(
+            resource_url))
+    return uid, resource_url
 
 
 def _extract_socrata_uid2(metadata):
@@ -123,7 +482,7 @@ def _extract_socrata_uid2(metadata):
             r"\/resource\/[a-z0-9A-Z]{4}-[a-z0-9A-Z]{4}\.json)")
     uid_reg = re.compile(r"https?:\/\/" + domain + \
             r"\/resource\/([a-z0-9A-Z]{4}-[a-z0-9A-Z]{4})\.json")
-    resp = requests.get(weburl)
+    resp = get_session(weburl).get(weburl)
     resp.raise_for_status()
     items = resource_url_reg.findall(resp.text)
     if len(items) != 1:
@@ -147,16 +506,75 @@ def add_socrata_resources_from_api(discovery_api_url, blob_prefix,
     """
     logger.info("(discovery_api_url=%s)" % (discovery_api_url))
     app_tokens = _get_socrata_app_tokens()
+    if not force_update:
+        logger.info("Reading last updated timestamps of Socrata resources")
+        updated_times = _get_socrata_updated_times()
     sources = _process_socrata_raw_metadata(discovery_api_url, 50, 
             random.choice(app_tokens))
+    skipped = 0
     for source in sources:
-        add_socrata_resource.delay(source, app_token=random.choice(app_tokens),
-                blob_prefix=blob_prefix, force_update=force_update)
+        if not force_update and not _is_socrata_resource_updated(source,
+                updated_times):
+            skipped += 1
+            continue
+        # Stage the metadata and pass only its blob name through the broker.
+        metadata_blob = storage.put_object(source,
+                _get_staging_blob_name(blob_prefix, source))
+        add_socrata_resource.delay(metadata_blob.name,
+                app_token=random.choice(app_tokens),
+                blob_prefix=blob_prefix, force_update=force_update,
+                freshness_checked=True)
+    logger.info("(discovery_api_url={}) Skipped {} resources not updated "
+            "since registered".format(discovery_api_url, skipped))
+
+
+def _get_staging_blob_name(blob_prefix, metadata):
+    # The blob name of the Discovery API metadata staged for the task, by
+    # the dataset ID as the UID is not yet resolved.
+    return "/".join([crawler_configs.get("staging_blob_prefix", "staging"),
+        blob_prefix, metadata["metadata"]["domain"],
+        metadata["resource"]["id"] + ".json"])
+
+
+def _get_socrata_updated_times():
+    # Get the registered times of all Socrata resources in one query, keyed
+    # by (domain, id) and by permalink, as the registered id is the resolved
+    # UID, which may differ from the dataset ID in the Discovery API.
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(r"""SELECT r.domain, r.id, c.permalink,
+                            r.updated::timestamptz
+                        FROM findopendata.socrata_resources AS r
+                        LEFT JOIN findopendata.socrata_uid_cache AS c
+                        ON r.domain = c.domain AND r.id = c.uid""")
+        updated_times = {}
+        for domain, uid, permalink, updated in cur:
+            updated_times[(domain, uid)] = updated
+            if permalink is not None:
+                updated_times[permalink] = updated
+        cur.close()
+    return updated_times
+
+
+def _is_socrata_resource_updated(metadata, updated_times):
+    # Whether the resource is new or updated since registered.
+    registered = updated_times.get(metadata.get("permalink"))
+    if registered is None:
+        registered = updated_times.get((metadata["metadata"]["domain"],
+            metadata["resource"]["id"]))
+    if registered is None:
+        return True
+    try:
+        last_updated = dateutil.parser.parse(
+                metadata["resource"]["updatedAt"])
+    except (KeyError, ValueError):
+        return True
+    return last_updated > registered
 
 
 def _process_socrata_raw_metadata(discovery_api_url, page_size, token):
     scroll_id = ""
-    sess = requests.session()
+    sess = get_session(discovery_api_url)
     while True:
         resp = sess.get(discovery_api_url,
                 params={"scroll_id" : scroll_id,
@@ -174,13 +592,12 @@ def _process_socrata_raw_metadata(discovery_api_url, page_size, token):
 
 
 def _get_socrata_app_tokens():
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-    cur.execute("SELECT token FROM findopendata.socrata_app_tokens "
-            "ORDER BY random()")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT token FROM findopendata.socrata_app_tokens "
+                "ORDER BY random()")
+        rows = cur.fetchall()
+        cur.close()
     if not rows:
         raise RuntimeError("Cannot found a Socrata app token!")
     return [row[0] for row in rows]
@@ -189,13 +606,12 @@ def _get_socrata_app_tokens():
 @app.task(ignore_result=True)
 def add_socrata_discovery_apis(force_update):
     """Add Socrata Discovery API endpoints to the crawler."""
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-    cur.execute("SELECT url "
-            "FROM findopendata.socrata_discovery_apis WHERE enabled = true")
-    api_urls = [row[0] for row in cur]
-    cur.close()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT url "
+                "FROM findopendata.socrata_discovery_apis WHERE enabled = true")
+        api_urls = [row[0] for row in cur]
+        cur.close()
     for api_url in api_urls:
         add_socrata_resources_from_api.delay(api_url,
                 crawler_configs.get("socrata_blob_prefix"), force_update)
@@ -0,0 +1,111 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import BlobStorage
+
+
+class AsyncBlobStorage(object):
+    """An asyncio interface to a blocking storage provider. Blocking calls
+    are run on a bounded thread pool so many blobs can be in flight at once
+    from a single process, which is useful for fetching small JSON blobs
+    whose cost is dominated by round trips.
+
+    Args:
+        storage: the BlobStorage provider (local, gcp or azure) to wrap.
+        max_concurrency: the maximum number of storage requests in flight.
+    """
+
+    def __init__(self, storage: BlobStorage, max_concurrency: int = 32):
+        self._storage = storage
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def _run(self, func, *args, **kwargs):
+        # asyncio.get_running_loop requires Python 3.7.
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor,
+                functools.partial(func, *args, **kwargs))
+
+    async def get_object(self, blob_name):
+        """Get a JSON blob as a Python dictionary object.
+
+        Args:
+            blob_name: the name of the blob.
+
+        Returns: a Python dictionary.
+        """
+        return await self._run(self._storage.get_object, blob_name)
+
+    async def get_range(self, blob_name, start, length):
+        """Get a byte range of a blob.
+
+        Args:
+            blob_name: the name of the blob.
+            start: the offset of the first byte to read.
+            length: the number of bytes to read.
+
+        Returns: the bytes read.
+        """
+        return await self._run(self._storage.get_range, blob_name, start,
+                length)
+
+    async def put_object(self, obj, blob_name):
+        """Save a single JSON-serializable Python dictionary to storage.
+
+        Args:
+            obj: the Python dictionary to be saved.
+            blob_name: the name of the destination blob.
+
+        Returns:
+            blob: the blob object that was created.
+        """
+        return await self._run(self._storage.put_object, obj, blob_name)
+
+    async def get_objects(self, blob_names, return_exceptions=False):
+        """Get many JSON blobs concurrently.
+
+        Args:
+            blob_names: an iterable of blob names.
+            return_exceptions: whether to return the exception raised for
+                a blob in place of its object instead of raising it.
+
+        Returns: a list of Python dictionaries in the order of blob_names.
+        """
+        return await asyncio.gather(
+                *[self.get_object(blob_name) for blob_name in blob_names],
+                return_exceptions=return_exceptions)
+
+    def close(self):
+        """Shut down the thread pool."""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_objects(storage, blob_names, max_concurrency=32,
+        return_exceptions=False):
+    """Get many JSON blobs concurrently from blocking code, such as a Celery
+    task.
+
+    Args:
+        storage: the BlobStorage provider.
+        blob_names: an iterable of blob names.
+        max_concurrency: the maximum number of storage requests in flight.
+        return_exceptions: whether to return the exception raised for
+            a blob in place of its object instead of raising it.
+
+    Returns: a list of Python dictionaries in the order of blob_names.
+    """
+    # Run on a new event loop rather than with asyncio.run, which requires
+    # Python 3.7, so it also works in threads without an event loop.
+    loop = asyncio.new_event_loop()
+    try:
+        with AsyncBlobStorage(storage, max_concurrency) as async_storage:
+            return loop.run_until_complete(async_storage.get_objects(
+                blob_names, return_exceptions=return_exceptions))
+    finally:
+        loop.close()
@@ -1,15 +1,18 @@
 import io
+import time
 import base64
 import contextlib
 import urllib
 import collections
 import gzip
+import shutil
 
 import fastavro
 import simplejson as json
 from azure.storage.blob import BlobBlock, ContainerClient, BlobClient
 
 from .base import Blob, BlobStorage
+from .compression import check_codec, dumps_object, loads_object
 
 
 def _encode_base64(data):
@@ -122,12 +125,21 @@ class AzureStorage(BlobStorage):
             for the connection string format.
         container_name: the name of the blob container in which all blobs
             are stored.
+        block_size: the size of staged blocks when writing large blobs.
+        object_compression: the compression codec for JSON object blobs,
+            one of None, `gzip` and `zstd`.
 
     """
 
     def __init__(
-        self, connection_string, container_name, block_size: int = 4 * 1024 * 1024
+        self,
+        connection_string,
+        container_name,
+        block_size: int = 4 * 1024 * 1024,
+        object_compression: str = None,
     ):
+        check_codec(object_compression)
+        self._object_compression = object_compression
         self._container = ContainerClient.from_connection_string(
             connection_string, container_name
         )
@@ -137,16 +149,39 @@ class AzureStorage(BlobStorage):
         self._block_size = block_size
 
     def get_object(self, blob_name):
+        return loads_object(self.get_bytes(blob_name))
+
+    def get_bytes(self, blob_name):
         blob_client = self._container.get_blob_client(blob_name)
-        blob_content = blob_client.download_blob().content_as_text()
-        return json.loads(blob_content)
+        return blob_client.download_blob().readall()
+
+    def get_range(self, blob_name, start, length):
+        blob_client = self._container.get_blob_client(blob_name)
+        return blob_client.download_blob(offset=start, length=length).readall()
 
     def put_object(self, obj, blob_name):
         blob_client = self._container.get_blob_client(blob_name)
-        blob_content = json.dumps(obj).encode("utf-8")
+        blob_content = dumps_object(obj, self._object_compression)
         blob_client.upload_blob(blob_content, overwrite=True)
         return Blob(blob_name, len(blob_content))
 
+    def copy(self, blob_name, dest_blob_name):
+        source = self._container.get_blob_client(blob_name)
+        dest = self._container.get_blob_client(dest_blob_name)
+        dest.start_copy_from_url(source.url)
+        # Copies within a storage account usually complete at once.
+        properties = dest.get_blob_properties()
+        while properties.copy.status == "pending":
+            time.sleep(1)
+            properties = dest.get_blob_properties()
+        if properties.copy.status != "success":
+            raise RuntimeError("Failed to copy blob {} to {}: {}".format(
+                blob_name, dest_blob_name, properties.copy.status))
+        return Blob(dest_blob_name, properties.size)
+
+    def delete(self, blob_name):
+        self._container.delete_blob(blob_name)
+
     @contextlib.contextmanager
     def get_file(self, blob_name):
         try:
@@ -156,8 +191,12 @@ class AzureStorage(BlobStorage):
             stream.close()
 
     def put_file(self, fileobj, blob_name):
-        self._container.upload_blob(blob_name, fileobj, overwrite=True)
-        size = fileobj.tell()
+        writer = AzureBlobWriter(
+            self._container.get_blob_client(blob_name), block_size=self._block_size
+        )
+        shutil.copyfileobj(fileobj, writer, self._block_size)
+        writer.close()
+        size = writer.tell()
         return Blob(blob_name, size)
 
     def put_avro(self, schema, records, blob_name, codec="snappy"):
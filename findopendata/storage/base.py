@@ -30,6 +30,31 @@ class BlobStorage(object):
         """
         pass
 
+    @abc.abstractmethod
+    def get_bytes(self, blob_name):
+        """Get the whole content of a blob as bytes.
+
+        Args:
+            blob_name: the name of the blob.
+
+        Returns: the bytes of the blob.
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_range(self, blob_name, start, length):
+        """Get a byte range of a blob.
+
+        Args:
+            blob_name: the name of the blob.
+            start: the offset of the first byte to read.
+            length: the number of bytes to read.
+
+        Returns: the bytes read, which may be shorter than length if the
+            range goes past the end of the blob.
+        """
+        pass
+
     @abc.abstractmethod
     @contextlib.contextmanager
     def get_file(self, blob_name):
@@ -49,7 +74,9 @@ class BlobStorage(object):
 
     @abc.abstractmethod
     def put_file(self, fileobj, blob_name):
-        """Save a flat file to the storage.
+        """Save a flat file to the storage. The file is read sequentially
+        until the end, so it can also be a non-seekable stream such as a HTTP
+        response body.
 
         Args:
             fileobj: the file object to be uploaded to the bucket.
@@ -89,6 +116,28 @@ class BlobStorage(object):
         """
         pass
 
+    @abc.abstractmethod
+    def copy(self, blob_name, dest_blob_name):
+        """Copy a blob, replacing the destination blob if it exists.
+
+        Args:
+            blob_name: the name of the source blob.
+            dest_blob_name: the name of the destination blob.
+
+        Returns:
+            blob: the destination blob.
+        """
+        pass
+
+    @abc.abstractmethod
+    def delete(self, blob_name):
+        """Delete a blob.
+
+        Args:
+            blob_name: the name of the blob.
+        """
+        pass
+
     @abc.abstractmethod
     def put_json(self, records, blob_name, gzip_compress=True):
         """Save JSON records to storage as a newline-delimited JSON file.
@@ -0,0 +1,79 @@
+"""Encoding of JSON object blobs with optional compression. The codec of a
+blob is detected from its magic bytes on read, so blobs written with any
+codec (including uncompressed blobs written before compression was enabled)
+can always be read back.
+"""
+import gzip
+
+import simplejson as json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# The supported codecs for object blobs, None means no compression.
+CODECS = (None, "gzip", "zstd")
+
+# The content types of object blobs by codec.
+CONTENT_TYPES = {
+        None: "application/json",
+        "gzip": "application/gzip",
+        "zstd": "application/zstd",
+        }
+
+
+def check_codec(codec):
+    """Raise ValueError if the codec is not supported or its library is not
+    installed."""
+    if codec not in CODECS:
+        raise ValueError("Unknown object compression codec: {}".format(codec))
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("The zstandard package is required for zstd "
+                "object compression.")
+
+
+def compress(data, codec=None):
+    """Compress bytes using the given codec.
+
+    Args:
+        data: the bytes to compress.
+        codec: one of None, `gzip` and `zstd`.
+
+    Returns: the compressed bytes.
+    """
+    check_codec(codec)
+    if codec == "gzip":
+        return gzip.compress(data)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress(data):
+    """Decompress bytes, detecting the codec from the magic bytes. Bytes
+    without a known magic number are returned as is.
+    """
+    if data.startswith(GZIP_MAGIC):
+        return gzip.decompress(data)
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("The zstandard package is required to read "
+                    "zstd-compressed blobs.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def dumps_object(obj, codec=None):
+    """Serialize a Python dictionary as JSON bytes compressed using the given
+    codec."""
+    return compress(json.dumps(obj).encode("utf-8"), codec)
+
+
+def loads_object(data):
+    """Deserialize JSON bytes written by dumps_object with any codec."""
+    return json.loads(decompress(data).decode("utf-8"))
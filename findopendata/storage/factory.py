@@ -2,32 +2,51 @@ import logging
 
 from ..settings import azure_configs
 from ..settings import local_configs
+from ..settings import memory_configs
 from ..settings import gcp_configs
+from ..settings import storage_configs
 from .base import BlobStorage
 from .gcp import GoogleCloudStorage
 from .azure import AzureStorage
 from .local import LocalStorage
+from .memory import InMemoryStorage
+from .instrumented import InstrumentedStorage
 
 
 def BlobStorageFactory(provider="local") -> BlobStorage:
-    """Create a storage provider.
+    """Create a storage provider. The provider is wrapped by
+    InstrumentedStorage when `storage.instrument` is set in the configs.
 
     Args:
         provider: the name of the storage provider. Choose among 
-            `local` and `gcp`.
+            `local`, `gcp`, `azure` and `memory`.
     
     Return: a storage provider of the class `BlobStorage`.
     """
+    storage = _create_provider(provider)
+    if storage_configs.get("instrument", False):
+        return InstrumentedStorage(storage, provider)
+    return storage
+
+
+def _create_provider(provider):
+    object_compression = storage_configs.get("object_compression") or None
     if provider == "local":
         root = local_configs.get("root")
-        return LocalStorage(root)
+        return LocalStorage(root, object_compression=object_compression)
+    if provider == "memory":
+        latency = float(memory_configs.get("latency") or 0)
+        bandwidth = memory_configs.get("bandwidth") or None
+        return InMemoryStorage(latency=latency, bandwidth=bandwidth,
+                object_compression=object_compression)
     if provider == "gcp":
         project_id = gcp_configs.get("project_id")
         bucket_name = gcp_configs.get("bucket_name")
         service_account_file = gcp_configs.get("service_account_file")
         return GoogleCloudStorage(project_id=project_id, 
                 bucket_name=bucket_name,
-                service_account_file=service_account_file)
+                service_account_file=service_account_file,
+                object_compression=object_compression)
     if provider == "azure":
         # Set logging level
         connection_string = azure_configs.get("connection_string") 
@@ -36,5 +55,6 @@ def BlobStorageFactory(provider="local") -> BlobStorage:
         logging.getLogger("azure.storage.common.storageclient")\
                 .setLevel(log_level)
         return AzureStorage(connection_string=connection_string,
-                container_name=container_name)
+                container_name=container_name,
+                object_compression=object_compression)
     raise ValueError("Uknown provider: "+provider)
@@ -9,6 +9,8 @@ from google.cloud import storage
 from gcsfs.core import GCSFileSystem
 
 from .base import BlobStorage, Blob
+from .compression import check_codec, dumps_object, loads_object, \
+        CONTENT_TYPES
 
 
 class GoogleCloudStorage(BlobStorage):
@@ -19,9 +21,17 @@ class GoogleCloudStorage(BlobStorage):
         bucket_name: the name of the Cloud Storage bucket to use for all blobs.
         service_account_file: the filename of the GCP service account JSON key 
             file.
+        object_compression: the compression codec for JSON object blobs,
+            one of None, `gzip` and `zstd`.
+        chunk_size: the chunk size of resumable uploads in put_file, must be
+            a multiple of 256 KB.
     """
     def __init__(self, project_id: str, bucket_name: str, 
-            service_account_file: str):
+            service_account_file: str, object_compression: str = None,
+            chunk_size: int = 8 * 1024 * 1024):
+        check_codec(object_compression)
+        self._chunk_size = chunk_size
+        self._object_compression = object_compression
         self._bucket_name = bucket_name
         self._client = storage.Client(project=project_id, 
                 credentials=service_account.Credentials.\
@@ -30,10 +40,32 @@ class GoogleCloudStorage(BlobStorage):
                 check_connection=True)
     
     def get_object(self, blob_name):
+        return loads_object(self.get_bytes(blob_name))
+
+    def get_bytes(self, blob_name):
         blob = self._client.bucket(self._bucket_name).get_blob(blob_name)
         if blob is None:
             raise ValueError("Cannot find blob: "+blob_name)
-        return json.loads(blob.download_as_string().decode("utf-8"))
+        return blob.download_as_string()
+
+    def get_range(self, blob_name, start, length):
+        blob = self._client.bucket(self._bucket_name).blob(blob_name)
+        # The end position is inclusive.
+        return blob.download_as_string(start=start, end=start+length-1)
+
+    def copy(self, blob_name, dest_blob_name):
+        bucket = self._client.bucket(self._bucket_name)
+        blob = bucket.get_blob(blob_name)
+        if blob is None:
+            raise ValueError("Cannot find blob: "+blob_name)
+        dest_blob = bucket.copy_blob(blob, bucket, dest_blob_name)
+        return Blob(dest_blob_name, dest_blob.size)
+
+    def delete(self, blob_name):
+        blob = self._client.bucket(self._bucket_name).get_blob(blob_name)
+        if blob is None:
+            raise ValueError("Cannot find blob: "+blob_name)
+        blob.delete()
 
     @contextlib.contextmanager
     def get_file(self, blob_name):
@@ -46,13 +78,17 @@ class GoogleCloudStorage(BlobStorage):
 
     def put_object(self, obj, blob_name):
         blob = self._client.bucket(self._bucket_name).blob(blob_name)
-        data = json.dumps(obj).encode("utf-8")
-        blob.upload_from_string(data, content_type="application/json")
+        data = dumps_object(obj, self._object_compression)
+        blob.upload_from_string(data,
+                content_type=CONTENT_TYPES[self._object_compression])
         blob.reload()
         return Blob(blob_name, blob.size)
 
     def put_file(self, fileobj, blob_name):
-        blob = self._client.bucket(self._bucket_name).blob(blob_name)
+        # Setting the chunk size makes a chunked resumable upload, so streams
+        # of unknown size are not read into memory.
+        blob = self._client.bucket(self._bucket_name).blob(blob_name,
+                chunk_size=self._chunk_size)
         blob.upload_from_file(fileobj)
         blob.reload()
         return Blob(blob_name, blob.size)
@@ -0,0 +1,162 @@
+import time
+import contextlib
+
+from ..metrics import registry as default_registry
+from .base import BlobStorage
+from .compression import loads_object
+
+
+class _InstrumentedReader(object):
+    """A proxy of a readonly binary file object that records the number
+    of bytes read."""
+
+    def __init__(self, fileobj, on_read):
+        self._fileobj = fileobj
+        self._on_read = on_read
+
+    def _counted(self, func, *args):
+        data = func(*args)
+        self._on_read(len(data))
+        return data
+
+    def read(self, *args):
+        return self._counted(self._fileobj.read, *args)
+
+    def read1(self, *args):
+        return self._counted(self._fileobj.read1, *args)
+
+    def readline(self, *args):
+        return self._counted(self._fileobj.readline, *args)
+
+    def readinto(self, b):
+        n = self._fileobj.readinto(b)
+        self._on_read(n or 0)
+        return n
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+
+class InstrumentedStorage(BlobStorage):
+    """A storage provider wrapper that records bytes read and written,
+    request counts and latencies for every operation in a metrics registry.
+
+    The following metrics are labeled by `provider` and `operation`:
+        storage_requests_total: the number of requests.
+        storage_errors_total: the number of requests that raised errors.
+        storage_bytes_read_total: the number of bytes read.
+        storage_bytes_written_total: the number of bytes written.
+        storage_request_seconds: the latency histogram of requests. For
+            get_file it is the time from opening to closing the file.
+
+    Args:
+        storage: the storage provider to wrap.
+        provider: the name of the storage provider used as label.
+        registry: the metrics registry, default is the process's registry.
+    """
+
+    def __init__(self, storage: BlobStorage, provider: str,
+            registry=default_registry):
+        self._storage = storage
+        self._provider = provider
+        self._requests = registry.counter("storage_requests_total",
+                "The number of storage requests.")
+        self._errors = registry.counter("storage_errors_total",
+                "The number of storage requests that raised errors.")
+        self._bytes_read = registry.counter("storage_bytes_read_total",
+                "The number of bytes read from storage.")
+        self._bytes_written = registry.counter("storage_bytes_written_total",
+                "The number of bytes written to storage.")
+        self._latency = registry.histogram("storage_request_seconds",
+                "The latency of storage requests in seconds.")
+
+    @property
+    def storage(self):
+        """The wrapped storage provider."""
+        return self._storage
+
+    def _record(self, operation, seconds, bytes_read=0, bytes_written=0):
+        labels = {"provider": self._provider, "operation": operation}
+        self._requests.inc(**labels)
+        self._latency.observe(seconds, **labels)
+        if bytes_read:
+            self._bytes_read.inc(bytes_read, **labels)
+        if bytes_written:
+            self._bytes_written.inc(bytes_written, **labels)
+
+    def _call(self, operation, func, *args):
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception:
+            self._errors.inc(provider=self._provider, operation=operation)
+            self._record(operation, time.perf_counter() - start)
+            raise
+        return result, time.perf_counter() - start
+
+    def _read(self, operation, func, *args):
+        data, seconds = self._call(operation, func, *args)
+        self._record(operation, seconds, bytes_read=len(data))
+        return data
+
+    def _write(self, operation, func, *args):
+        blob, seconds = self._call(operation, func, *args)
+        self._record(operation, seconds, bytes_written=blob.size or 0)
+        return blob
+
+    def get_object(self, blob_name):
+        return loads_object(self._read("get_object",
+                self._storage.get_bytes, blob_name))
+
+    def get_bytes(self, blob_name):
+        return self._read("get_bytes", self._storage.get_bytes, blob_name)
+
+    def get_range(self, blob_name, start, length):
+        return self._read("get_range", self._storage.get_range, blob_name,
+                start, length)
+
+    @contextlib.contextmanager
+    def get_file(self, blob_name):
+        def _on_read(n):
+            self._bytes_read.inc(n, provider=self._provider,
+                    operation="get_file")
+        self._requests.inc(provider=self._provider, operation="get_file")
+        start = time.perf_counter()
+        try:
+            with self._storage.get_file(blob_name) as fileobj:
+                yield _InstrumentedReader(fileobj, _on_read)
+        except Exception:
+            self._errors.inc(provider=self._provider, operation="get_file")
+            raise
+        finally:
+            self._latency.observe(time.perf_counter() - start,
+                    provider=self._provider, operation="get_file")
+
+    def put_file(self, fileobj, blob_name):
+        return self._write("put_file", self._storage.put_file, fileobj,
+                blob_name)
+
+    def put_object(self, obj, blob_name):
+        return self._write("put_object", self._storage.put_object, obj,
+                blob_name)
+
+    def put_avro(self, schema, records, blob_name, codec="snappy"):
+        return self._write("put_avro", self._storage.put_avro, schema,
+                records, blob_name, codec)
+
+    def copy(self, blob_name, dest_blob_name):
+        blob, seconds = self._call("copy", self._storage.copy, blob_name,
+                dest_blob_name)
+        self._record("copy", seconds)
+        return blob
+
+    def delete(self, blob_name):
+        _, seconds = self._call("delete", self._storage.delete, blob_name)
+        self._record("delete", seconds)
+
+    def put_json(self, records, blob_name, gzip_compress=True):
+        return self._write("put_json", self._storage.put_json, records,
+                blob_name, gzip_compress)
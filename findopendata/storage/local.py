@@ -7,6 +7,7 @@ import simplejson as json
 import fastavro
 
 from .base import BlobStorage, Blob
+from .compression import check_codec, dumps_object, loads_object
 
 
 class LocalStorage(BlobStorage):
@@ -14,10 +15,14 @@ class LocalStorage(BlobStorage):
 
     Args:
         root: the root directory, will be created if not exists.
+        object_compression: the compression codec for JSON object blobs,
+            one of None, `gzip` and `zstd`.
     """
 
-    def __init__(self, root):
+    def __init__(self, root, object_compression=None):
+        check_codec(object_compression)
         self._root = root
+        self._object_compression = object_compression
         # Create if not exists.
         if not os.path.exists(self._root):
             os.makedirs(self._root)
@@ -36,10 +41,20 @@ class LocalStorage(BlobStorage):
         return path
     
     def get_object(self, blob_name):
+        return loads_object(self.get_bytes(blob_name))
+
+    def get_bytes(self, blob_name):
+        path = self._get_and_check_path(blob_name)
+        with open(path, "rb") as f:
+            data = f.read()
+        return data
+
+    def get_range(self, blob_name, start, length):
         path = self._get_and_check_path(blob_name)
-        with open(path, "r") as f:
-            obj = json.load(f)
-        return obj
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(length)
+        return data
 
     @contextlib.contextmanager
     def get_file(self, blob_name):
@@ -59,8 +74,8 @@ class LocalStorage(BlobStorage):
     
     def put_object(self, obj, blob_name):
         path = self._get_path_and_create_dir(blob_name)
-        with open(path, "w") as f:
-            json.dump(obj, f)
+        with open(path, "wb") as f:
+            f.write(dumps_object(obj, self._object_compression))
         size = os.path.getsize(path)
         return Blob(blob_name, size)
     
@@ -71,6 +86,19 @@ class LocalStorage(BlobStorage):
         size = os.path.getsize(path)
         return Blob(blob_name, size)
     
+    def copy(self, blob_name, dest_blob_name):
+        path = self._get_and_check_path(blob_name)
+        dest_path = self._get_path_and_create_dir(dest_blob_name)
+        # Replace the destination at once by renaming a complete copy.
+        tmp_path = dest_path + ".copying"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, dest_path)
+        size = os.path.getsize(dest_path)
+        return Blob(dest_blob_name, size)
+
+    def delete(self, blob_name):
+        os.remove(self._get_and_check_path(blob_name))
+
     def put_json(self, records, blob_name, gzip_compress=True):
         path = self._get_path_and_create_dir(blob_name)
         newline = "\n"
@@ -0,0 +1,161 @@
+import io
+import time
+import gzip
+import threading
+import contextlib
+
+import simplejson as json
+import fastavro
+
+from .base import BlobStorage, Blob
+from .compression import check_codec, dumps_object, loads_object
+
+
+class _ThrottledReader(io.BufferedIOBase):
+    """A readonly binary file over bytes that sleeps to simulate a
+    bandwidth limit."""
+
+    def __init__(self, data, throttle):
+        self._buf = io.BytesIO(data)
+        self._throttle = throttle
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self._buf.read(size)
+        self._throttle(len(data))
+        return data
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._buf.seek(offset, whence)
+
+    def tell(self):
+        return self._buf.tell()
+
+
+class InMemoryStorage(BlobStorage):
+    """Storage provider that keeps all blobs in the memory of this process,
+    for tests and benchmarks. Remote storage can be simulated by injecting a
+    fixed latency per request and a bandwidth limit.
+
+    Args:
+        latency: the seconds to wait before each request.
+        bandwidth: the maximum bytes per second transferred for reads and
+            writes, None for unlimited.
+        object_compression: the compression codec for JSON object blobs,
+            one of None, `gzip` and `zstd`.
+    """
+
+    def __init__(self, latency: float = 0.0, bandwidth: float = None,
+            object_compression: str = None):
+        check_codec(object_compression)
+        self._latency = latency
+        self._bandwidth = bandwidth
+        self._object_compression = object_compression
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def _wait_for_request(self):
+        if self._latency:
+            time.sleep(self._latency)
+
+    def _wait_for_transfer(self, size):
+        if self._bandwidth:
+            time.sleep(float(size) / float(self._bandwidth))
+
+    def _get(self, blob_name):
+        self._wait_for_request()
+        with self._lock:
+            data = self._blobs.get(blob_name)
+        if data is None:
+            raise ValueError("Cannot find blob: "+blob_name)
+        return data
+
+    def _put(self, data, blob_name):
+        self._wait_for_transfer(len(data))
+        with self._lock:
+            self._blobs[blob_name] = bytes(data)
+        return Blob(blob_name, len(data))
+
+    def get_object(self, blob_name):
+        return loads_object(self.get_bytes(blob_name))
+
+    def get_bytes(self, blob_name):
+        data = self._get(blob_name)
+        self._wait_for_transfer(len(data))
+        return data
+
+    def get_range(self, blob_name, start, length):
+        data = self._get(blob_name)[start:start+length]
+        self._wait_for_transfer(len(data))
+        return data
+
+    @contextlib.contextmanager
+    def get_file(self, blob_name):
+        fileobj = _ThrottledReader(self._get(blob_name),
+                self._wait_for_transfer)
+        try:
+            yield fileobj
+        finally:
+            fileobj.close()
+
+    def put_file(self, fileobj, blob_name):
+        self._wait_for_request()
+        return self._put(fileobj.read(), blob_name)
+
+    def put_object(self, obj, blob_name):
+        self._wait_for_request()
+        return self._put(dumps_object(obj, self._object_compression),
+                blob_name)
+
+    def put_avro(self, schema, records, blob_name, codec="snappy"):
+        self._wait_for_request()
+        buf = io.BytesIO()
+        fastavro.writer(buf, schema, records, codec)
+        return self._put(buf.getvalue(), blob_name)
+
+    def put_json(self, records, blob_name, gzip_compress=True):
+        self._wait_for_request()
+        buf = io.StringIO()
+        newline = "\n"
+        for record in records:
+            buf.write(json.dumps(record))
+            buf.write(newline)
+        data = buf.getvalue().encode("utf-8")
+        if gzip_compress:
+            data = gzip.compress(data)
+        return self._put(data, blob_name)
+
+    def copy(self, blob_name, dest_blob_name):
+        data = self._get(blob_name)
+        with self._lock:
+            self._blobs[dest_blob_name] = data
+        return Blob(dest_blob_name, len(data))
+
+    def delete(self, blob_name):
+        self._wait_for_request()
+        with self._lock:
+            if self._blobs.pop(blob_name, None) is None:
+                raise ValueError("Cannot find blob: "+blob_name)
+
+    def exists(self, blob_name):
+        """Whether a blob with the given name exists."""
+        with self._lock:
+            return blob_name in self._blobs
+
+    def clear(self):
+        """Remove all blobs."""
+        with self._lock:
+            self._blobs.clear()
@@ -7,17 +7,70 @@ class TableSketch:
     """A TableSketch contains summaries of a table, including the column 
     sketches.
 
+    The columns are given by the keys of the first record, and only the
+    values of these columns are sketched. The column sketches are created
+    when the columns are first seen, and with the exact_threshold keyword
+    argument, they keep the distinct values exactly until there are more
+    than exact_threshold of them.
+
     Args:
         record_sample_size: the number of record to include in the sample.
+        max_columns: the maximum number of columns sketched, the columns
+            after them are skipped, None for no limit.
         column_sketch_kwargs: keyword arguments for ColumnSketch's constructor.
     """
 
-    def __init__(self, record_sample_size=20, **column_sketch_kwargs):
+    def __init__(self, record_sample_size=20, max_columns=None,
+            **column_sketch_kwargs):
         self._column_sketches = {}
         self._record_sample_size = record_sample_size
+        self._max_columns = max_columns
         self._sample = []
         self._column_names = []
+        self._column_name_set = set()
+        self._skipped_columns = 0
+        self._skipped_values = 0
         self._column_sketch_kwargs = column_sketch_kwargs
+
+    @classmethod
+    def from_state(cls, state, **column_sketch_kwargs):
+        """Restore a table sketch from the state created by get_state.
+
+        Args:
+            state: the state as a Python dictionary.
+            column_sketch_kwargs: keyword arguments for ColumnSketch's
+                constructor that are not in the state (e.g., model).
+        """
+        kwargs = dict(state["column_sketch_kwargs"], **column_sketch_kwargs)
+        sketch = cls(record_sample_size=state["record_sample_size"],
+                max_columns=state.get("max_columns"), **kwargs)
+        sketch._sample = state["record_sample"]
+        sketch._column_names = state["column_names"]
+        sketch._column_name_set = set(state["column_names"])
+        sketch._skipped_columns = state.get("skipped_columns", 0)
+        sketch._skipped_values = state.get("skipped_values", 0)
+        model_kwargs = dict((k, v) for k, v in column_sketch_kwargs.items()
+                if k == "model")
+        for column_state in state["column_sketches"]:
+            sketch._column_sketches[column_state["column_name"]] = \
+                    ColumnSketch.from_state(column_state, **model_kwargs)
+        return sketch
+
+    def get_state(self):
+        """The complete state of this sketch, including all column sketches,
+        as a JSON-serializable Python dictionary."""
+        return {
+                "record_sample_size": self._record_sample_size,
+                "record_sample": self._sample,
+                "column_names": self._column_names,
+                "max_columns": self._max_columns,
+                "skipped_columns": self._skipped_columns,
+                "skipped_values": self._skipped_values,
+                "column_sketch_kwargs": dict((k, v) for k, v in
+                    self._column_sketch_kwargs.items() if k != "model"),
+                "column_sketches": [sketch.get_state()
+                    for sketch in self._column_sketches.values()],
+                }
     
     @property
     def column_sketches(self):
@@ -34,19 +87,48 @@ class TableSketch:
         """Column names in the order from left to right."""
         return self._column_names
     
+    @property
+    def memory_usage(self):
+        """A report of the memory used by the column sketches, and the
+        columns and values skipped to stay within max_columns, as a
+        dictionary."""
+        exact_columns = sum(1 for sketch in self._column_sketches.values()
+                if sketch.is_exact)
+        return {
+                "columns": len(self._column_sketches),
+                "exact_columns": exact_columns,
+                "sketched_columns": len(self._column_sketches) - exact_columns,
+                "skipped_columns": self._skipped_columns,
+                "skipped_values": self._skipped_values,
+                "estimated_bytes": sum(sketch.memory_usage
+                    for sketch in self._column_sketches.values()),
+                }
+
     def update(self, record):
         # Check type.
         if not isinstance(record, OrderedDict):
             raise TypeError("record must be an OrderedDict")
         # Assign column names.
         if not self._column_names:
-            self._column_names = list(record.keys())
+            column_names = list(record.keys())
+            if self._max_columns is not None and \
+                    len(column_names) > self._max_columns:
+                self._skipped_columns = len(column_names) - self._max_columns
+                column_names = column_names[:self._max_columns]
+            self._column_names = column_names
+            self._column_name_set = set(column_names)
         # Update column sketches.
         for column_name, value in record.items():
-            if column_name not in self._column_sketches:
-                self._column_sketches[column_name] = ColumnSketch(column_name, 
+            sketch = self._column_sketches.get(column_name)
+            if sketch is None:
+                if column_name not in self._column_name_set:
+                    # Not a column of the table.
+                    self._skipped_values += 1
+                    continue
+                sketch = ColumnSketch(column_name,
                         **self._column_sketch_kwargs)
-            self._column_sketches[column_name].update(value)
+                self._column_sketches[column_name] = sketch
+            sketch.update(value)
         # Update record sample.
         if len(self._sample) < self._record_sample_size:
             self._sample.append(dict(record))
@@ -1,12 +1,13 @@
 #!/usr/bin/env python
 import sys
 import argparse
-import collections
-
-import psycopg2
 
 from findopendata.settings import db_configs
-from findopendata.metadata import index_ckan_package, index_socrata_resource
+from findopendata.celery import app
+from findopendata.enqueue import count_rows, stream_rows, batched, \
+        enqueue, get_queue_depth
+from findopendata.metadata import index_ckan_package, index_ckan_packages, \
+        index_socrata_resource
 
 
 _sql_ckan_force_update = r"""
@@ -39,7 +40,8 @@ WHERE package_updated IS NULL OR crawler_updated > package_updated
 """
 
 _sql_socrata_force_update = r"""
-SELECT r.key, r.domain, r.metadata_blob, r.resource_blob, r.dataset_size
+SELECT r.key, r.domain, r.metadata_blob, r.resource_blob, r.dataset_size,
+    r.content_fingerprint, r.sketch_blob
 FROM findopendata.socrata_resources as r, findopendata.original_hosts as h
 WHERE r.domain = h.original_host AND h.enabled
 """
@@ -52,19 +54,21 @@ WITH updated_times AS (
 ),
 enabled_resources AS (
     SELECT r.key, r.domain, r.metadata_blob, r.resource_blob, r.dataset_size,
-        r.updated
+        r.content_fingerprint, r.sketch_blob, r.updated
     FROM findopendata.socrata_resources as r, findopendata.original_hosts as h
     WHERE r.domain = h.original_host AND h.enabled
 ),
 resources AS (
     SELECT a.key, a.domain, a.metadata_blob, a.resource_blob,
-        a.dataset_size, a.updated as crawler_updated,
+        a.dataset_size, a.content_fingerprint, a.sketch_blob,
+        a.updated as crawler_updated,
         u.updated as package_updated
     FROM enabled_resources as a
     LEFT JOIN updated_times as u
     ON a.key = u.key
 )
-SELECT key, domain, metadata_blob, resource_blob, dataset_size
+SELECT key, domain, metadata_blob, resource_blob, dataset_size,
+    content_fingerprint, sketch_blob
 FROM resources
 WHERE package_updated IS NULL OR crawler_updated > package_updated
 """
@@ -74,45 +78,70 @@ if __name__ == "__main__":
         description="Extract and generate package metadata and "
         "make the packages searchable.")
     parser.add_argument("-u", "--force-update", action="store_true")
+    parser.add_argument("-b", "--batch-size", type=int, default=1,
+            help="The number of CKAN packages indexed per task.")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+            help="The number of tasks sent between checks of the queue.")
+    parser.add_argument("--max-queue-depth", type=int, default=10000,
+            help="Pause sending tasks while the queue has more messages.")
     args = parser.parse_args(sys.argv[1:])
 
+    def _get_queue_depth():
+        return get_queue_depth(app, app.conf.task_default_queue)
+
     # CKAN
     print("Creating CKAN tasks (force_update = {})...".format(args.force_update))
-    ckan_packages = collections.deque([])
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-    cur.execute((_sql_ckan_force_update if args.force_update else _sql_ckan))
-    for row in cur:
-        ckan_packages.append(row)
-    cur.close()
-    conn.close()
-    print("Sending {} CKAN tasks to workers...".format(len(ckan_packages)))
-    for key, package_blob, endpoint in ckan_packages:
-        index_ckan_package.delay(
-            crawler_package_key=key,
-            package_blob_name=package_blob,
-            endpoint=endpoint)
+    sql = _sql_ckan_force_update if args.force_update else _sql_ckan
+    total = count_rows(db_configs, sql)
+    ckan_packages = stream_rows(db_configs, sql, name="ckan_packages")
+    if args.batch_size > 1:
+        print("Sending {} CKAN packages in tasks of {} to workers...".format(
+            total, args.batch_size))
+
+        def _send(packages):
+            index_ckan_packages.delay(packages=packages)
+
+        enqueue(batched(ckan_packages, args.batch_size), _send,
+                total=(total + args.batch_size - 1) // args.batch_size,
+                chunk_size=max(args.chunk_size // args.batch_size, 1),
+                max_queue_depth=args.max_queue_depth,
+                get_queue_depth=_get_queue_depth)
+    else:
+        print("Sending {} CKAN tasks to workers...".format(total))
+
+        def _send(row):
+            key, package_blob, endpoint = row
+            index_ckan_package.delay(
+                crawler_package_key=key,
+                package_blob_name=package_blob,
+                endpoint=endpoint)
+
+        enqueue(ckan_packages, _send, total=total,
+                chunk_size=args.chunk_size,
+                max_queue_depth=args.max_queue_depth,
+                get_queue_depth=_get_queue_depth)
     print("Done sending CKAN tasks.")
-    ckan_packages.clear()
 
     # Socrata
     print("Creating Socrata tasks (force_update = {})...".format(args.force_update))
-    socrata_resources = collections.deque([])
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor()
-    cur.execute((_sql_socrata_force_update if args.force_update else _sql_socrata))
-    for row in cur:
-        socrata_resources.append(row)
-    cur.close()
-    conn.close()
-    print("Sending {} Socrata tasks to workers...".format(len(socrata_resources)))
-    for key, domain, metadata_blob, resource_blob, dataset_size in \
-            socrata_resources:
+    sql = _sql_socrata_force_update if args.force_update else _sql_socrata
+    total = count_rows(db_configs, sql)
+    print("Sending {} Socrata tasks to workers...".format(total))
+
+    def _send(row):
+        key, domain, metadata_blob, resource_blob, dataset_size, \
+                content_fingerprint, sketch_blob = row
         index_socrata_resource.delay(
             crawler_key=key,
             domain=domain,
             metadata_blob_name=metadata_blob,
             resource_blob_name=resource_blob,
-            dataset_size=dataset_size)
+            dataset_size=dataset_size,
+            content_fingerprint=content_fingerprint,
+            sketch_blob=sketch_blob)
+
+    enqueue(stream_rows(db_configs, sql, name="socrata_resources"), _send,
+            total=total, chunk_size=args.chunk_size,
+            max_queue_depth=args.max_queue_depth,
+            get_queue_depth=_get_queue_depth)
     print("Done sending Socrata tasks.")
-    socrata_resources.clear()
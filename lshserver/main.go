@@ -2,6 +2,7 @@ package main
 
 import (
 	"database/sql"
+	"encoding/binary"
 	"encoding/json"
 	"fmt"
 	"io"
@@ -15,7 +16,6 @@ import (
 	"github.com/gin-gonic/gin"
 	"google.golang.org/appengine"
 
-	"github.com/lib/pq"
 	_ "github.com/lib/pq"
 )
 
@@ -23,7 +23,32 @@ var (
 	threshold = 0.1
 )
 
-func indexing(db *sql.DB) (lsh *minhashlsh.MinhashLSH, minhashSize, minhashSeed int) {
+// decodeMinhash reads the hash values saved as little-endian unsigned
+// integers of the given number of bits (8, 16 or 32), see
+// findopendata/sketch_encoding.py.
+func decodeMinhash(data []byte, bits int) ([]uint64, error) {
+	width := bits / 8
+	if (width != 1 && width != 2 && width != 4) || bits%8 != 0 {
+		return nil, fmt.Errorf("Unsupported number of minhash bits %v", bits)
+	}
+	if len(data)%width != 0 {
+		return nil, fmt.Errorf("Incorrect minhash length %v for %v bits", len(data), bits)
+	}
+	values := make([]uint64, len(data)/width)
+	for i := range values {
+		switch width {
+		case 1:
+			values[i] = uint64(data[i])
+		case 2:
+			values[i] = uint64(binary.LittleEndian.Uint16(data[i*2:]))
+		case 4:
+			values[i] = uint64(binary.LittleEndian.Uint32(data[i*4:]))
+		}
+	}
+	return values, nil
+}
+
+func indexing(db *sql.DB) (lsh *minhashlsh.MinhashLSH, minhashSize, minhashSeed, minhashBits int) {
 	sqlPredicates := `count != empty_count
 					AND (
 						distinct_count >= 10
@@ -31,26 +56,37 @@ func indexing(db *sql.DB) (lsh *minhashlsh.MinhashLSH, minhashSize, minhashSeed
 						distinct_count::float / (count - empty_count)::float >= 0.9
 					)`
 	log.Print("Counting indexable column sketches...")
+	// Column sketches saved with different minhash bits cannot be compared,
+	// e.g., during a migration to b-bit minhash, so only those with the
+	// most common minhash bits are indexed.
 	var count int
-	err := db.QueryRow(`SELECT count(*) as count
+	err := db.QueryRow(`SELECT minhash_bits, count(*) as num_sketches
 			FROM findopendata.column_sketches 
-			WHERE ` + sqlPredicates).Scan(&count)
+			WHERE `+sqlPredicates+`
+			GROUP BY minhash_bits
+			ORDER BY num_sketches DESC
+			LIMIT 1`).Scan(&minhashBits, &count)
 	if err != nil {
 		log.Fatal(err)
 	}
-	log.Printf("Indexing started, scanning %d column sketches...", count)
+	log.Printf("Indexing started, scanning %d column sketches with %d minhash bits...", count, minhashBits)
 	rows, err := db.Query(`SELECT id, minhash, seed 
 						FROM findopendata.column_sketches
-						WHERE ` + sqlPredicates)
+						WHERE `+sqlPredicates+`
+						AND minhash_bits = $1`, minhashBits)
 	if err != nil {
 		log.Fatal(err)
 	}
 	minhashSize, minhashSeed = -1, -1
 	var id string
-	var minhash []int64
+	var data []byte
 	var seed int
 	for rows.Next() {
-		if err := rows.Scan(&id, pq.Array(&minhash), &seed); err != nil {
+		if err := rows.Scan(&id, &data, &seed); err != nil {
+			log.Fatal(err)
+		}
+		minhash, err := decodeMinhash(data, minhashBits)
+		if err != nil {
 			log.Fatal(err)
 		}
 		if minhashSize == -1 {
@@ -66,11 +102,7 @@ func indexing(db *sql.DB) (lsh *minhashlsh.MinhashLSH, minhashSize, minhashSeed
 		if lsh == nil {
 			lsh = minhashlsh.NewMinhashLSH(minhashSize, threshold, count)
 		}
-		minhashUnsigned := make([]uint64, len(minhash))
-		for i := range minhash {
-			minhashUnsigned[i] = uint64(minhash[i])
-		}
-		lsh.Add(id, minhashUnsigned)
+		lsh.Add(id, minhash)
 	}
 	if err := rows.Err(); err != nil {
 		log.Fatal(err)
@@ -82,8 +114,9 @@ func indexing(db *sql.DB) (lsh *minhashlsh.MinhashLSH, minhashSize, minhashSeed
 }
 
 type request struct {
-	Seed    int      `json:"seed"`
-	Minhash []uint64 `json:"minhash"`
+	Seed        int      `json:"seed"`
+	MinhashBits int      `json:"minhash_bits"`
+	Minhash     []uint64 `json:"minhash"`
 }
 
 type response []string
@@ -96,7 +129,7 @@ func main() {
 		log.Fatalf("Could not open db: %v", err)
 	}
 	// Build Minhash LSH index.
-	lsh, minhashSize, minhashSeed := indexing(db)
+	lsh, minhashSize, minhashSeed, minhashBits := indexing(db)
 	// Close database connection.
 	if err := db.Close(); err != nil {
 		log.Fatal(err)
@@ -138,6 +171,12 @@ func main() {
 			c.AbortWithError(http.StatusBadRequest, err)
 			return
 		}
+		if req.MinhashBits != minhashBits {
+			err := fmt.Errorf("Incorrect minhash bits, expecting %v", minhashBits)
+			c.Error(err).SetType(gin.ErrorTypePublic)
+			c.AbortWithError(http.StatusBadRequest, err)
+			return
+		}
 		results := lsh.Query(req.Minhash)
 		resp := make(response, len(results))
 		for i := range results {
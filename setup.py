@@ -48,7 +48,10 @@ setuptools.setup(
     extras_require={
         "test": [
             "nose2>=0.9.1",
-        ]
+        ],
+        "zstd": [
+            "zstandard>=0.13.0",
+        ],
     },
     scripts=[
         "harvest_datasets.py",
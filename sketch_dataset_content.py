@@ -1,13 +1,14 @@
 #!/usr/bin/env python
 import sys
 import argparse
-import collections
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Json
 
 from findopendata.settings import db_configs, index_configs
-from findopendata.indexing import sketch_package_file
+from findopendata.celery import app
+from findopendata.enqueue import count_rows, stream_rows, enqueue, \
+        get_queue_depth
+from findopendata.indexing import sketch_package_file, get_sketch_params
 
 
 _sql = r"""
@@ -18,20 +19,29 @@ WITH updated_times AS (
 ),
 package_files AS (
     SELECT f.key, f.blob_name, f.format, f.updated as file_updated,
+        f.content_fingerprint, f.sketch_fingerprint, f.sketch_params,
         u.updated as sketch_updated
     FROM findopendata.package_files as f
     LEFT JOIN updated_times as u
     ON f.key = u.key
 )
-SELECT key, blob_name, format
+SELECT key, blob_name, format, content_fingerprint
 FROM package_files
-WHERE (sketch_updated IS NULL OR file_updated > sketch_updated)
-    AND blob_name IS NOT NULL
+WHERE blob_name IS NOT NULL AND (
+    sketch_updated IS NULL
+    -- Sketches saved with a content fingerprint are created again only if
+    -- the content or the sketch parameters have changed.
+    OR (sketch_fingerprint IS NOT NULL AND (
+        content_fingerprint IS DISTINCT FROM sketch_fingerprint
+        OR sketch_params IS DISTINCT FROM %(sketch_params)s::jsonb))
+    -- Otherwise, by the updated time of the package file.
+    OR (sketch_fingerprint IS NULL AND file_updated > sketch_updated)
+)
 """
 
 
 _sql_force_update = r"""
-SELECT key, blob_name, format
+SELECT key, blob_name, format, content_fingerprint
 FROM findopendata.package_files
 WHERE blob_name IS NOT NULL
 """
@@ -41,28 +51,31 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(
             description="Creating column sketches of all package files.")
     parser.add_argument("-u", "--force-update", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=1000,
+            help="The number of tasks sent between checks of the queue.")
+    parser.add_argument("--max-queue-depth", type=int, default=10000,
+            help="Pause sending tasks while the queue has more messages.")
     args = parser.parse_args(sys.argv[1:])
 
     print("Creating tasks (force_update = {})...".format(args.force_update))
-    package_files = collections.deque([])
-    conn = psycopg2.connect(**db_configs)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute((_sql_force_update if args.force_update else _sql))
-    for row in cur:
-        package_files.append(row)
-    cur.close()
-    conn.close()
-    print("Sending {} tasks to workers.".format(len(package_files)))
-    for package_file in package_files:
+    sketch_params = get_sketch_params(index_configs)
+    sql = _sql_force_update if args.force_update else _sql
+    params = {"sketch_params": Json(sketch_params)}
+    total = count_rows(db_configs, sql, params)
+    print("Sending {} tasks to workers.".format(total))
+
+    def _send(package_file):
         fmt = package_file["format"].strip().lower()
         sketch_package_file.delay(package_file_key=package_file["key"],
                 blob_name=package_file["blob_name"],
                 dataset_format=fmt,
-                max_records=index_configs["max_records_per_dataset"],
-                table_sample_size=index_configs["table_sample_size"],
-                minhash_size=index_configs["minhash_size"],
-                minhash_seed=index_configs["minhash_seed"],
-                hyperloglog_p=index_configs["hyperloglog_p"],
-                column_sample_size=index_configs["column_sample_size"],
-                enable_word_vector_data=index_configs["enable_word_vector_data"])
+                content_fingerprint=package_file["content_fingerprint"],
+                **sketch_params)
+
+    enqueue(stream_rows(db_configs, sql, params, name="package_files",
+                cursor_factory=RealDictCursor), _send,
+            total=total, chunk_size=args.chunk_size,
+            max_queue_depth=args.max_queue_depth,
+            get_queue_depth=lambda: get_queue_depth(app,
+                app.conf.task_default_queue))
     print("Done sending tasks")
@@ -37,11 +37,18 @@ CREATE TABLE IF NOT EXISTS findopendata.socrata_resources (
     original_url text NOT NULL,
     -- The size of the dataset in bytes.
     dataset_size bigint NOT NULL,
+    -- The fingerprint (hash and length) of the downloaded records.
+    content_fingerprint text,
+    -- The storage blob name of the sketch state of the downloaded records,
+    -- with the row identifier of the last record for incremental downloads.
+    sketch_blob text,
     -- The time this resource is added.
     added timestamp default current_timestamp,
     -- The time this resource record is last updated.
     updated timestamp default current_timestamp
 );
+ALTER TABLE findopendata.socrata_resources ADD COLUMN IF NOT EXISTS content_fingerprint text;
+ALTER TABLE findopendata.socrata_resources ADD COLUMN IF NOT EXISTS sketch_blob text;
 CREATE UNIQUE INDEX IF NOT EXISTS socrata_resources_idx ON findopendata.socrata_resources (domain, id);
 
 /* The registry of all CKAN API endpoints.
@@ -55,6 +62,9 @@ CREATE TABLE IF NOT EXISTS findopendata.ckan_apis (
     enabled boolean NOT NULL default false
 );
 CREATE UNIQUE INDEX IF NOT EXISTS ckan_apis_idx ON findopendata.ckan_apis (scheme, endpoint);
+-- The high-water mark of metadata_modified of the packages read from this
+-- endpoint, used by incremental crawls.
+ALTER TABLE findopendata.ckan_apis ADD COLUMN IF NOT EXISTS modified_since timestamptz;
 INSERT INTO findopendata.ckan_apis (endpoint, name, region, enabled) VALUES
 ('data.gov.uk', 'UK Open Data', 'United Kingdoms', true),
 ('open.canada.ca/data/en', 'Canadian Open Data', 'Canada', true)
@@ -96,10 +106,63 @@ CREATE TABLE IF NOT EXISTS findopendata.ckan_resources (
     file_size bigint,
     -- The portion of the raw CKAN metadata associated with this resource.
     raw_metadata jsonb NOT NULL,
+    -- The storage blob name of the sketch state created during ingest.
+    sketch_blob text,
+    -- The fingerprint (hash and length) of the downloaded file.
+    content_fingerprint text,
     -- The time this file record is added.
     added timestamp default current_timestamp,
     -- The time this file record is last updated
     updated timestamp default current_timestamp
 );
+ALTER TABLE findopendata.ckan_resources ADD COLUMN IF NOT EXISTS sketch_blob text;
+ALTER TABLE findopendata.ckan_resources ADD COLUMN IF NOT EXISTS content_fingerprint text;
 CREATE UNIQUE INDEX IF NOT EXISTS ckan_resources_idx ON findopendata.ckan_resources (package_key, resource_id);
 
+
+/* The HTTP validators of the last download of each URL, used to make
+ * conditional requests and to skip unchanged resources.
+ */
+CREATE TABLE IF NOT EXISTS findopendata.http_validators (
+    -- The original URL from which the resource is retrieved.
+    url text PRIMARY KEY,
+    -- The ETag response header.
+    etag text,
+    -- The Last-Modified response header.
+    last_modified text,
+    -- The number of bytes downloaded.
+    content_length bigint,
+    -- The SHA-256 hex digest of the downloaded content.
+    content_hash text,
+    -- The time the validators are last updated.
+    updated timestamp default current_timestamp
+);
+
+/* The token buckets of the per-host rate limits of crawler tasks.
+ */
+CREATE TABLE IF NOT EXISTS findopendata.crawler_host_buckets (
+    -- The host name.
+    host text PRIMARY KEY,
+    -- The number of tokens left at the updated time.
+    tokens double precision NOT NULL,
+    -- The time the tokens are last refilled.
+    updated timestamptz NOT NULL
+);
+
+/* The UIDs and resource URLs of Socrata datasets resolved by permalink,
+ * so the dataset web pages are scraped at most once.
+ */
+CREATE TABLE IF NOT EXISTS findopendata.socrata_uid_cache (
+    -- The permalink of the dataset from the Discovery API.
+    permalink text PRIMARY KEY,
+    -- The domain name of the publisher.
+    domain text NOT NULL,
+    -- The UID (SODA 2.1) of the dataset.
+    uid text NOT NULL,
+    -- The resource URL of the dataset.
+    resource_url text NOT NULL,
+    -- The time this mapping is added.
+    added timestamp default current_timestamp,
+    -- The time this mapping is last updated.
+    updated timestamp default current_timestamp
+);
@@ -135,8 +135,19 @@ CREATE TABLE IF NOT EXISTS findopendata.package_files (
     -- The column sketch IDs of this package file, in the same order as the column_names.
     column_sketch_ids uuid[],
     -- The sample of records of this package file in JSON.
-    sample jsonb
+    sample jsonb,
+
+    -- The fingerprint (hash and length) of the content of this package file
+    -- given by the crawler.
+    content_fingerprint text,
+    -- The content fingerprint of this package file when it was sketched.
+    sketch_fingerprint text,
+    -- The parameters the sketches of this package file were created with.
+    sketch_params jsonb
 );
+ALTER TABLE findopendata.package_files ADD COLUMN IF NOT EXISTS content_fingerprint text;
+ALTER TABLE findopendata.package_files ADD COLUMN IF NOT EXISTS sketch_fingerprint text;
+ALTER TABLE findopendata.package_files ADD COLUMN IF NOT EXISTS sketch_params jsonb;
 CREATE UNIQUE INDEX IF NOT EXISTS package_files_crawler_idx ON findopendata.package_files(crawler_table, crawler_key);
 CREATE UNIQUE INDEX IF NOT EXISTS package_files_idx ON findopendata.package_files(id);
 CREATE INDEX IF NOT EXISTS package_files_package_key_idx ON findopendata.package_files(package_key);
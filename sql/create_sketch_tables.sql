@@ -40,13 +40,18 @@ CREATE TABLE IF NOT EXISTS findopendata.column_sketches (
     word_vector_column_name real[],
     -- The mean word embedding vector of the data values.
     word_vector_data real[],
-    -- The MinHash sketch of this column.
-    minhash bigint[],
+    -- The MinHash sketch of this column: the hash values as little-endian
+    -- unsigned integers of minhash_bits bits.
+    minhash bytea,
+    -- The number of bits kept of each MinHash hash value (8, 16 or 32).
+    minhash_bits smallint NOT NULL default 32,
     -- The random seed used to generate the MinHash sketch
     seed bigint,
-    -- The HyperLogLog registers of this column.
-    hyperloglog int[]
+    -- The HyperLogLog registers of this column, one byte each.
+    hyperloglog bytea
 );
+-- Tables created with the bigint[] and int[] sketches are converted by
+-- sql/migrate_column_sketches_binary.sql.
 CREATE UNIQUE INDEX IF NOT EXISTS column_sketches_column_name_idx ON findopendata.column_sketches(package_file_key, column_name);
 CREATE UNIQUE INDEX IF NOT EXISTS column_sketches_idx ON findopendata.column_sketches(id);
 
@@ -8,7 +8,8 @@ CREATE TEMP VIEW v AS (
             s.empty_count as empty_count,
             s.numeric_count as numeric_count,
             s.distinct_count as approx_distinct_count,
-            s.minhash as minhash,
+            encode(s.minhash, 'hex') as minhash,
+            s.minhash_bits as minhash_bits,
             s.seed as seed,
             f.id as table_id,
             f.original_url as table_original_url,
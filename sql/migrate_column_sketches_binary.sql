@@ -0,0 +1,52 @@
+/* Convert the MinHash (bigint[]) and HyperLogLog (int[]) sketches in the
+ * column_sketches table, created before the binary encoding, to the
+ * little-endian bytea used by findopendata.sketch_encoding, in place.
+ * Run once, with the crawler workers, API Server and LSH Server stopped:
+ *
+ *     psql -f sql/migrate_column_sketches_binary.sql
+ *
+ * The table is rewritten, so this takes an exclusive lock on it.
+ */
+BEGIN;
+
+/* Pack the integers into little-endian unsigned integers of width bytes.
+ */
+CREATE OR REPLACE FUNCTION findopendata.pack_le(vals bigint[], width int)
+RETURNS bytea AS $$
+DECLARE
+    result bytea := '';
+    be bytea;
+    v bigint;
+BEGIN
+    IF vals IS NULL THEN
+        RETURN NULL;
+    END IF;
+    FOREACH v IN ARRAY vals LOOP
+        -- The lowest width bytes of the big-endian integer, reversed.
+        be := substring(int8send(v) from 9 - width for width);
+        FOR i IN REVERSE width..1 LOOP
+            result := result || substring(be from i for 1);
+        END LOOP;
+    END LOOP;
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+ALTER TABLE findopendata.column_sketches
+    ALTER COLUMN minhash TYPE bytea
+        USING findopendata.pack_le(minhash, 4),
+    ALTER COLUMN hyperloglog TYPE bytea
+        USING findopendata.pack_le(hyperloglog::bigint[], 1);
+ALTER TABLE findopendata.column_sketches
+    ADD COLUMN IF NOT EXISTS minhash_bits smallint NOT NULL default 32;
+
+/* The existing sketches have all 32 bits, record it in their parameters so
+ * they are not sketched again by sketch_dataset_content.py.
+ */
+UPDATE findopendata.package_files
+    SET sketch_params = sketch_params || '{"minhash_bits": 32}'::jsonb
+    WHERE sketch_params IS NOT NULL AND NOT sketch_params ? 'minhash_bits';
+
+DROP FUNCTION findopendata.pack_le(bigint[], int);
+
+COMMIT;
@@ -0,0 +1,119 @@
+import json
+import time
+import datetime
+import unittest
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import dateutil.tz
+
+from findopendata.ckan import read_api, format_solr_timestamp
+
+
+class _MockCKANHandler(BaseHTTPRequestHandler):
+    """A CKAN package_search endpoint supporting the metadata_modified
+    range filter and sort used by read_api."""
+
+    packages = []
+    requests = []
+    # The seconds to wait before responding, as the latency of the API.
+    delay = 0
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.requests.append(query)
+        if self.delay:
+            time.sleep(self.delay)
+        packages = list(self.packages)
+        if "fq" in query:
+            low = query["fq"][0].split("[")[1].split(" TO ")[0]
+            # Solr dates in the same format compare as strings.
+            packages = [p for p in packages
+                    if p["metadata_modified"] + "Z" >= low]
+        if query.get("sort") == ["metadata_modified asc"]:
+            packages.sort(key=lambda p: p["metadata_modified"])
+        start = int(query["start"][0])
+        rows = int(query["rows"][0])
+        body = json.dumps({"result": {"count": len(packages),
+            "results": packages[start:start+rows]}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestReadAPI(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        start = datetime.datetime(2019, 1, 1)
+        _MockCKANHandler.packages = [{"id": "package-{}".format(i),
+            "metadata_modified": (start + datetime.timedelta(days=i))\
+                    .strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]}
+            for i in reversed(range(100))]
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _MockCKANHandler)
+        cls.url = "http://127.0.0.1:{}".format(cls.server.server_port)
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        del _MockCKANHandler.requests[:]
+        _MockCKANHandler.delay = 0
+
+    def test_format_solr_timestamp(self):
+        t = datetime.datetime(2019, 8, 1, 8, 30, 0, 123456,
+                tzinfo=dateutil.tz.tzoffset(None, -4*3600))
+        self.assertEqual(format_solr_timestamp(t), "2019-08-01T12:30:00.123Z")
+
+    def test_read_all(self):
+        packages = list(read_api(self.url, page_size=30))
+        self.assertEqual(len(packages), 100)
+        self.assertEqual(len(_MockCKANHandler.requests), 5)
+
+    def test_read_modified_since(self):
+        modified_since = datetime.datetime(2019, 3, 21,
+                tzinfo=dateutil.tz.tzutc())
+        packages = list(read_api(self.url, page_size=30,
+            modified_since=modified_since))
+        self.assertEqual([p["id"] for p in packages],
+                ["package-{}".format(i) for i in range(79, 100)])
+        self.assertEqual(len(_MockCKANHandler.requests), 2)
+
+    def test_prefetch(self):
+        _MockCKANHandler.delay = 0.05
+        start = time.time()
+        expected = [p["id"] for p in read_api(self.url, page_size=10)]
+        sequential = time.time() - start
+        self.assertEqual(len(_MockCKANHandler.requests), 11)
+        del _MockCKANHandler.requests[:]
+        start = time.time()
+        packages = [p["id"] for p in read_api(self.url, page_size=10,
+            prefetch=4)]
+        prefetched = time.time() - start
+        self.assertEqual(packages, expected)
+        self.assertEqual(len(set(packages)), 100)
+        # The pages past the end are bounded by the count of the first page.
+        self.assertLessEqual(len(_MockCKANHandler.requests), 12)
+        self.assertLess(prefetched, sequential / 2)
+
+    def test_prefetch_stop_early(self):
+        packages = read_api(self.url, page_size=10, prefetch=4)
+        ids = [next(packages)["id"] for _ in range(15)]
+        packages.close()
+        self.assertEqual(ids, ["package-{}".format(i)
+            for i in reversed(range(85, 100))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -74,6 +74,34 @@ class TestColumnSketch(unittest.TestCase):
         self.assertTrue(sketch.hyperloglog is not None)
         self.assertTrue(len(sketch.minhash) == 256)
 
+    def test_exact_threshold(self):
+        values = ["value{}".format(i % 20) for i in range(1000)]
+        sketches = [ColumnSketch(TEST_COLUMN_1_NAME, minhash_size=256,
+            sample_size=10, exact_threshold=threshold)
+            for threshold in (0, 10, 100)]
+        for value in values:
+            for sketch in sketches:
+                sketch.update(value)
+        full, promoted, exact = sketches
+        self.assertFalse(full.is_exact)
+        self.assertFalse(promoted.is_exact)
+        self.assertTrue(exact.is_exact)
+        # The sketches are the same as if created from the start.
+        for sketch in (promoted, exact):
+            self.assertEqual(sketch.minhash, full.minhash)
+            self.assertEqual(sketch.hyperloglog, full.hyperloglog)
+            self.assertEqual(sketch.count, full.count)
+        self.assertEqual(exact.distinct_count, 20)
+        self.assertLess(exact.memory_usage, full.memory_usage)
+        restored = ColumnSketch.from_state(exact.get_state())
+        self.assertEqual(restored.minhash, full.minhash)
+        # Many long values take more memory than the sketches.
+        sketch = ColumnSketch(TEST_COLUMN_1_NAME, minhash_size=256,
+                exact_threshold=1000)
+        for i in range(100):
+            sketch.update("value{}".format(i) * 10)
+        self.assertFalse(sketch.is_exact)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,69 @@
+import os
+import unittest
+
+import psycopg2.pool
+
+from findopendata.db import ConnectionPool
+
+
+# The Postgres DSN for the tests using a database, e.g.,
+# "host=127.0.0.1 dbname=findopendata_test user=postgres".
+_dsn = os.environ.get("FINDOPENDATA_TEST_DSN")
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_not_configured(self):
+        pool = ConnectionPool()
+        with self.assertRaises(RuntimeError):
+            with pool.connection():
+                pass
+
+    def test_configure_timeout(self):
+        pool = ConnectionPool(timeout=5)
+        pool.configure(maxconn=2)
+        self.assertEqual(pool._timeout, 5.0)
+        # None waits forever.
+        pool.configure(timeout=None)
+        self.assertIsNone(pool._timeout)
+
+    @unittest.skipIf(_dsn is None, "FINDOPENDATA_TEST_DSN is not set")
+    def test_reuse(self):
+        pool = ConnectionPool({"dsn": _dsn}, minconn=1, maxconn=2,
+                timeout=0.1)
+        with pool.connection() as conn:
+            first = conn
+            cur = conn.cursor()
+            cur.execute("CREATE TEMPORARY TABLE t (v int);")
+            cur.execute("INSERT INTO t VALUES (1);")
+            # Not committed.
+        with pool.connection() as conn:
+            self.assertIs(conn, first)
+            cur = conn.cursor()
+            cur.execute("SELECT count(*) FROM pg_tables "
+                    "WHERE tablename = 't' AND schemaname LIKE 'pg_temp%';")
+            # The uncommitted transaction has been rolled back.
+            self.assertEqual(cur.fetchone()[0], 0)
+            with pool.connection() as other:
+                self.assertIsNot(other, conn)
+                # All connections are in use.
+                with self.assertRaises(psycopg2.pool.PoolError):
+                    with pool.connection():
+                        pass
+        pool.close()
+
+    @unittest.skipIf(_dsn is None, "FINDOPENDATA_TEST_DSN is not set")
+    def test_broken_connection(self):
+        pool = ConnectionPool({"dsn": _dsn}, minconn=1, maxconn=1)
+        with pool.connection() as conn:
+            conn.close()
+        with pool.connection() as conn:
+            self.assertFalse(conn.closed)
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            self.assertEqual(cur.fetchone()[0], 1)
+        pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
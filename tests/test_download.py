@@ -0,0 +1,187 @@
+import os
+import re
+import hashlib
+import unittest
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from findopendata.download import download_to_local, download_to_storage, \
+        NotModified
+from findopendata.storage.memory import InMemoryStorage
+from findopendata.storage.local import LocalStorage
+
+test_file_content = b"h1,h2,h3\na,b,c\ne,f,g\n1,2,3\n" * 10000
+test_file_etag = '"v1"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The number of responses to cut off after drop_after bytes.
+    drops = [0]
+    drop_after = 50000
+    requests = []
+
+    def do_GET(self):
+        if self.path not in ("/data/resource.csv", "/data/ranges.csv"):
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == test_file_etag:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        ranges = self.path == "/data/ranges.csv"
+        start, end = 0, len(test_file_content) - 1
+        m = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if ranges and m is not None and \
+                self.headers.get("If-Range", test_file_etag) == test_file_etag:
+            start = int(m.group(1))
+            if m.group(2):
+                end = min(int(m.group(2)), end)
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start,
+                end, len(test_file_content)))
+        else:
+            self.send_response(200)
+        self.requests.append((start, end))
+        body = test_file_content[start:end+1]
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("ETag", test_file_etag)
+        self.send_header("Content-Length", str(len(body)))
+        if ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if self.drops[0] > 0 and len(body) > self.drop_after:
+            self.drops[0] -= 1
+            self.wfile.write(body[:self.drop_after])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownload(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        cls.url = "http://127.0.0.1:{}/data/resource.csv".format(
+                cls.server.server_port)
+        cls.ranges_url = "http://127.0.0.1:{}/data/ranges.csv".format(
+                cls.server.server_port)
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _Handler.drops[0] = 0
+        del _Handler.requests[:]
+
+    def test_download_to_local(self):
+        with tempfile.TemporaryDirectory() as dir_name:
+            filename, validators = download_to_local(self.url, dir_name)
+            self.assertEqual(filename, "resource.csv")
+            self.assertEqual(validators["etag"], test_file_etag)
+            self.assertEqual(validators["content_length"],
+                    len(test_file_content))
+            self.assertEqual(validators["content_hash"],
+                    hashlib.sha256(test_file_content).hexdigest())
+            with open(os.path.join(dir_name, filename), "rb") as f:
+                self.assertEqual(f.read(), test_file_content)
+
+    def test_download_to_storage(self):
+        storage = InMemoryStorage()
+        filename, blob, validators = download_to_storage(self.url, storage,
+                "pkg/res")
+        self.assertEqual(filename, "resource.csv")
+        self.assertEqual(validators["content_hash"],
+                hashlib.sha256(test_file_content).hexdigest())
+        self.assertEqual(blob.name, "pkg/res/resource.csv")
+        self.assertEqual(blob.size, len(test_file_content))
+        self.assertEqual(storage.get_bytes(blob.name), test_file_content)
+
+    def test_download_to_local_storage(self):
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(root)
+            filename, blob, _ = download_to_storage(self.url, storage,
+                    "pkg/res")
+            self.assertEqual(blob.size, len(test_file_content))
+            with storage.get_file(blob.name) as f:
+                self.assertEqual(f.read(), test_file_content)
+
+    def test_download_to_storage_on_read(self):
+        chunks = []
+        download_to_storage(self.url, InMemoryStorage(), "pkg/res",
+                on_read=chunks.append)
+        self.assertEqual(b"".join(chunks), test_file_content)
+
+    def test_download_not_modified(self):
+        storage = InMemoryStorage()
+        _, _, validators = download_to_storage(self.url, storage, "pkg/res")
+        storage.clear()
+        with self.assertRaises(NotModified):
+            download_to_storage(self.url, storage, "pkg/res",
+                    validators=validators)
+        self.assertFalse(storage.exists("pkg/res/resource.csv"))
+        with tempfile.TemporaryDirectory() as dir_name:
+            with self.assertRaises(NotModified):
+                download_to_local(self.url, dir_name, validators=validators)
+
+    def test_resume_download_to_local(self):
+        _Handler.drops[0] = 2
+        with tempfile.TemporaryDirectory() as dir_name:
+            filename, validators = download_to_local(self.ranges_url,
+                    dir_name)
+            with open(os.path.join(dir_name, filename), "rb") as f:
+                self.assertEqual(f.read(), test_file_content)
+        self.assertEqual(validators["content_hash"],
+                hashlib.sha256(test_file_content).hexdigest())
+        self.assertEqual([start for start, _ in _Handler.requests],
+                [0, 50000, 100000])
+
+    def test_resume_download_to_storage(self):
+        _Handler.drops[0] = 1
+        chunks = []
+        storage = InMemoryStorage()
+        _, blob, _ = download_to_storage(self.ranges_url, storage, "pkg/res",
+                on_read=chunks.append)
+        self.assertEqual(storage.get_bytes(blob.name), test_file_content)
+        self.assertEqual(b"".join(chunks), test_file_content)
+        self.assertEqual(len(_Handler.requests), 2)
+
+    def test_no_resume_without_ranges(self):
+        _Handler.drops[0] = 1
+        with self.assertRaises(Exception):
+            download_to_storage(self.url, InMemoryStorage(), "pkg/res")
+
+    def test_parallel_download_to_local(self):
+        # The first response, of which only the headers are used, and one
+        # of the parts are dropped.
+        _Handler.drops[0] = 2
+        with tempfile.TemporaryDirectory() as dir_name:
+            filename, validators = download_to_local(self.ranges_url,
+                    dir_name, parallel_min_size=1024, parallel_parts=3)
+            with open(os.path.join(dir_name, filename), "rb") as f:
+                self.assertEqual(f.read(), test_file_content)
+        self.assertEqual(validators["content_length"], len(test_file_content))
+        self.assertEqual(validators["content_hash"],
+                hashlib.sha256(test_file_content).hexdigest())
+        # The first request and 3 parts, one of which is resumed.
+        self.assertEqual(len(_Handler.requests), 5)
+
+    def test_download_not_found(self):
+        with self.assertRaises(Exception):
+            download_to_storage(self.url + ".missing", InMemoryStorage(),
+                    "pkg/res")
+
+
+if __name__ == "__main__":
+    unittest.main()
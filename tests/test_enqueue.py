@@ -0,0 +1,78 @@
+import io
+import unittest
+
+from findopendata.enqueue import batched, enqueue, Progress
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Queue(object):
+    """A queue drained by 300 messages every poll of the depth while
+    sending is paused."""
+
+    def __init__(self):
+        self.depth = 0
+        self.sleeps = 0
+        self.max_depth = 0
+
+    def send(self, row):
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+
+    def sleep(self, seconds):
+        self.sleeps += 1
+        self.depth = max(self.depth - 300, 0)
+
+    def get_depth(self):
+        return self.depth
+
+
+class TestEnqueue(unittest.TestCase):
+
+    def test_batched(self):
+        self.assertEqual(list(batched(range(7), 3)),
+                [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(batched([], 3)), [])
+
+    def test_backpressure(self):
+        queue = _Queue()
+        out = io.StringIO()
+        sent = enqueue(range(5000), queue.send, total=5000, chunk_size=500,
+                max_queue_depth=1000, get_queue_depth=queue.get_depth,
+                out=out, sleep=queue.sleep)
+        self.assertEqual(sent, 5000)
+        self.assertGreater(queue.sleeps, 0)
+        # The queue never grows beyond the maximum depth plus a chunk.
+        self.assertLessEqual(queue.max_depth, 1000 + 500)
+        self.assertIn("Sent 5000/5000 tasks", out.getvalue())
+
+    def test_no_backpressure(self):
+        queue = _Queue()
+        sent = enqueue(range(5000), queue.send, chunk_size=500,
+                out=io.StringIO(), sleep=queue.sleep)
+        self.assertEqual(sent, 5000)
+        self.assertEqual(queue.sleeps, 0)
+        self.assertEqual(queue.max_depth, 5000)
+
+    def test_progress(self):
+        clock = _Clock()
+        out = io.StringIO()
+        progress = Progress(total=1000, interval=10, out=out, clock=clock)
+        clock.now = 5.0
+        progress.update(100)
+        self.assertEqual(out.getvalue(), "")
+        clock.now = 10.0
+        progress.update(100)
+        self.assertEqual(out.getvalue(),
+                "Sent 200/1000 tasks (20.0 tasks/s, ETA 0:00:40)\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
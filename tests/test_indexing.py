@@ -0,0 +1,97 @@
+import os
+import unittest
+from collections import OrderedDict
+
+import psycopg2
+from psycopg2.extras import Json, RealDictCursor
+
+
+# The Postgres DSN of a database with the findopendata tables created by
+# sql/create_metadata_tables.sql and sql/create_sketch_tables.sql. The test
+# data is rolled back.
+_dsn = os.environ.get("FINDOPENDATA_TEST_DSN")
+
+
+class _CountingCursor(RealDictCursor):
+    """A cursor counting the statements sent to the server."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.round_trips = 0
+
+    def execute(self, query, vars=None):
+        self.round_trips += 1
+        return super().execute(query, vars)
+
+
+@unittest.skipIf(_dsn is None, "FINDOPENDATA_TEST_DSN is not set")
+class TestSaveTableSketch(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = psycopg2.connect(_dsn)
+        cur = self.conn.cursor()
+        cur.execute("INSERT INTO findopendata.packages "
+                "(crawler_table, crawler_key, id, num_files, raw_metadata) "
+                "VALUES ('test', -1, uuid_generate_v1mc(), 1, %s) "
+                "RETURNING key;", (Json({}),))
+        package_key = cur.fetchone()[0]
+        cur.execute("INSERT INTO findopendata.package_files "
+                "(package_key, crawler_table, crawler_key, id, raw_metadata) "
+                "VALUES (%s, 'test', -1, uuid_generate_v1mc(), %s) "
+                "RETURNING key;", (package_key, Json({})))
+        self.package_file_key = cur.fetchone()[0]
+        cur.close()
+
+    def tearDown(self):
+        self.conn.rollback()
+        self.conn.close()
+
+    def test_round_trips(self):
+        from findopendata.table_sketch import TableSketch
+        from findopendata.indexing import save_table_sketch
+        num_columns = 200
+        table_sketch = TableSketch(minhash_size=16, hyperloglog_p=4,
+                enable_word_vector_data=False)
+        for i in range(100):
+            table_sketch.update(OrderedDict(("column {}".format(j),
+                str(i * j)) for j in range(num_columns)))
+        cur = self.conn.cursor(cursor_factory=_CountingCursor)
+        save_table_sketch(cur, self.package_file_key, table_sketch)
+        # One upsert of the column sketches and one update of the package
+        # file, regardless of the number of columns.
+        self.assertEqual(cur.round_trips, 2)
+        # The column sketch IDs are in the order of the columns.
+        cur.execute("SELECT s.column_name FROM findopendata.package_files f, "
+                "unnest(f.column_sketch_ids) WITH ORDINALITY AS u(id, i), "
+                "findopendata.column_sketches s "
+                "WHERE f.key = %s AND s.id = u.id ORDER BY u.i;",
+                (self.package_file_key,))
+        self.assertEqual([row["column_name"] for row in cur],
+                table_sketch.column_names)
+        # The MinHash and HyperLogLog sketches are saved in binary.
+        cur.execute("SELECT length(minhash) AS minhash, minhash_bits, "
+                "length(hyperloglog) AS hyperloglog "
+                "FROM findopendata.column_sketches "
+                "WHERE package_file_key = %s LIMIT 1;",
+                (self.package_file_key,))
+        self.assertEqual(dict(cur.fetchone()), {"minhash": 16 * 4,
+            "minhash_bits": 32, "hyperloglog": 1 << 4})
+        # Saving again updates the same column sketches, and records what
+        # they were created from.
+        save_table_sketch(cur, self.package_file_key, table_sketch,
+                content_fingerprint="abcd:100",
+                sketch_params={"minhash_size": 16})
+        cur.execute("SELECT count(*) AS n FROM findopendata.column_sketches "
+                "WHERE package_file_key = %s;", (self.package_file_key,))
+        self.assertEqual(cur.fetchone()["n"], num_columns)
+        cur.execute("SELECT sketch_fingerprint, sketch_params "
+                "FROM findopendata.package_files WHERE key = %s;",
+                (self.package_file_key,))
+        row = cur.fetchone()
+        self.assertEqual(row["sketch_fingerprint"], "abcd:100")
+        self.assertEqual(row["sketch_params"], {"minhash_size": 16})
+        cur.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
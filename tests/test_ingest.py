@@ -0,0 +1,67 @@
+import unittest
+
+from findopendata.ingest import StreamSketcher
+from findopendata.parsers.csv import csv2json
+from findopendata.table_sketch import TableSketch
+
+
+def _csv_sketcher(fileobj_binary, record_sample_size=20, **kwargs):
+    table_sketch = TableSketch(record_sample_size=record_sample_size,
+            **kwargs)
+    for record in csv2json(fileobj_binary):
+        table_sketch.update(record)
+    return table_sketch
+
+
+def _failing_sketcher(fileobj_binary, **kwargs):
+    fileobj_binary.read(1)
+    raise ValueError("Cannot sketch")
+
+
+def _make_csv(n):
+    lines = ["name,city,count"]
+    for i in range(n):
+        lines.append("name{},city{},{}".format(i, i % 10, i))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _chunks(data, size):
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+
+class TestStreamSketcher(unittest.TestCase):
+
+    def test_stream_sketch(self):
+        data = _make_csv(2000)
+        with StreamSketcher(_csv_sketcher, head_size=16384,
+                max_queued_chunks=4, record_sample_size=5,
+                enable_word_vector_data=False) as sketcher:
+            for chunk in _chunks(data, 1000):
+                sketcher.feed(chunk)
+        table_sketch = sketcher.result()
+        self.assertEqual(table_sketch.column_names, ["name", "city", "count"])
+        self.assertEqual(len(table_sketch.record_sample), 5)
+        counts = [s.count for s in table_sketch.column_sketches]
+        self.assertEqual(counts, [2000, 2000, 2000])
+
+        # The state of the sketch can be restored.
+        restored = TableSketch.from_state(table_sketch.get_state())
+        self.assertEqual(restored.column_names, table_sketch.column_names)
+        for s1, s2 in zip(restored.column_sketches,
+                table_sketch.column_sketches):
+            self.assertEqual(s1.minhash, s2.minhash)
+            self.assertEqual(s1.distinct_count, s2.distinct_count)
+
+    def test_sketch_error(self):
+        data = _make_csv(2000)
+        with StreamSketcher(_failing_sketcher, max_queued_chunks=1) \
+                as sketcher:
+            # Feeding must not block after the sketcher has stopped.
+            for chunk in _chunks(data, 100):
+                sketcher.feed(chunk)
+        with self.assertRaises(ValueError):
+            sketcher.result()
+
+
+if __name__ == "__main__":
+    unittest.main()
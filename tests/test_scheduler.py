@@ -0,0 +1,123 @@
+import os
+import unittest
+
+from findopendata.scheduler import HostLimits, LocalHostLimiter, \
+        PostgresHostLimiter, HostLimiterFactory, NullHostLimiter, \
+        parse_host_limits, host_slot, get_host
+
+
+# The Postgres DSN for the tests using a database, e.g.,
+# "host=127.0.0.1 dbname=findopendata_test user=postgres".
+_dsn = os.environ.get("FINDOPENDATA_TEST_DSN")
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Deferred(Exception):
+    pass
+
+
+class _Task(object):
+
+    def __init__(self):
+        self.countdowns = []
+
+    def retry(self, countdown, max_retries):
+        self.countdowns.append(countdown)
+        return _Deferred()
+
+
+class TestLocalHostLimiter(unittest.TestCase):
+
+    def test_concurrency(self):
+        limiter = LocalHostLimiter(HostLimits(max_concurrency=2, rate=None,
+                burst=None))
+        self.assertEqual(limiter.acquire("a.org"), 0)
+        self.assertEqual(limiter.acquire("a.org"), 0)
+        self.assertGreater(limiter.acquire("a.org"), 0)
+        # Other hosts are not affected.
+        self.assertEqual(limiter.acquire("b.org"), 0)
+        limiter.release("a.org")
+        self.assertEqual(limiter.running("a.org"), 1)
+        self.assertEqual(limiter.acquire("a.org"), 0)
+
+    def test_rate(self):
+        clock = _Clock()
+        limiter = LocalHostLimiter(HostLimits(max_concurrency=None, rate=2.0,
+                burst=2), clock=clock)
+        self.assertEqual(limiter.acquire("a.org"), 0)
+        self.assertEqual(limiter.acquire("a.org"), 0)
+        wait = limiter.acquire("a.org")
+        self.assertAlmostEqual(wait, 0.5)
+        clock.now += wait
+        self.assertEqual(limiter.acquire("a.org"), 0)
+        self.assertGreater(limiter.acquire("a.org"), 0)
+
+    def test_per_host_limits(self):
+        default, limits = parse_host_limits({
+            "default": {"max_concurrency": 3},
+            "Slow.org": {"max_concurrency": 1, "rate": None},
+            })
+        self.assertEqual(default.max_concurrency, 3)
+        self.assertEqual(limits["slow.org"],
+                HostLimits(max_concurrency=1, rate=None, burst=default.burst))
+        limiter = HostLimiterFactory("local", {
+            "slow.org": {"max_concurrency": 1, "rate": None}})
+        self.assertEqual(limiter.acquire("slow.org"), 0)
+        self.assertGreater(limiter.acquire("slow.org"), 0)
+        self.assertIsInstance(HostLimiterFactory(None), NullHostLimiter)
+        with self.assertRaises(ValueError):
+            HostLimiterFactory("unknown")
+
+
+class TestPostgresHostLimiter(unittest.TestCase):
+
+    @unittest.skipIf(_dsn is None, "FINDOPENDATA_TEST_DSN is not set")
+    def test_concurrency_in_process(self):
+        limiter = PostgresHostLimiter({"dsn": _dsn}, HostLimits(
+            max_concurrency=2, rate=None, burst=None))
+        other = PostgresHostLimiter({"dsn": _dsn}, HostLimits(
+            max_concurrency=2, rate=None, burst=None))
+        host = "test.postgres-limiter.example.org"
+        # Two acquisitions in the same process take different slots.
+        self.assertEqual(limiter.acquire(host), 0)
+        self.assertEqual(limiter.acquire(host), 0)
+        self.assertEqual(sorted(limiter._slots[host]), [0, 1])
+        self.assertGreater(limiter.acquire(host), 0)
+        self.assertGreater(other.acquire(host), 0)
+        limiter.release(host)
+        self.assertEqual(other.acquire(host), 0)
+        self.assertGreater(limiter.acquire(host), 0)
+        other.release(host)
+        limiter.release(host)
+        self.assertEqual(limiter._slots[host], [])
+
+
+class TestHostSlot(unittest.TestCase):
+
+    def test_host_slot(self):
+        limiter = LocalHostLimiter(HostLimits(max_concurrency=1, rate=None,
+                burst=None))
+        task = _Task()
+        url = "https://data.example.org/resource/abcd-1234.json"
+        self.assertEqual(get_host(url), "data.example.org")
+        with host_slot(limiter, task, url):
+            self.assertEqual(limiter.running("data.example.org"), 1)
+            # The host is busy so the task is deferred.
+            with self.assertRaises(_Deferred):
+                with host_slot(limiter, task, url):
+                    pass
+            self.assertEqual(len(task.countdowns), 1)
+            self.assertGreater(task.countdowns[0], 0)
+        self.assertEqual(limiter.running("data.example.org"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from findopendata.sessions import SessionRegistry
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The number of requests failed with 503 before succeeding.
+    failures = [0]
+    connections = set()
+
+    def do_GET(self):
+        self.connections.add(self.client_address)
+        if self.failures[0] > 0:
+            self.failures[0] -= 1
+            self._reply(503, b"unavailable")
+            return
+        self._reply(200, b"ok")
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSessionRegistry(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), _Handler)
+        cls.url = "http://127.0.0.1:{}/data".format(cls.server.server_port)
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _Handler.connections.clear()
+        _Handler.failures[0] = 0
+
+    def test_session_per_host(self):
+        registry = SessionRegistry()
+        session = registry.get(self.url)
+        self.assertIs(registry.get(self.url + "/other"), session)
+        self.assertIsNot(registry.get("http://example.org/data"), session)
+        registry.clear()
+        self.assertIsNot(registry.get(self.url), session)
+
+    def test_keep_alive(self):
+        registry = SessionRegistry()
+        for _ in range(5):
+            resp = registry.get(self.url).get(self.url)
+            self.assertEqual(resp.text, "ok")
+        # All requests are sent over the same connection.
+        self.assertEqual(len(_Handler.connections), 1)
+
+    def test_retry(self):
+        registry = SessionRegistry(max_retries=2, backoff_factor=0)
+        _Handler.failures[0] = 2
+        resp = registry.get(self.url).get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        _Handler.failures[0] = 3
+        resp = registry.get(self.url).get(self.url)
+        self.assertEqual(resp.status_code, 503)
+
+
+if __name__ == "__main__":
+    unittest.main()
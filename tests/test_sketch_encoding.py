@@ -0,0 +1,33 @@
+import unittest
+
+import numpy as np
+
+from findopendata.sketch_encoding import encode_minhash, encode_hyperloglog
+
+
+class TestSketchEncoding(unittest.TestCase):
+
+    def test_minhash(self):
+        hashvalues = [0, 1, 0x1234, 0xdeadbeef, 0xffffffff]
+        data = encode_minhash(hashvalues)
+        self.assertEqual(len(data), 4 * len(hashvalues))
+        self.assertEqual(data[8:12], b"\x34\x12\x00\x00")
+        # The bytea values are read by psycopg2 as memoryview.
+        decoded = np.frombuffer(memoryview(data), dtype="<u4")
+        self.assertEqual(decoded.tolist(), hashvalues)
+
+    def test_minhash_bbit(self):
+        hashvalues = [0x1234, 0xdeadbeef]
+        self.assertEqual(encode_minhash(hashvalues, 16),
+                b"\x34\x12\xef\xbe")
+        self.assertEqual(encode_minhash(hashvalues, 8), b"\x34\xef")
+        with self.assertRaises(ValueError):
+            encode_minhash(hashvalues, 4)
+
+    def test_hyperloglog(self):
+        registers = [0, 3, 17, 64]
+        self.assertEqual(encode_hyperloglog(registers), bytes(registers))
+
+
+if __name__ == "__main__":
+    unittest.main()
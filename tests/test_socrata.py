@@ -1,9 +1,16 @@
 import os
+import re
 import json
 import unittest
 import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import HTTPServer, BaseHTTPRequestHandler
 
-from findopendata.socrata import socrata_records
+import requests
+
+from findopendata.socrata import socrata_records, socrata_csv_records, \
+        socrata_rows_summary
 from findopendata.parsers.avro import JSON2AvroRecords
 from findopendata.storage.local import LocalStorage
 
@@ -27,6 +34,232 @@ class TestSocrataRecords(unittest.TestCase):
             self.assertTrue(os.path.exists(os.path.join(root, "test_blob")))
 
 
+class _MockSODAHandler(BaseHTTPRequestHandler):
+    """A SODA endpoint over rows sorted by :id, which counts the rows scanned,
+    including the rows skipped by $offset like a server without an index."""
+
+    rows = []
+    scanned = [0]
+
+    def do_GET(self):
+        if urlparse(self.path).path.endswith("/rows.csv"):
+            self._export_csv()
+            return
+        query = parse_qs(urlparse(self.path).query)
+        select = query.get("$select", [""])[0]
+        if "count(*)" in select:
+            self._summarize(query)
+            return
+        limit = int(query.get("$limit", ["1000"])[0])
+        offset = int(query.get("$offset", ["0"])[0])
+        start = 0
+        if "$where" in query:
+            last_id = re.match(r":id > '(.*)'$", query["$where"][0]).group(1)
+            # Seek with the index on :id.
+            start = next((i for i, row in enumerate(self.rows)
+                if row[":id"] > last_id), len(self.rows))
+        start += offset
+        page = self.rows[start:start+limit]
+        # Rows skipped by the offset are scanned.
+        self.scanned[0] += offset + len(page)
+        # System fields are only returned if selected.
+        page = [dict((k, v) for k, v in row.items()
+            if not k.startswith(":") or k in select) for row in page]
+        self._send_json(page)
+
+    def _summarize(self, query):
+        rows = self.rows
+        if "$where" in query:
+            until_id = re.match(r":id <= '(.*)'$",
+                    query["$where"][0]).group(1)
+            rows = [row for row in rows if row[":id"] <= until_id]
+        self._send_json([{"num_records": str(len(rows)), "max_updated_at":
+            max((row[":updated_at"] for row in rows), default=None)}])
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _export_csv(self):
+        lines = ["Name,Value,Is Even,Extra"]
+        for row in self.rows:
+            lines.append("{},\"{:,}\",{},x".format(row["name"],
+                int(row["value"]), str(int(row["value"]) % 2 == 0).lower()))
+        body = ("\n".join(lines) + "\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _MockSODATestCase(unittest.TestCase):
+    """Serves the mock SODA endpoint over 5000 rows."""
+
+    @classmethod
+    def setUpClass(cls):
+        _MockSODAHandler.rows = [{":id": "row-{:06d}".format(i),
+            ":updated_at": "2020-01-{:02d}T00:00:00.000Z".format(i % 28 + 1),
+            "name": "name{}".format(i), "value": str(i)} for i in range(5000)]
+        cls.server = HTTPServer(("127.0.0.1", 0), _MockSODAHandler)
+        cls.url = "http://127.0.0.1:{}/resource/abcd-1234.json".format(
+                cls.server.server_port)
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class TestSocrataKeysetPaging(_MockSODATestCase):
+
+    def setUp(self):
+        _MockSODAHandler.scanned[0] = 0
+
+    def _offset_records(self, limit):
+        # The previous $offset paging, for comparison.
+        offset = 0
+        while True:
+            records = requests.get(self.url, params={"$order": ":id",
+                "$offset": offset, "$limit": limit}).json()
+            if not records:
+                return
+            offset += limit
+            yield from records
+
+    def test_keyset_paging(self):
+        for prefetch in (True, False):
+            _MockSODAHandler.scanned[0] = 0
+            records = list(socrata_records(self.url, None, limit=300,
+                prefetch=prefetch))
+            self.assertEqual(len(records), 5000)
+            self.assertEqual(records[0], {"name": "name0", "value": "0"})
+            self.assertEqual(records[-1]["value"], "4999")
+            # Every row is scanned once.
+            self.assertEqual(_MockSODAHandler.scanned[0], 5000)
+
+    def test_start_after(self):
+        records = list(socrata_records(self.url, None, limit=300,
+            start_after="row-004899", include_id=True))
+        self.assertEqual(len(records), 100)
+        self.assertEqual(records[0][":id"], "row-004900")
+        self.assertNotIn(":updated_at", records[0])
+
+    def test_rows_summary(self):
+        self.assertEqual(socrata_rows_summary(self.url, None),
+                (5000, "2020-01-28T00:00:00.000Z"))
+        self.assertEqual(socrata_rows_summary(self.url, None,
+            until_id="row-000009"), (10, "2020-01-10T00:00:00.000Z"))
+        records = list(socrata_records(self.url, None, limit=300,
+            start_after="row-004989", include_updated_at=True))
+        self.assertEqual(records[0], {":updated_at":
+            "2020-01-07T00:00:00.000Z", "name": "name4990", "value": "4990"})
+
+    def test_benchmark(self):
+        n = sum(1 for _ in self._offset_records(250))
+        offset_scanned = _MockSODAHandler.scanned[0]
+
+        _MockSODAHandler.scanned[0] = 0
+        m = sum(1 for _ in socrata_records(self.url, None, limit=250))
+        keyset_scanned = _MockSODAHandler.scanned[0]
+
+        self.assertEqual(n, 5000)
+        self.assertEqual(m, 5000)
+        # Each of the 20 pages with $offset scans the rows before it, and
+        # the last request for an empty page scans all the rows.
+        self.assertEqual(offset_scanned,
+                sum(250 * (i + 1) for i in range(20)) + 5000)
+        # Keyset paging scans every row once.
+        self.assertEqual(keyset_scanned, 5000)
+
+
+
+class TestSocrataCSVExport(_MockSODATestCase):
+
+    def test_csv_export(self):
+        field_names = ["name", "value", "is_even", "missing"]
+        datatypes = ["text", "number", "checkbox", "text"]
+        records = list(socrata_csv_records(self.url, None, field_names,
+            datatypes, display_names=["Name", "Value", "Is Even", "Missing"]))
+        self.assertEqual(len(records), 5000)
+        # The values are the strings returned by the JSON API.
+        self.assertEqual(records[1234], {"name": "name1234", "value": "1234",
+            "is_even": "true"})
+        json_records = list(socrata_records(self.url, None))
+        self.assertEqual([dict((k, r[k]) for k in ("name", "value"))
+            for r in records], json_records)
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(root)
+            avro_records = JSON2AvroRecords(iter(records),
+                    field_names=field_names)
+            blob = storage.put_avro(avro_records.schema, avro_records.get(),
+                    "test_blob")
+            self.assertGreater(blob.size, 0)
+
+
+class TestSketchState(unittest.TestCase):
+
+    sketch_params = dict(max_records=150, table_sample_size=5,
+            minhash_size=16, minhash_seed=43, hyperloglog_p=4,
+            column_sample_size=10, enable_word_vector_data=False)
+    field_names = ["name", "value"]
+
+    def _records(self, start, end, updated_at="2020-01-01T00:00:00.000Z"):
+        return [{":id": "row-{:06d}".format(i), ":updated_at": updated_at,
+            "name": "name{}".format(i % 7), "value": str(i)}
+            for i in range(start, end)]
+
+    def _read(self, sketch_state, records):
+        return list(sketch_state.sketch(sketch_state.track(iter(records)),
+            self.field_names))
+
+    def test_resume(self):
+        from findopendata.socrata.sketch_state import SketchState
+        full = SketchState.new(self.sketch_params, self.field_names)
+        records = self._read(full, self._records(0, 200))
+        self.assertEqual(records[0], {"name": "name0", "value": "0"})
+
+        first = SketchState.new(self.sketch_params, self.field_names)
+        self._read(first, self._records(0, 100))
+        # Restore from the JSON of the state.
+        resumed = SketchState.from_state(json.loads(json.dumps(
+            first.get_state())))
+        self.assertTrue(resumed.can_resume(self.sketch_params,
+            self.field_names))
+        self.assertFalse(resumed.can_resume(self.sketch_params, ["name"]))
+        self.assertTrue(resumed.is_unchanged(100,
+            "2020-01-01T00:00:00.000Z"))
+        self.assertFalse(resumed.is_unchanged(100,
+            "2020-02-01T00:00:00.000Z"))
+        self.assertEqual(resumed.last_id, "row-000099")
+        self._read(resumed, self._records(100, 200,
+            "2020-02-01T00:00:00.000Z"))
+
+        # Sketching the new records after the state is the same as
+        # sketching all records, up to max_records.
+        self.assertEqual(resumed.num_records, 200)
+        self.assertEqual(resumed.num_sketched, 150)
+        self.assertEqual(resumed.last_id, "row-000199")
+        self.assertEqual(resumed.max_updated_at, "2020-02-01T00:00:00.000Z")
+        expected = full.table_sketch.column_sketches
+        actual = resumed.table_sketch.column_sketches
+        self.assertEqual([s.count for s in actual], [150, 150])
+        for e, a in zip(expected, actual):
+            self.assertEqual(a.minhash, e.minhash)
+            self.assertEqual(a.hyperloglog, e.hyperloglog)
+            self.assertEqual(a.distinct_count, e.distinct_count)
+
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -0,0 +1,66 @@
+import os
+import asyncio
+import unittest
+import tempfile
+
+from findopendata.storage.local import LocalStorage
+from findopendata.storage.aio import AsyncBlobStorage, get_objects
+
+test_objs = [
+    {"name": "blob-{}".format(i), "values": list(range(i))}
+    for i in range(20)
+]
+
+
+def _run(coroutine):
+    # Instead of asyncio.run, which requires Python 3.7.
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncBlobStorage(unittest.TestCase):
+
+    def test_put_and_get_objects(self):
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(root)
+            blob_names = ["objects/{}.json".format(obj["name"])
+                    for obj in test_objs]
+
+            async def _put_and_get(async_storage):
+                await asyncio.gather(*[
+                    async_storage.put_object(obj, blob_name)
+                    for obj, blob_name in zip(test_objs, blob_names)])
+                return await async_storage.get_objects(blob_names)
+
+            with AsyncBlobStorage(storage, max_concurrency=4) as async_storage:
+                objs = _run(_put_and_get(async_storage))
+            self.assertEqual(objs, test_objs)
+
+            # The blocking helper returns the objects in the same order.
+            self.assertEqual(get_objects(storage, blob_names), test_objs)
+
+    def test_get_objects_return_exceptions(self):
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(root)
+            storage.put_object(test_objs[0], "exists.json")
+            objs = get_objects(storage, ["exists.json", "missing.json"],
+                    return_exceptions=True)
+            self.assertEqual(objs[0], test_objs[0])
+            self.assertIsInstance(objs[1], ValueError)
+
+    def test_get_range(self):
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(root)
+            storage.put_object(test_objs[5], "range.json")
+            with open(os.path.join(root, "range.json"), "rb") as f:
+                data = f.read()
+            with AsyncBlobStorage(storage) as async_storage:
+                chunk = _run(async_storage.get_range("range.json", 2, 10))
+            self.assertEqual(chunk, data[2:12])
+
+
+if __name__ == "__main__":
+    unittest.main()
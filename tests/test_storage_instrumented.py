@@ -0,0 +1,99 @@
+import io
+import unittest
+import tempfile
+
+from findopendata.metrics import MetricsRegistry
+from findopendata.storage.local import LocalStorage
+from findopendata.storage.instrumented import InstrumentedStorage
+from findopendata.parsers.csv import csv2json
+
+test_obj = {
+    "name" : "First name Last name",
+    "accounts": [123, 432, 2123],
+}
+
+test_file_content = """h1,h2,h3
+a,b,c
+e,f,g
+1,2,3
+"""
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_counter_and_histogram(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "Requests.")
+        counter.inc(operation="get")
+        counter.inc(2, operation="get")
+        counter.inc(operation="put")
+        self.assertEqual(counter.get(operation="get"), 3)
+        self.assertIs(registry.counter("requests_total"), counter)
+
+        histogram = registry.histogram("latency_seconds", "Latency.",
+                buckets=(0.1, 1.0))
+        histogram.observe(0.05, operation="get")
+        histogram.observe(0.5, operation="get")
+        histogram.observe(5.0, operation="get")
+        self.assertEqual(histogram.get(operation="get"), (3, 5.55))
+
+        text = registry.to_prometheus()
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{operation="get"} 3', text)
+        self.assertIn('latency_seconds_bucket{operation="get",le="0.1"} 1',
+                text)
+        self.assertIn('latency_seconds_bucket{operation="get",le="1.0"} 2',
+                text)
+        self.assertIn('latency_seconds_bucket{operation="get",le="+Inf"} 3',
+                text)
+        self.assertIn('latency_seconds_count{operation="get"} 3', text)
+        self.assertEqual(len(registry.log_lines()), 3)
+
+        with self.assertRaises(ValueError):
+            registry.histogram("requests_total")
+
+
+class TestInstrumentedStorage(unittest.TestCase):
+
+    def test_operations(self):
+        registry = MetricsRegistry()
+        with tempfile.TemporaryDirectory() as root:
+            storage = InstrumentedStorage(LocalStorage(root), "local",
+                    registry=registry)
+            blob = storage.put_object(test_obj, "test_object_blob")
+            self.assertEqual(storage.get_object("test_object_blob"), test_obj)
+            storage.put_file(io.BytesIO(test_file_content.encode("utf-8")),
+                    "test_file_blob")
+            with storage.get_file("test_file_blob") as f:
+                records = list(csv2json(f))
+            self.assertEqual(len(records), 3)
+            with self.assertRaises(ValueError):
+                storage.get_object("missing_blob")
+
+        requests = registry.counter("storage_requests_total")
+        bytes_read = registry.counter("storage_bytes_read_total")
+        bytes_written = registry.counter("storage_bytes_written_total")
+        errors = registry.counter("storage_errors_total")
+        self.assertEqual(requests.get(provider="local",
+                operation="put_object"), 1)
+        self.assertEqual(requests.get(provider="local",
+                operation="get_object"), 2)
+        self.assertEqual(errors.get(provider="local",
+                operation="get_object"), 1)
+        self.assertEqual(bytes_written.get(provider="local",
+                operation="put_object"), blob.size)
+        self.assertEqual(bytes_read.get(provider="local",
+                operation="get_object"), blob.size)
+        self.assertEqual(bytes_written.get(provider="local",
+                operation="put_file"), len(test_file_content))
+        # The CSV reader rewinds the file, so it is read more than once.
+        self.assertGreaterEqual(bytes_read.get(provider="local",
+                operation="get_file"), len(test_file_content))
+        # The latency of get_file is observed once, when the file is closed.
+        latency = registry.histogram("storage_request_seconds")
+        self.assertEqual(latency.get(provider="local",
+                operation="get_file")[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,6 +6,7 @@ import gzip
 import json
 
 from findopendata.storage.local import LocalStorage
+from findopendata.storage import compression
 from findopendata.parsers.avro import avro2json
 from findopendata.parsers.jsonl import jsonl2json
 
@@ -51,7 +52,49 @@ class TestLocalStorage(unittest.TestCase):
 
             obj = storage.get_object("test_blob")
             self.assertEqual(test_obj, obj)
+
+            copied = storage.copy("test_blob", "copied/test_blob")
+            self.assertEqual(copied.size, blob.size)
+            self.assertEqual(storage.get_object("copied/test_blob"), test_obj)
+            self.assertEqual(os.listdir(os.path.join(root, "copied")),
+                    ["test_blob"])
+
+            storage.delete("test_blob")
+            self.assertFalse(os.path.exists(os.path.join(root, "test_blob")))
+            with self.assertRaises(ValueError):
+                storage.delete("test_blob")
     
+    def test_put_and_get_compressed_object(self):
+        codecs = ["gzip"]
+        if compression.zstandard is not None:
+            codecs.append("zstd")
+        for codec in codecs:
+            with tempfile.TemporaryDirectory() as root:
+                storage = LocalStorage(root, object_compression=codec)
+                blob = storage.put_object(test_obj, "test_blob")
+                with open(os.path.join(root, "test_blob"), "rb") as f:
+                    data = f.read()
+                self.assertEqual(blob.size, len(data))
+                self.assertNotEqual(data[:1], b"{")
+                self.assertEqual(test_obj, storage.get_object("test_blob"))
+
+                # Readers without compression enabled can read it.
+                storage = LocalStorage(root)
+                self.assertEqual(test_obj, storage.get_object("test_blob"))
+
+    def test_get_uncompressed_object(self):
+        with tempfile.TemporaryDirectory() as root:
+            # Blobs written before compression was enabled.
+            with open(os.path.join(root, "test_blob"), "w") as f:
+                json.dump(test_obj, f)
+            storage = LocalStorage(root, object_compression="gzip")
+            self.assertEqual(test_obj, storage.get_object("test_blob"))
+
+    def test_unknown_object_compression(self):
+        with tempfile.TemporaryDirectory() as root:
+            with self.assertRaises(ValueError):
+                LocalStorage(root, object_compression="lz4")
+
     def test_put_and_get_file(self):
         with tempfile.TemporaryDirectory() as root:
             storage = LocalStorage(root)
@@ -0,0 +1,95 @@
+import io
+import time
+import unittest
+import gzip
+import json
+
+from findopendata.storage.memory import InMemoryStorage
+from findopendata.parsers.avro import avro2json
+from findopendata.parsers.csv import csv2json
+
+test_obj = {
+    "name" : "First name Last name",
+    "email" : "example@email.com",
+    "age" : 42,
+    "accounts": [123, 432, 2123],
+}
+
+test_file_content = """h1,h2,h3
+a,b,c
+e,f,g
+1,2,3
+"""
+
+test_avro_records = [
+    {"h1" : "a", "h2": "b", "h3": "c"},
+    {"h1" : "d", "h2": "e", "h3": "f"},
+    {"h1" : "1", "h2": "2", "h3": "3"},
+]
+
+test_avro_schema = {
+    "name": "root",
+    "type": "record",
+    "fields": [
+        {"name": "h1", "type": "string"}, 
+        {"name": "h2", "type": "string"}, 
+        {"name": "h3", "type": "string"}, 
+    ],
+}
+
+
+class TestInMemoryStorage(unittest.TestCase):
+
+    def test_put_and_get_object(self):
+        storage = InMemoryStorage(object_compression="gzip")
+        blob = storage.put_object(test_obj, "test_blob")
+        self.assertEqual(blob.name, "test_blob")
+        self.assertGreater(blob.size, 0)
+        self.assertTrue(storage.exists("test_blob"))
+        self.assertEqual(storage.get_object("test_blob"), test_obj)
+        with self.assertRaises(ValueError):
+            storage.get_object("missing_blob")
+        self.assertEqual(storage.copy("test_blob", "copied_blob").size,
+                blob.size)
+        self.assertEqual(storage.get_object("copied_blob"), test_obj)
+        storage.delete("test_blob")
+        self.assertFalse(storage.exists("test_blob"))
+        with self.assertRaises(ValueError):
+            storage.delete("test_blob")
+
+    def test_put_and_get_file(self):
+        storage = InMemoryStorage()
+        fileobj = io.BytesIO(test_file_content.encode("utf-8"))
+        blob = storage.put_file(fileobj, "test_blob")
+        self.assertEqual(blob.size, len(test_file_content))
+        self.assertEqual(storage.get_range("test_blob", 0, 8), b"h1,h2,h3")
+        with storage.get_file("test_blob") as f:
+            records = list(csv2json(f))
+        self.assertEqual(records[0], {"h1": "a", "h2": "b", "h3": "c"})
+
+    def test_put_avro(self):
+        storage = InMemoryStorage()
+        storage.put_avro(test_avro_schema, test_avro_records, "test_blob")
+        with storage.get_file("test_blob") as f:
+            records = [dict(r) for r in avro2json(f)]
+        self.assertEqual(records, test_avro_records)
+
+    def test_put_json(self):
+        storage = InMemoryStorage()
+        storage.put_json(test_avro_records, "test_blob")
+        with storage.get_file("test_blob") as f:
+            f = io.TextIOWrapper(gzip.GzipFile(fileobj=f, mode="rb"))
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records, test_avro_records)
+
+    def test_latency_and_bandwidth(self):
+        storage = InMemoryStorage(latency=0.05, bandwidth=1000)
+        start = time.perf_counter()
+        storage.put_file(io.BytesIO(b"x" * 100), "test_blob")
+        storage.get_bytes("test_blob")
+        # 2 requests with 0.05s latency and 200 bytes at 1000 bytes/s.
+        self.assertGreaterEqual(time.perf_counter() - start, 0.3)
+
+
+if __name__ == "__main__":
+    unittest.main()
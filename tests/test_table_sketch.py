@@ -0,0 +1,44 @@
+import unittest
+from collections import OrderedDict
+
+from findopendata.table_sketch import TableSketch
+
+
+class TestTableSketch(unittest.TestCase):
+
+    def test_sparse_keys(self):
+        sketch = TableSketch(minhash_size=16, hyperloglog_p=4,
+                exact_threshold=10)
+        sketch.update(OrderedDict([("a", "1"), ("b", "2")]))
+        for i in range(100):
+            # Keys that are not columns of the table are not sketched.
+            sketch.update(OrderedDict([("a", str(i)),
+                ("key{}".format(i), "x")]))
+        self.assertEqual(sketch.column_names, ["a", "b"])
+        self.assertEqual(sketch.column_sketches[0].count, 101)
+        usage = sketch.memory_usage
+        self.assertEqual(usage["columns"], 2)
+        self.assertEqual(usage["exact_columns"], 1)
+        self.assertEqual(usage["sketched_columns"], 1)
+        self.assertEqual(usage["skipped_values"], 100)
+        self.assertGreater(usage["estimated_bytes"], 0)
+
+    def test_max_columns(self):
+        sketch = TableSketch(max_columns=3, minhash_size=16, hyperloglog_p=4)
+        for i in range(10):
+            sketch.update(OrderedDict(("column{}".format(j), str(i))
+                for j in range(1000)))
+        self.assertEqual(sketch.column_names,
+                ["column0", "column1", "column2"])
+        self.assertEqual(len(sketch.column_sketches), 3)
+        self.assertEqual(sketch.memory_usage["skipped_columns"], 997)
+        restored = TableSketch.from_state(sketch.get_state())
+        restored.update(OrderedDict(("column{}".format(j), "x")
+            for j in range(1000)))
+        self.assertEqual(restored.column_names, sketch.column_names)
+        self.assertEqual(restored.column_sketches[0].count, 11)
+        self.assertEqual(restored.memory_usage["skipped_columns"], 997)
+
+
+if __name__ == "__main__":
+    unittest.main()